@@ -8,6 +8,9 @@ use Exporter;
 @EXPORT      = ();
 @EXPORT_OK   = qw(getAbundanceData expandMetanodeIds getClusterMap getMetagenomeInfo getClusterNumber expandMetanodeIdAttribute getClusterSizes);
 
+# First line of the sparse tables written by merge_shortbred.py --sparse
+my $SparseHeader = "Feature\tSample\tValue";
+
 #our ($IdentifyScript, $QuantifyScript, $ParseSSNScript);
 #
 #$IdentifyScript = "shortbred_identify.py";
@@ -54,8 +57,10 @@ sub getAbundanceData {
 
     my $abd = {metagenomes => [], proteins => {}, clusters => {}};
 
-    if (defined $protFile and -f $protFile) {
-        open PROT, $protFile or die "Unable to open protein file $protFile: $!";
+    if (defined $protFile and -f $protFile and isSparseAbundanceFile($protFile)) {
+        readSparseAbundanceFile($protFile, $abd, "proteins", $cleanId);
+    } elsif (defined $protFile and -f $protFile) {
+        openAbundanceFile(\*PROT, $protFile) or die "Unable to open protein file $protFile: $!";
 
         my $header = <PROT>;
         chomp($header);
@@ -97,8 +102,10 @@ sub getAbundanceData {
         close PROT;
     }
 
-    if (defined $clustFile and -f $clustFile) {
-        open CLUST, $clustFile or die "Unable to open cluster file $clustFile: $!";
+    if (defined $clustFile and -f $clustFile and isSparseAbundanceFile($clustFile)) {
+        readSparseAbundanceFile($clustFile, $abd, "clusters", 0);
+    } elsif (defined $clustFile and -f $clustFile) {
+        openAbundanceFile(\*CLUST, $clustFile) or die "Unable to open cluster file $clustFile: $!";
 
         my $header = <CLUST>;
         chomp($header);
@@ -125,6 +132,63 @@ sub getAbundanceData {
 }
 
 
+# Abundance tables may be gzip-compressed.
+sub openAbundanceFile {
+    my $fh = shift;
+    my $file = shift;
+
+    if ($file =~ m/\.gz$/) {
+        return open($fh, "-|", "gzip", "-dc", $file);
+    } else {
+        return open($fh, "<", $file);
+    }
+}
+
+
+sub isSparseAbundanceFile {
+    my $file = shift;
+
+    openAbundanceFile(\*TABLE, $file) or die "Unable to open abundance file $file: $!";
+    my $header = <TABLE>;
+    close TABLE;
+
+    return 0 if not defined $header;
+    chomp($header);
+    return $header eq $SparseHeader;
+}
+
+
+# Reads a table with one feature, sample and value per line, only for nonzero values.  Metagenomes are
+# added in sorted order, the same as the columns of the dense tables; ones without any values are not
+# in the file.
+sub readSparseAbundanceFile {
+    my $file = shift;
+    my $abd = shift;
+    my $type = shift;
+    my $cleanId = shift;
+
+    openAbundanceFile(\*TABLE, $file) or die "Unable to open abundance file $file: $!";
+    my $header = <TABLE>;
+
+    my %mgIds;
+    while (<TABLE>) {
+        chomp;
+        my ($feature, $mgId, $value) = split(m/\t/);
+        next if not defined $value;
+        if ($cleanId) {
+            my ($clusterNum, $tempId) = split(m/\|/, $feature);
+            $feature = $tempId if defined $tempId and $tempId =~ m/^[A-Z0-9]{6,10}$/;
+        }
+        $abd->{$type}->{$feature}->{$mgId} = $value;
+        $mgIds{$mgId} = 1;
+    }
+
+    close TABLE;
+
+    push(@{$abd->{metagenomes}}, sort keys %mgIds) if not scalar @{$abd->{metagenomes}};
+}
+
+
 # Expand metanodes into their constituent parts (e.g. expand UniRef seed sequence clusters, as well as SSN repnode networks).
 # Call this on an XML node that represents an SSN node.
 sub expandMetanodeIds {
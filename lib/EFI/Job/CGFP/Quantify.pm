@@ -107,6 +107,8 @@ sub setupDefaults {
     $conf->{real_dir} = $realDir;
     $conf->{src_dir} = $srcDir;
     $conf->{temp_dir_pat} = "$realDir/quantify-temp";
+    # Marker search databases, shared by all quantify runs on the same markers
+    $conf->{marker_db_cache} = $self->getConfigValue("cgfp", "marker_db_cache") || "$conf->{identify_real_dir}/marker_db";
     
     $conf->{metagenome_ids} = $conf->{metagenome_ids} eq "\@all" ? "*" : [split(m/,/, $conf->{metagenome_ids})];
     $conf->{metagenome_db} = $self->getConfigValue("cgfp.database", $conf->{metagenome_db});
@@ -291,7 +293,7 @@ sub getQuantifyParallel {
         my $mgFile = $conf->{mgFiles}->{$mgId};
         my $resFileMedian = $conf->{resFilesMedian}->{$mgId};
         my $resFileMean = $conf->{resFilesMean}->{$mgId};
-        $B->addAction("python $sbQuantifyApp --threads $np $searchTypeArgs --markers $conf->{sb_marker_file} --wgs $mgFile --results $resFileMedian --results-mean $resFileMean --tmp $conf->{temp_dir_pat}-$mgId");
+        $B->addAction("python $sbQuantifyApp --threads $np $searchTypeArgs --stream --markers $conf->{sb_marker_file} --dbcache $conf->{marker_db_cache} --wgs $mgFile --results $resFileMedian --results-mean $resFileMean --tmp $conf->{temp_dir_pat}-$mgId");
     }
 }
 
@@ -337,7 +339,7 @@ sub getQuantifyTasks {
             $B->addAction("    cp $conf->{sb_marker_file} $tmpMarker"); # Copy to possibly help performance out.
         }
         my $tempDir = "$conf->{temp_dir_pat}-$mgId";
-        $B->addAction("    python $sbQuantifyApp $searchTypeArgs --markers $tmpMarker --wgs $mgFile --results $resFileMedian --results-mean $resFileMean --tmp $tempDir");
+        $B->addAction("    python $sbQuantifyApp $searchTypeArgs --stream --markers $tmpMarker --catalog $conf->{sb_marker_file}.catalog --dbcache $conf->{marker_db_cache} --wgs $mgFile --results $resFileMedian --results-mean $resFileMean --tmp $tempDir");
         $B->addAction("    rm -rf $tempDir") if $removeTemp;
         $c++;
     }
@@ -369,16 +371,15 @@ sub getMergeQuantifyJob {
     $self->requestResourcesByName($B, 1, 1, "sb_merge");
     $self->addStandardEnv($B);
 
-    $B->addAction("python $localMergeApp $resFileMedianList -C $conf->{cluster_file_median} -p $conf->{protein_file_median} -c $conf->{ssn_cluster_file}");
-    $B->addAction("python $localMergeApp $resFileMedianList -C $conf->{cluster_norm_median} -p $conf->{protein_norm_median} -c $conf->{ssn_cluster_file} -n");
-    if ($conf->{ags_file_path}) {
-        $B->addAction("python $localMergeApp $resFileMedianList -C $conf->{cluster_genome_norm_median} -p $conf->{protein_genome_norm_median} -c $conf->{ssn_cluster_file} -g $conf->{ags_file_path}");
-    }
-    $B->addAction("python $localMergeApp $resFileMeanList -C $conf->{cluster_file_mean} -p $conf->{protein_file_mean} -c $conf->{ssn_cluster_file}");
-    $B->addAction("python $localMergeApp $resFileMeanList -C $conf->{cluster_norm_mean} -p $conf->{protein_norm_mean} -c $conf->{ssn_cluster_file} -n");
-    if ($conf->{ags_file_path}) {
-        $B->addAction("python $localMergeApp $resFileMeanList -C $conf->{cluster_genome_norm_mean} -p $conf->{protein_genome_norm_mean} -c $conf->{ssn_cluster_file} -g $conf->{ags_file_path}");
+    # All of the tables are written in one run, so the cluster map and each sample file are only read once.
+    my @outputs;
+    foreach my $stat ("median", "mean") {
+        push @outputs, join(" ", "--output $stat raw", $conf->{"protein_file_$stat"}, $conf->{"cluster_file_$stat"});
+        push @outputs, join(" ", "--output $stat sum", $conf->{"protein_norm_$stat"}, $conf->{"cluster_norm_$stat"});
+        push @outputs, join(" ", "--output $stat genome", $conf->{"protein_genome_norm_$stat"}, $conf->{"cluster_genome_norm_$stat"}) if $conf->{ags_file_path};
     }
+    my $agsArg = $conf->{ags_file_path} ? "-g $conf->{ags_file_path}" : "";
+    $B->addAction("python $localMergeApp -c $conf->{ssn_cluster_file} --median-files $resFileMedianList --mean-files $resFileMeanList $agsArg " . join(" ", @outputs));
 
     if ($self->getRemoveTemp()) {
         $B->addAction("rm $resFileMedianList");
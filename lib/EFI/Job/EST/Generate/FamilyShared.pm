@@ -556,15 +556,37 @@ sub getGraphJob {
         $B->addAction("$toolPath/create_graphs_html_table.pl --results-dir $resultsDir --html-file $resultsDir/graphs.html $unirefArg");
     } else {
         map { $B->addAction($_); } $self->getEnvironment("est-graphs-v2");
-        $B->addAction("$toolPath/make_hdf5_graph_data.py -b $outputDir/1.out -f $outputDir/rdata.hdf5 -a $conf->{all_seq_file} -i $conf->{inc_frac}");
+        # The same length histograms as the v1 graphs, all written to rdata.hdf5 in one run.
+        my %lenSources = (uniprot => {title => "", file => $conf->{len_uniprot_file}, png => "length_histogram_uniprot"});
+        $lenSources{uniprot}->{title} = "UniProt, Full Length" if $unirefVersion or $domain eq "on";
+        $lenSources{uniprot_domain} = {title => "UniProt, Domain", file => $conf->{len_uniprot_dom_file}, png => "length_histogram_uniprot_domain"} if $domain eq "on";
+        $lenSources{uniref} = {title => "UniRef$unirefVersion Cluster IDs, Full Length", file => $conf->{len_uniref_file}, png => "length_histogram_uniref"} if $unirefVersion;
+        $lenSources{uniref_domain} = {title => "UniRef$unirefVersion Cluster IDs, Domain", file => $conf->{len_uniref_dom_file}, png => "length_histogram_uniref_domain"} if $unirefVersion and $domain eq "on";
+        my $lenArgs = join(" ", map { "-n $_=$lenSources{$_}->{file}" } sort keys %lenSources);
+        $lenArgs .= join("", map { " --length-title \"$_=$lenSources{$_}->{title}\"" } grep { $lenSources{$_}->{title} } sort keys %lenSources);
+        # The graphs are drawn by make_hdf5_graph_data.py when matplotlib is available; the R
+        # scripts only run when it left them out.
+        $B->addAction("$toolPath/make_hdf5_graph_data.py -b $outputDir/1.out -f $outputDir/rdata.hdf5 -a $conf->{all_seq_file} -i $conf->{inc_frac} $lenArgs --png-dir $resultsDir --job-id $jobId");
+        $B->addAction("if [ ! -f $resultsDir/number_of_edges_sm.png ]; then");
         $B->addAction("Rscript $toolPath/R/quart-align.r hdf5 $outputDir/rdata.hdf5 $resultsDir/alignment_length.png $jobId");
         $B->addAction("Rscript $toolPath/R/quart-align.r hdf5 $outputDir/rdata.hdf5 $resultsDir/alignment_length_sm.png $jobId $smallWidth $smallHeight");
         $B->addAction("Rscript $toolPath/R/quart-perid.r hdf5 $outputDir/rdata.hdf5 $resultsDir/percent_identity.png $jobId");
         $B->addAction("Rscript $toolPath/R/quart-perid.r hdf5 $outputDir/rdata.hdf5 $resultsDir/percent_identity_sm.png $jobId $smallWidth $smallHeight");
-        $B->addAction("Rscript $toolPath/R/hist-length.r hdf5 $outputDir/rdata.hdf5 $resultsDir/length_histogram.png $jobId");
-        $B->addAction("Rscript $toolPath/R/hist-length.r hdf5 $outputDir/rdata.hdf5 $resultsDir/length_histogram_sm.png $jobId $smallWidth $smallHeight");
+        $B->addAction("Rscript $toolPath/R/hist-length.r hdf5 $outputDir/rdata.hdf5 $resultsDir/length_histogram.png $jobId \"\" 1800 900 sequences");
+        $B->addAction("Rscript $toolPath/R/hist-length.r hdf5 $outputDir/rdata.hdf5 $resultsDir/length_histogram_sm.png $jobId \"\" $smallWidth $smallHeight sequences");
+        foreach my $name (sort keys %lenSources) {
+            my $title = $lenSources{$name}->{title} ? "\"(" . $lenSources{$name}->{title} . ")\"" : "\"\"";
+            # make_hdf5_graph_data.py skips length sources that do not exist, so there is no histogram to draw.
+            $B->addAction("if [ -e $lenSources{$name}->{file} ]; then");
+            $B->addAction("Rscript $toolPath/R/hist-length.r hdf5 $outputDir/rdata.hdf5 $resultsDir/$lenSources{$name}->{png}.png $jobId $title 1800 900 $name");
+            $B->addAction("Rscript $toolPath/R/hist-length.r hdf5 $outputDir/rdata.hdf5 $resultsDir/$lenSources{$name}->{png}_sm.png $jobId $title $smallWidth $smallHeight $name");
+            $B->addAction("fi");
+        }
         $B->addAction("Rscript $toolPath/R/hist-edges.r hdf5 $outputDir/rdata.hdf5 $resultsDir/number_of_edges.png $jobId");
         $B->addAction("Rscript $toolPath/R/hist-edges.r hdf5 $outputDir/rdata.hdf5 $resultsDir/number_of_edges_sm.png $jobId $smallWidth $smallHeight");
+        $B->addAction("fi");
+        my $unirefArg = $unirefVersion ? "--uniref-version $unirefVersion" : "";
+        $B->addAction("$toolPath/create_graphs_html_table.pl --results-dir $resultsDir --html-file $resultsDir/graphs.html $unirefArg");
     }
     $B->addAction("touch  $flagFile");
 
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import json
+import math
+import os
+import platform
+import shlex
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+#the graph data script this harness measures
+SCRIPT=os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sbin', 'make_hdf5_graph_data.py'))
+
+#edges per synthetic 1.out when --sizes is not given
+DEFAULT_SIZES=['1M', '10M', '100M']
+
+#edges generated and written per block
+BLOCK_EDGES=1000000
+
+AMINO_ACIDS=np.frombuffer(b'ACDEFGHIKLMNPQRSTVWY', dtype=np.uint8)
+
+
+def edge_count(value):
+  """ argparse type for edge counts such as 250000, 500K or 10M """
+  scale={'K': 10**3, 'M': 10**6, 'G': 10**9}.get(value[-1:].upper(), 1)
+  try:
+    count=int(float(value[:-1] if scale>1 else value)*scale)
+  except ValueError:
+    raise argparse.ArgumentTypeError("expected an edge count such as 1M, got %s" % value)
+  if count<1:
+    raise argparse.ArgumentTypeError("edge count must be positive, got %s" % value)
+  return count
+
+
+def get_args():
+  parser=argparse.ArgumentParser(description='time make_hdf5_graph_data.py on synthetic 1.out and fasta files and write the results as json')
+  parser.add_argument('-s','--sizes',dest='sizes',help='numbers of edges of the synthetic 1.out files (default %s)' % ' '.join(DEFAULT_SIZES), type=edge_count, nargs='+', default=[edge_count(size) for size in DEFAULT_SIZES])
+  parser.add_argument('-d','--work-dir',dest='workdir',help='directory for the synthetic inputs, which are kept and reused by later runs with the same size and seed, and for the outputs', default='hdf5_graph_benchmark')
+  parser.add_argument('-o','--output',dest='output',help='json file for the results, - for stdout', default='-')
+  parser.add_argument('-c','--config',dest='configs',help='NAME=ARGS extra make_hdf5_graph_data.py arguments to measure, e.g. "summary=--summary -w 4"; may be repeated (default: no extra arguments)', action='append', default=[])
+  parser.add_argument('-r','--repeat',dest='repeat',help='number of runs of each size and configuration', default=1, type=int)
+  parser.add_argument('--seed',dest='seed',help='random seed of the synthetic inputs', default=1, type=int)
+  parser.add_argument('--python',dest='python',help='python interpreter used to run make_hdf5_graph_data.py', default=sys.executable)
+  parser.add_argument('--script',dest='script',help='make_hdf5_graph_data.py to measure (default: the one in this tree)', default=SCRIPT)
+  args=parser.parse_args()
+  configs=[]
+  for config in args.configs or ['default=']:
+    name, sep, extra=config.partition('=')
+    if not sep or not name:
+      parser.error("expected NAME=ARGS for --config, got %s" % config)
+    configs.append((name, shlex.split(extra)))
+  args.configs=configs
+  return args
+
+
+#-------------------------------------------------------------------------------
+# synthetic inputs
+#-------------------------------------------------------------------------------
+def sequence_lengths(rng, count):
+  """ lengths of a protein family: most sequences around one domain length, some multidomain ones twice as long """
+  lengths=rng.lognormal(math.log(330), 0.25, count)
+  multi=rng.random_sample(count)<0.1
+  lengths[multi]=rng.lognormal(math.log(650), 0.35, multi.sum())
+  return np.clip(lengths, 40, 5000).astype(np.int64)
+
+
+def write_fasta(path, rng, lengths):
+  """ random sequences of the given lengths, 60 residues per line """
+  with open(path, 'wb') as out:
+    for index, length in enumerate(lengths):
+      residues=AMINO_ACIDS[rng.randint(0, len(AMINO_ACIDS), length)].tobytes()
+      out.write(b'>A0A%07d\n' % index)
+      out.write(b'\n'.join(residues[pos:pos+60] for pos in range(0, length, 60)))
+      out.write(b'\n')
+
+
+def edge_block(rng, lengths, count):
+  """ 1.out lines for count edges between random sequences
+
+  Percent identity is skewed towards the 25-45% typical of a family all by
+  all blast, alignments cover most of the shorter sequence and the bitscore
+  follows from both, so the alignment scores rise with identity the way
+  they do in real jobs.
+  """
+  query=np.sort(rng.randint(0, len(lengths), count))
+  subject=rng.randint(0, len(lengths), count)
+  qlen=lengths[query]
+  slen=lengths[subject]
+  perid=20+80*rng.beta(1.6, 4.0, count)
+  align=np.maximum(20, (np.minimum(qlen, slen)*rng.uniform(0.5, 1.0, count)).astype(np.int64))
+  bits=np.maximum(25, align*(perid/100*2.1-0.25)*rng.normal(1.0, 0.05, count))
+  lines=['A0A%07d\tA0A%07d\t%.2f\t%d\t%.1f\t%d\t%d\n' % row for row in
+    zip(query.tolist(), subject.tolist(), perid.tolist(), align.tolist(), bits.tolist(), qlen.tolist(), slen.tolist())]
+  return ''.join(lines)
+
+
+def make_inputs(workDir, edges, seed):
+  """ write (or reuse) the 1.out and fasta files with the given number of edges, returning their paths """
+  dataDir=os.path.join(workDir, 'data_%s_%s' % (edges, seed))
+  blastPath=os.path.join(dataDir, '1.out')
+  fastaPath=os.path.join(dataDir, 'allsequences.fa')
+  if os.path.exists(os.path.join(dataDir, 'complete')):
+    return blastPath, fastaPath
+  if not os.path.isdir(dataDir):
+    os.makedirs(dataDir)
+  print("generating %s edges in %s" % (edges, dataDir), file=sys.stderr)
+  rng=np.random.RandomState(seed)
+  #enough sequences for the edges to be a sparse part of the all by all pairs
+  lengths=sequence_lengths(rng, max(1000, int(math.sqrt(edges)*4)))
+  write_fasta(fastaPath, rng, lengths)
+  with open(blastPath, 'w') as out:
+    for first in range(0, edges, BLOCK_EDGES):
+      out.write(edge_block(rng, lengths, min(BLOCK_EDGES, edges-first)))
+  open(os.path.join(dataDir, 'complete'), 'w').close()
+  return blastPath, fastaPath
+
+
+#-------------------------------------------------------------------------------
+# runs
+#-------------------------------------------------------------------------------
+def git_commit(path):
+  try:
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(path))).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def exit_code(status):
+  """ the exit code in a wait status, or minus the signal that ended the process, as subprocess reports it """
+  if hasattr(os, 'waitstatus_to_exitcode'):
+    return os.waitstatus_to_exitcode(status)
+  #python before 3.9
+  if os.WIFSIGNALED(status):
+    return -os.WTERMSIG(status)
+  return os.WEXITSTATUS(status)
+
+
+def run_once(args, blastPath, fastaPath, outDir, extra):
+  """ run make_hdf5_graph_data.py once and return its phase timings, peak memory use and output size """
+  hdfPath=os.path.join(outDir, 'rdata.hdf5')
+  timingsPath=os.path.join(outDir, 'timings.json')
+  command=[args.python, args.script, '-f', hdfPath, '-b', blastPath, '-a', fastaPath, '--no-length-cache', '--timings', timingsPath]+extra
+  with open(os.path.join(outDir, 'log.txt'), 'w') as log:
+    started=time.time()
+    proc=subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+    #wait4 gives the peak memory of this run alone, including the --workers processes
+    pid, status, usage=os.wait4(proc.pid, 0)
+    proc.returncode=exit_code(status)
+    elapsed=time.time()-started
+  if proc.returncode!=0:
+    raise RuntimeError("%s exited with status %s, see %s" % (' '.join(command), proc.returncode, os.path.join(outDir, 'log.txt')))
+  with open(timingsPath) as timings:
+    result=json.load(timings)
+  result['wall']=elapsed
+  result['peak_rss_mb']=usage.ru_maxrss/1024.0
+  result['command']=command
+  return result
+
+
+def main():
+  args=get_args()
+  results={'script': os.path.abspath(args.script),
+    'commit': git_commit(args.script),
+    'host': platform.node(),
+    'python': subprocess.check_output([args.python, '--version'], stderr=subprocess.STDOUT).decode().strip(),
+    'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'seed': args.seed,
+    'runs': []}
+  for edges in args.sizes:
+    blastPath, fastaPath=make_inputs(args.workdir, edges, args.seed)
+    for name, extra in args.configs:
+      for repeat in range(args.repeat):
+        outDir=os.path.join(args.workdir, 'run_%s_%s_%s' % (edges, name, repeat))
+        if not os.path.isdir(outDir):
+          os.makedirs(outDir)
+        print("running %s with %s edges (%s of %s)" % (name, edges, repeat+1, args.repeat), file=sys.stderr)
+        result=run_once(args, blastPath, fastaPath, outDir, extra)
+        result.update({'edges': edges, 'config': name, 'repeat': repeat,
+          'input_bytes': os.path.getsize(blastPath)+os.path.getsize(fastaPath)})
+        results['runs'].append(result)
+        os.remove(os.path.join(outDir, 'rdata.hdf5'))
+
+  if args.output=='-':
+    json.dump(results, sys.stdout, indent=2)
+    print()
+  else:
+    with open(args.output, 'w') as out:
+      json.dump(results, out, indent=2)
+
+
+if __name__ == "__main__":
+  main()
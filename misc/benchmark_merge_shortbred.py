@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+
+"""
+benchmark_merge_shortbred.py
+============================
+Generates synthetic ShortBRED quantify results, a cgfp-clusters map and a
+genome size file, then runs each phase of the CGFP merge step
+(sbin/efi_cgfp/merge_shortbred.py) under cProfile and writes the time,
+throughput, memory use and hottest functions of every phase as JSON.
+
+Memory is traced with tracemalloc (Python 3.9+ for per-phase peaks), which
+counts the allocations of Python and numpy, and slows allocation-heavy
+phases down a little more than cProfile alone.
+
+  ./benchmark_merge_shortbred.py --samples 500 --families 200 -o merge.json
+"""
+
+from __future__ import print_function # PYTHON 2.7+ REQUIRED
+import os
+import sys
+import argparse
+import cProfile
+import json
+import platform
+import pstats
+import random
+import resource
+import subprocess
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+#-------------------------------------------------------------------------------
+# constants
+#-------------------------------------------------------------------------------
+
+c_script = os.path.normpath( os.path.join( os.path.dirname( os.path.abspath( __file__ ) ),
+                                           "..", "sbin", "efi_cgfp", "merge_shortbred.py" ) )
+c_header = "Family\tCount\tHits\tTotMarkerLength"
+
+#-------------------------------------------------------------------------------
+# arguments
+#-------------------------------------------------------------------------------
+
+def get_args( ):
+    """ master argument parser """
+    parser = argparse.ArgumentParser(
+        description="Time the phases of merge_shortbred.py on synthetic ShortBRED results",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument( "-s", "--samples", type=int, default=100, metavar="<int>",
+        help="Number of metagenome samples (default 100)" )
+    parser.add_argument( "-f", "--families", type=int, default=100, metavar="<int>",
+        help="Number of SSN clusters (default 100)" )
+    parser.add_argument( "--proteins-per-family", type=int, default=50, metavar="<int>",
+        help="Mean number of marker proteins per cluster (default 50)" )
+    parser.add_argument( "--sparsity", type=float, default=0.95, metavar="<float>",
+        help="Fraction of protein-sample pairs with no hits (default 0.95)" )
+    parser.add_argument( "--seed", type=int, default=1, metavar="<int>",
+        help="Random seed of the synthetic data (default 1)" )
+    parser.add_argument( "-d", "--work-dir", type=str, default="merge_shortbred_benchmark", metavar="<dir>",
+        help="Directory for the synthetic inputs, kept and reused by runs with the same\n"
+             "parameters, and for the merged tables" )
+    parser.add_argument( "-b", "--backend", type=str, nargs="+", default=["matrix", "dict"], metavar="<name>",
+        help="merge_shortbred.py backends to measure (default matrix dict)" )
+    parser.add_argument( "--workers", type=int, default=1, metavar="<int>",
+        help="Processes reading the sample files in the load phase (default 1)" )
+    parser.add_argument( "--top", type=int, default=10, metavar="<int>",
+        help="Number of functions listed per phase, by cumulative time (default 10)" )
+    parser.add_argument( "--profile-dir", type=str, default=None, metavar="<dir>",
+        help="Also save the cProfile stats of each phase here, for pstats or snakeviz" )
+    parser.add_argument( "--script", type=str, default=c_script, metavar="<path>",
+        help="merge_shortbred.py to measure (default: the one in this tree)" )
+    parser.add_argument( "-o", "--output", type=str, default="-", metavar="<path>",
+        help="JSON results file, - for stdout (default)" )
+    return parser.parse_args( )
+
+def load_script( path ):
+    """ import merge_shortbred.py as a module from its path """
+    try:
+        import importlib.util
+    except ImportError:
+        import imp
+        return imp.load_source( "merge_shortbred", path )
+    spec = importlib.util.spec_from_file_location( "merge_shortbred", path )
+    module = importlib.util.module_from_spec( spec )
+    # registered first so the --workers processes can pickle its functions
+    sys.modules[spec.name] = module
+    spec.loader.exec_module( module )
+    return module
+
+#-------------------------------------------------------------------------------
+# synthetic inputs
+#-------------------------------------------------------------------------------
+
+def make_inputs( args ):
+    """ write (or reuse) the sample files, cluster map and genome sizes; return their paths """
+    folder = os.path.join( args.work_dir, "data_%d_%d_%d_%g_%d" % (
+        args.samples, args.families, args.proteins_per_family, args.sparsity, args.seed ) )
+    sample_dir = os.path.join( folder, "samples" )
+    paths = [os.path.join( sample_dir, "SRS%06d.txt" % i ) for i in range( args.samples )]
+    clusters_file = os.path.join( folder, "cgfp-clusters.txt" )
+    sizes_file = os.path.join( folder, "ags.txt" )
+    if os.path.exists( os.path.join( folder, "complete" ) ):
+        return paths, clusters_file, sizes_file
+    if not os.path.isdir( sample_dir ):
+        os.makedirs( sample_dir )
+    print( "generating %d samples in %s" % ( args.samples, folder ), file=sys.stderr )
+    rng = random.Random( args.seed )
+    # cluster sizes are skewed: a few large families and many small ones
+    proteins = []
+    with open( clusters_file, "w" ) as fh:
+        for cluster in range( 1, args.families + 1 ):
+            size = max( 1, int( rng.expovariate( 1.0 / args.proteins_per_family ) ) )
+            for i in range( size ):
+                acc = "A0A%07d" % len( proteins )
+                proteins.append( acc )
+                print( "%d\t%s" % ( cluster, acc ), file=fh )
+    # markers that were not in the map end up in the #N/A cluster
+    proteins.extend( "Q%05d" % i for i in range( max( 1, len( proteins ) // 50 ) ) )
+    # shortbred lists every marker family in each sample, most of them with no hits
+    names = [p if rng.random( ) < 0.8 else "tr|%s|%s_BACT" % ( p, p[-5:] ) for p in proteins]
+    lengths = [rng.randint( 30, 1500 ) for p in proteins]
+    for path in paths:
+        lines = [c_header]
+        for name, length in zip( names, lengths ):
+            if rng.random( ) < args.sparsity:
+                lines.append( "%s\t0.0\t0\t%d" % ( name, length ) )
+            else:
+                hits = int( rng.lognormvariate( 2, 1.5 ) ) + 1
+                # RPKM-like units
+                lines.append( "%s\t%r\t%d\t%d" % ( name, hits * 1e9 / ( length * 3 * 2e7 ), hits, length ) )
+        with open( path, "w" ) as fh:
+            fh.write( "\n".join( lines ) + "\n" )
+    # a few samples have no genome size and get the default
+    with open( sizes_file, "w" ) as fh:
+        for path in paths:
+            if rng.random( ) < 0.95:
+                name = os.path.split( path )[1].split( "." )[0]
+                print( "%s\t%d" % ( name, rng.uniform( 2e6, 8e6 ) ), file=fh )
+    open( os.path.join( folder, "complete" ), "w" ).close( )
+    return paths, clusters_file, sizes_file
+
+#-------------------------------------------------------------------------------
+# phases
+#-------------------------------------------------------------------------------
+
+def peak_rss_mb( ):
+    """ high-water mark of the whole process so far, which never goes down """
+    return resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss / 1024.0
+
+def traced_mb( ):
+    """ current and peak traced memory, or Nones when tracemalloc cannot reset the peak per phase """
+    if tracemalloc is None or not hasattr( tracemalloc, "reset_peak" ):
+        return None, None
+    current, peak = tracemalloc.get_traced_memory( )
+    return current / 1048576.0, peak / 1048576.0
+
+def entries( dd ):
+    """ number of protein-sample values held by either backend """
+    if hasattr( dd, "values" ) and not isinstance( dd, dict ):
+        return len( dd.values )
+    return sum( len( sdict ) for sdict in dd.values( ) )
+
+class PhaseProfiler( object ):
+    """ runs phases under cProfile, recording time, memory and the hottest functions of each """
+
+    def __init__( self, args, label ):
+        self.args = args
+        self.label = label
+        self.phases = []
+
+    def run( self, name, func, *fargs ):
+        profile = cProfile.Profile( )
+        if tracemalloc is not None and hasattr( tracemalloc, "reset_peak" ):
+            tracemalloc.reset_peak( )
+        before, _ = traced_mb( )
+        started = time.time( )
+        profile.enable( )
+        result = func( *fargs )
+        profile.disable( )
+        elapsed = time.time( ) - started
+        after, peak = traced_mb( )
+        stats = pstats.Stats( profile )
+        if self.args.profile_dir is not None:
+            stats.dump_stats( os.path.join( self.args.profile_dir, "%s.%s.prof" % ( self.label, name ) ) )
+        top = sorted( stats.stats.items( ), key=lambda item: -item[1][3] )[:self.args.top]
+        self.phases.append( {
+            "phase": name,
+            "seconds": elapsed,
+            # the most memory held at once during the phase, and what the phase left allocated
+            "peak_mb": peak,
+            "retained_mb": None if after is None else after - before,
+            "functions": [{"function": "%s:%d(%s)" % func_id, "calls": s[1], "tottime": s[2], "cumtime": s[3]}
+                          for func_id, s in top],
+        } )
+        return result
+
+    def throughput( self, name, count, unit ):
+        phase = [p for p in self.phases if p["phase"] == name][0]
+        phase[unit] = count
+        phase[unit + "_per_second"] = count / phase["seconds"] if phase["seconds"] > 0 else None
+
+def run_backend( args, merge, backend, paths, clusters_file, sizes_file ):
+    """ one merge with -g and -n through every phase of the given backend """
+    out_dir = os.path.join( args.work_dir, "out_" + backend )
+    if not os.path.isdir( out_dir ):
+        os.makedirs( out_dir )
+    cmap = merge.read_dict( merge.try_open( clusters_file ), kdex=1, vdex=0, dialect="excel-tab" )
+    sizes = merge.read_dict( merge.try_open( sizes_file ), func=float, dialect="excel-tab" )
+    prof = PhaseProfiler( args, backend )
+    samples = prof.run( "load", lambda: list( merge.read_samples( paths, args.workers ) ) )
+    prof.throughput( "load", len( paths ), "files" )
+    prof.throughput( "load", sum( os.path.getsize( p ) for p in paths ), "bytes" )
+    if backend == "matrix":
+        dd = prof.run( "relabel", merge.SampleMatrix.from_samples, samples, cmap )
+        normalize = lambda dd: dd.genome_size_normalize( sizes ).sum_normalize( )
+        write = lambda dd, path: dd.write( path )
+        collapse = lambda dd: dd.collapse_clusters( )
+    else:
+        dd = prof.run( "relabel", merge.relabel_samples, samples, cmap )
+        normalize = lambda dd: merge.sum_normalize( merge.genome_size_normalize( dd, sizes ) )
+        write = merge.write_nested_dict
+        collapse = merge.collapse_clusters
+    del samples
+    values = entries( dd )
+    prof.throughput( "relabel", values, "values" )
+    # the missing genome size messages would swamp the report
+    stderr, sys.stderr = sys.stderr, open( os.devnull, "w" )
+    try:
+        dd = prof.run( "normalize", normalize, dd )
+    finally:
+        sys.stderr = stderr
+    prof.throughput( "normalize", values, "values" )
+    prof.run( "write_proteins", write, dd, os.path.join( out_dir, "protein_abundance.txt" ) )
+    prof.throughput( "write_proteins", values, "values" )
+    cdd = prof.run( "collapse", collapse, dd )
+    prof.throughput( "collapse", values, "values" )
+    prof.run( "write_clusters", write, cdd, os.path.join( out_dir, "cluster_abundance.txt" ) )
+    prof.throughput( "write_clusters", entries( cdd ), "values" )
+    peaks = [p["peak_mb"] for p in prof.phases if p["peak_mb"] is not None]
+    return {"backend": backend, "values": values, "phases": prof.phases,
+            "total_seconds": sum( p["seconds"] for p in prof.phases ),
+            "peak_mb": max( peaks ) if peaks else None}
+
+def git_commit( path ):
+    try:
+        return subprocess.check_output( ["git", "rev-parse", "HEAD"],
+                                        cwd=os.path.dirname( os.path.abspath( path ) ) ).decode( ).strip( )
+    except ( OSError, subprocess.CalledProcessError ):
+        return None
+
+#-------------------------------------------------------------------------------
+# main
+#-------------------------------------------------------------------------------
+
+def main( ):
+    args = get_args( )
+    merge = load_script( args.script )
+    if args.profile_dir is not None and not os.path.isdir( args.profile_dir ):
+        os.makedirs( args.profile_dir )
+    paths, clusters_file, sizes_file = make_inputs( args )
+    if tracemalloc is None or not hasattr( tracemalloc, "reset_peak" ):
+        print( "tracemalloc cannot reset its peak in this python, memory use is not reported", file=sys.stderr )
+    else:
+        tracemalloc.start( )
+    results = {
+        "script": os.path.abspath( args.script ),
+        "commit": git_commit( args.script ),
+        "host": platform.node( ),
+        "python": platform.python_version( ),
+        "started": time.strftime( "%Y-%m-%dT%H:%M:%S" ),
+        "samples": args.samples,
+        "families": args.families,
+        "proteins_per_family": args.proteins_per_family,
+        "sparsity": args.sparsity,
+        "seed": args.seed,
+        "workers": args.workers,
+        "runs": [],
+    }
+    for backend in args.backend:
+        if backend == "matrix" and merge.np is None:
+            print( "numpy is not available, skipping the matrix backend", file=sys.stderr )
+            continue
+        print( "running the %s backend" % ( backend ), file=sys.stderr )
+        results["runs"].append( run_backend( args, merge, backend, paths, clusters_file, sizes_file ) )
+    # for the whole run only: the backends share this process
+    results["process_peak_rss_mb"] = peak_rss_mb( )
+    if args.output == "-":
+        json.dump( results, sys.stdout, indent=2 )
+        print( )
+    else:
+        with open( args.output, "w" ) as fh:
+            json.dump( results, fh, indent=2 )
+
+if __name__ == "__main__":
+    main( )
@@ -12,10 +12,20 @@ stop = 0
 
 if (type == "hdf5") {
     library("rhdf5")
-    plot_data = h5read(data_file,"/lenhisto")
-    start <- h5read(data_file,"/stats/lenstart")
-    stop <- h5read(data_file,"/stats/lenstop")
-    maxy <- h5read(data_file,"/stats/lenmax")
+    # Files written with make_hdf5_graph_data.py --length have one /lenhisto/<name> group per
+    # length source; the name of the source to plot is given after the image height.
+    if (length(args) > 7) {
+        group = paste0("/lenhisto/", args[8])
+        plot_data = h5read(data_file, paste0(group, "/counts"))
+        start <- h5read(data_file, paste0(group, "/start"))
+        stop <- h5read(data_file, paste0(group, "/stop"))
+        maxy <- h5read(data_file, paste0(group, "/max"))
+    } else {
+        plot_data = h5read(data_file,"/lenhisto")
+        start <- h5read(data_file,"/stats/lenstart")
+        stop <- h5read(data_file,"/stats/lenstop")
+        maxy <- h5read(data_file,"/stats/lenmax")
+    }
 
     start = start[1][1]
     stop = stop[1][1]
@@ -11,9 +11,22 @@ data_dir = ""
 start = 0
 stop = 0
 a_scores = vector()
+summary_stats = NULL
+offsets = NULL
 
 if (type == "hdf5") {
     library("rhdf5")
+    # Files written with make_hdf5_graph_data.py --summary have precomputed box plot
+    # statistics, one column per alignment score from start to stop.
+    if ("summary" %in% h5ls(data_file, recursive = FALSE)$name) {
+        summary_stats <- h5read(data_file, "/summary/perid")
+    }
+    # Version 2 files keep all the values in one array; the values for the i-th alignment
+    # score from start are at offsets[i]:offsets[i+1] (zero-based, end exclusive).
+    version = h5readAttributes(data_file, "/")$version
+    if (!is.null(version) && version >= 2) {
+        offsets <- h5read(data_file, "/offsets")
+    }
     start <- h5read(data_file,"/stats/start")
     stop <- h5read(data_file,"/stats/stop")
 
@@ -86,32 +99,57 @@ if (im_height < 500) {
     y_minor_interval <- 2
 }
 
-for (i in bars_to_use) {
-    key = i
-    if (type == "hdf5") {
-        newdata=t(h5read(data_file,paste0("/perid/",key)))
-    } else {
-        idx = i - start + 1
-        full_path=paste(data_dir,"/",data_files[idx],sep='')
-        if (!file.exists(full_path)) {
-            newdata = vector()
+if (!is.null(summary_stats)) {
+    # Rows are min, lower hinge, median, upper hinge, max, whisker ends and count; the
+    # first five are what boxplot(range = 0) draws, so all the boxes are drawn at once.
+    keys = seq(start, length.out = ncol(summary_stats))
+    use = keys %in% bars_to_use & summary_stats[8,] > 0
+    if (any(use)) {
+        bxp(list(stats = summary_stats[1:5, use, drop = FALSE], n = summary_stats[8, use], names = rep("", sum(use))),
+            boxfill = "red",
+            border = "blue",
+            whiskcol = whisk_color,
+            staplecol = whisk_color,
+            add = TRUE,
+            axes = FALSE,
+            at = keys[use])
+    }
+} else {
+    for (i in bars_to_use) {
+        key = i
+        if (type == "hdf5") {
+            if (is.null(offsets)) {
+                newdata = t(h5read(data_file,paste0("/perid/",key)))
+            } else {
+                idx = key - start + 1
+                newdata = vector()
+                if (idx >= 1 && idx < length(offsets) && offsets[idx+1] > offsets[idx]) {
+                    newdata = h5read(data_file, "/perid/values", start = offsets[idx] + 1, count = offsets[idx+1] - offsets[idx])
+                }
+            }
         } else {
-            newdata = read.table(full_path, header=TRUE, sep="\t", check.names = FALSE)
+            idx = i - start + 1
+            full_path=paste(data_dir,"/",data_files[idx],sep='')
+            if (!file.exists(full_path)) {
+                newdata = vector()
+            } else {
+                newdata = read.table(full_path, header=TRUE, sep="\t", check.names = FALSE)
+            }
         }
+        if (length(newdata) == 0) next
+        boxplot(newdata,
+                col = "red", 
+                border = "blue", 
+                whiskcol = whisk_color, 
+                staplecol = whisk_color,
+                add = TRUE, 
+                axes = FALSE,
+                at = key, 
+                range = 0, 
+                frame=F)
+        rm(newdata)
+        gc()
     }
-    if (length(newdata) == 0) next
-    boxplot(newdata,
-            col = "red", 
-            border = "blue", 
-            whiskcol = whisk_color, 
-            staplecol = whisk_color,
-            add = TRUE, 
-            axes = FALSE,
-            at = key, 
-            range = 0, 
-            frame=F)
-    rm(newdata)
-    gc()
 }
 
 axis(side = 2, at = y_label_range)
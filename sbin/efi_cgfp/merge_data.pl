@@ -7,8 +7,8 @@ use Getopt::Long;
 use FindBin;
 use Scalar::Util qw(looks_like_number);
 
-use lib $FindBin::Bin . "/lib";
-use ShortBRED qw(getAbundanceData getClusterSize);
+use lib $FindBin::Bin . "/../../lib";
+use EFI::CGFP::Util qw(getAbundanceData getClusterSizes);
 
 
 my ($proteinMerged, $clusterMerged, $proteinName, $clusterName, $inputDir, $qDirPattern, $qDirInclude, $clusterListFile);
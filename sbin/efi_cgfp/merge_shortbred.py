@@ -33,9 +33,21 @@ from __future__ import print_function # PYTHON 2.7+ REQUIRED
 import os
 import sys
 import argparse
+import multiprocessing
 import csv
+import gzip
 import re
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
 #-------------------------------------------------------------------------------
 # description
 #-------------------------------------------------------------------------------
@@ -53,6 +65,38 @@ BASIC OPERATION:
 
   ./merge_shortbred.py sample1.txt sample2.txt ... sampleN.txt --clusters-file cgfp-clusters.txt
 
+  All the tables of a quantify job can be written in one run, loading the 
+  cluster map and every sample once:
+
+  ./merge_shortbred.py --clusters-file cgfp-clusters.txt \
+      --median-files s1.median.txt ... sN.median.txt \
+      --mean-files s1.mean.txt ... sN.mean.txt \
+      --genome-size-normalize ags.txt \
+      --output median raw protein_abundance_median.txt cluster_abundance_median.txt \
+      --output median sum protein_abundance_median_norm.txt cluster_abundance_median_norm.txt \
+      --output median genome protein_abundance_median_genome_norm.txt cluster_abundance_median_genome_norm.txt \
+      --output mean raw ...
+
+  With --store <dir>, the abundances are also kept in <dir> (one NumPy 
+  archive per file list) and the files given on the command line are 
+  added to what is already there, so samples can be added to a job 
+  without reading the earlier ones again. The tables always cover every 
+  sample in the store.
+
+  With --sparse, each table is also written in long format next to the 
+  dense one (protein-abundance.sparse.txt for protein-abundance.txt, with 
+  .gz added for --sparse gz): a "Feature<tab>Sample<tab>Value" header and 
+  one line per nonzero value, in the row and column order of the dense 
+  table. Samples without any nonzero value do not appear.
+
+  With --hdf5, each table is also written unformatted to an HDF5 file next 
+  to it (protein-abundance.h5 for protein-abundance.txt): "values" is the 
+  features x samples matrix of doubles and "features" and "samples" name 
+  its rows and columns, in the order of the text table. "values" is stored 
+  contiguously, so it can be memory-mapped with 
+  numpy.memmap( path, dtype="<f8", mode="r", shape=dset.shape, 
+  offset=dset.id.get_offset( ) ) for constant time lookups.
+
 ARGUMENTS:
 """
 
@@ -64,6 +108,12 @@ c_na = "#N/A"
 c_epsilon = 1e-20
 c_default_genome_size = 5e6
 c_delim = "|"
+c_stats = ["median", "mean"]
+c_norms = ["raw", "sum", "genome"]
+c_backends = ["dict", "matrix"]
+c_block_rows = 1000
+c_store_version = 1
+c_sparse_header = "Feature\tSample\tValue"
 
 #-------------------------------------------------------------------------------
 # arguments
@@ -79,7 +129,7 @@ def get_args( ):
         "shortbred_outputs",
         type=str,
         metavar="<path(s) to shortbred outputs>",
-        nargs="+",
+        nargs="*",
         help="One or more output files from ShortBRED quantify",
     )
     parser.add_argument( 
@@ -93,15 +143,17 @@ def get_args( ):
         "-p", "--protein-abundance-file",
         type=str,
         metavar="<path>",
-        default="protein-abundance.txt",
-        help="Path to output file 1: abundance of individual proteins",
+        default=None,
+        help="Path to output file 1: abundance of individual proteins\n"
+             "(default protein-abundance.txt; use --output to write several tables)",
     )
     parser.add_argument( 
         "-C", "--cluster-abundance-file",
         type=str,
         metavar="<path>",
-        default="cluster-abundance.txt",
-        help="Path to output file 2: abundance of SSN clusters",
+        default=None,
+        help="Path to output file 2: abundance of SSN clusters\n"
+             "(default cluster-abundance.txt; use --output to write several tables)",
     )
     parser.add_argument( 
         "-n", "--sum-normalize",
@@ -115,7 +167,99 @@ def get_args( ):
         metavar="<path>",
         help="Perform genome-size normalization (requires mapping from sample ID to average genome size)",
     )
+    parser.add_argument( 
+        "--median-files",
+        type=str,
+        nargs="+",
+        default=[],
+        metavar="<path>",
+        help="ShortBRED quantify outputs with median abundances (use with --output)",
+    )
+    parser.add_argument( 
+        "--mean-files",
+        type=str,
+        nargs="+",
+        default=[],
+        metavar="<path>",
+        help="ShortBRED quantify outputs with mean abundances (use with --output)",
+    )
+    parser.add_argument( 
+        "--output",
+        type=str,
+        nargs=4,
+        action="append",
+        default=[],
+        metavar=("<stat>", "<norm>", "<protein path>", "<cluster path>"),
+        help="Write the protein and cluster tables of the <stat> (%s) files with <norm>\n"
+             "(%s) normalization; may be repeated. 'genome' uses the\n"
+             "--genome-size-normalize mapping" % ( ", ".join( c_stats ), ", ".join( c_norms ) ),
+    )
+    parser.add_argument( 
+        "--backend",
+        choices=c_backends,
+        default="matrix" if np is not None else "dict",
+        help="How abundances are held: 'matrix' interns proteins and samples to indices\n"
+             "and works on numpy arrays, 'dict' keeps one dict per sample\n"
+             "(default: matrix if numpy is available)",
+    )
+    parser.add_argument( 
+        "--workers",
+        type=int,
+        default=1,
+        metavar="<int>",
+        help="Read the ShortBRED outputs with this many processes (output is the same as with one)",
+    )
+    parser.add_argument( 
+        "--store",
+        type=str,
+        default=None,
+        metavar="<dir>",
+        help="Add the ShortBRED outputs to the merge store in <dir> (created if needed)\n"
+             "and write the tables for every sample in it (matrix backend only)",
+    )
+    parser.add_argument( 
+        "--sparse",
+        choices=["txt", "gz"],
+        default=None,
+        help="Also write each table in sparse long format (feature, sample, value for\n"
+             "nonzero values), as plain text or gzip-compressed",
+    )
+    parser.add_argument( 
+        "--hdf5",
+        action="store_true",
+        help="Also write each table as a matrix of doubles with feature and sample\n"
+             "names to an HDF5 file (matrix backend only, requires h5py)",
+    )
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error( "--workers must be at least 1" )
+    if args.backend == "matrix" and np is None:
+        parser.error( "the matrix backend requires numpy" )
+    if args.store is not None and args.backend != "matrix":
+        parser.error( "--store requires the matrix backend" )
+    if args.hdf5 and ( args.backend != "matrix" or h5py is None ):
+        parser.error( "--hdf5 requires the matrix backend and h5py" )
+    if args.output:
+        if args.shortbred_outputs or args.sum_normalize:
+            parser.error( "--output takes its inputs from --median-files and --mean-files and its normalization from <norm>" )
+        # they would otherwise be left unwritten without a word
+        if args.protein_abundance_file is not None or args.cluster_abundance_file is not None:
+            parser.error( "--output gives the paths of its tables, -p and -C cannot be used with it" )
+        for stat, norm, protein_path, cluster_path in args.output:
+            if stat not in c_stats:
+                parser.error( "unknown --output stat %s, expected one of %s" % ( stat, ", ".join( c_stats ) ) )
+            if norm not in c_norms:
+                parser.error( "unknown --output normalization %s, expected one of %s" % ( norm, ", ".join( c_norms ) ) )
+            if not getattr( args, stat + "_files" ) and args.store is None:
+                parser.error( "--output %s requires --%s-files" % ( stat, stat ) )
+            if norm == "genome" and args.genome_size_normalize is None:
+                parser.error( "--output %s genome requires --genome-size-normalize" % ( stat ) )
+    elif not args.shortbred_outputs and args.store is None:
+        parser.error( "no ShortBRED outputs given" )
+    if args.protein_abundance_file is None:
+        args.protein_abundance_file = "protein-abundance.txt"
+    if args.cluster_abundance_file is None:
+        args.cluster_abundance_file = "cluster-abundance.txt"
     return args
 
 #-------------------------------------------------------------------------------
@@ -160,7 +304,20 @@ def strat_sort( k ):
     #key[0] = 0 if key[0] == c_na else int( key[0] )
     return key
 
-def write_nested_dict( dd, path, missing=0 ):
+def sparse_path( path, sparse ):
+    """ path of the long format table written next to the dense table at path """
+    root, ext = os.path.splitext( path )
+    return root + ".sparse" + ( ext or ".txt" ) + ( ".gz" if sparse == "gz" else "" )
+
+def open_sparse( path, sparse ):
+    """ binary file handle for a long format table, gzip-compressed if sparse is 'gz' """
+    path = sparse_path( path, sparse )
+    try:
+        return gzip.open( path, "wb" ) if sparse == "gz" else open( path, "wb" )
+    except IOError:
+        sys.exit( "Unable to open: %s, please check the path" % ( path ) )
+
+def write_nested_dict( dd, path, missing=0, sparse=None ):
     colheads = sorted( dd )
     rowheads = set( )
     for c, cdict in dd.items( ):
@@ -174,63 +331,346 @@ def write_nested_dict( dd, path, missing=0 ):
                 outline.append( dd[c].get( r, missing ) )
             outline = [r] + ["%.6g" % k for k in outline]
             print( "\t".join( outline ), file=fh )
+    if sparse is not None:
+        with open_sparse( path, sparse ) as fh:
+            fh.write( ( c_sparse_header + "\n" ).encode( "utf-8" ) )
+            for r in rowheads:
+                lines = ["%s\t%s\t%.6g\n" % ( r, c, dd[c][r] ) for c in colheads if dd[c].get( r )]
+                fh.write( "".join( lines ).encode( "utf-8" ) )
 
 def clean_acc( acc ):
     if re.search( "^(>)?[a-z]{2}\|", acc ):
         acc = acc.split( c_delim )[1]
     return acc
 
+def read_sample( path ):
+    """ sample name and {accession: abundance} of one ShortBRED output """
+    name = os.path.split( path )[1].split( "." )[0]
+    with try_open( path ) as fh:
+        sdict = read_dict( fh, headers=True, func=float, dialect="excel-tab" )
+    return name, sdict
+
+def read_sample_job( path ):
+    """ read_sample for a pool worker; a failed open comes back as the exit to raise """
+    try:
+        return read_sample( path )
+    except SystemExit as e:
+        return e
+
+def read_samples( paths, workers=1 ):
+    """ read_sample for each path in order, reading them with a pool of worker processes if workers > 1 """
+    if workers <= 1 or len( paths ) <= 1:
+        for p in paths:
+            yield read_sample( p )
+        return
+    pool = multiprocessing.Pool( min( workers, len( paths ) ) )
+    try:
+        # imap hands the results back in the order of paths
+        for result in pool.imap( read_sample_job, paths ):
+            if isinstance( result, SystemExit ):
+                raise result
+            yield result
+    finally:
+        pool.terminate( )
+        pool.join( )
+
 #-------------------------------------------------------------------------------
-# main
+# merging
 #-------------------------------------------------------------------------------
 
-def main( ):
-    args = get_args()
-    # load cluster mapping
-    cmap = read_dict( try_open( args.clusters_file ), kdex=1, vdex=0, dialect="excel-tab" )
-    # load shortbred outputs
+def load_samples( paths, cmap, workers=1 ):
+    """ sample name -> {cluster|protein: abundance} for each ShortBRED output """
+    return relabel_samples( read_samples( paths, workers ), cmap )
+
+def relabel_samples( samples, cmap ):
+    """ sample name -> {cluster|protein: abundance} for (name, {accession: abundance}) pairs """
     dd = {}
-    for p in args.shortbred_outputs:
-        name = os.path.split( p )[1].split( "." )[0]
-        sdict = read_dict( try_open( p ), headers=True,
-                           func=float, dialect="excel-tab" )
+    for name, sdict in samples:
         # rebuild dict with clean acc
         sdict = {clean_acc( k ): v for k, v in sdict.items( )}
         # update keys with cluster numbers
         sdict = {c_delim.join( [cmap.get( k, c_na ), k] ): v for k, v in sdict.items( )}
         dd[name] = sdict
-    # genome-size-normalize?
-    if args.genome_size_normalize is not None:
-        sizes = read_dict( try_open( args.genome_size_normalize ),
-                           func=float, dialect="excel-tab" )
-        for name, sdict in dd.items( ):
-            if name in sizes:
-                ags = sizes[name]
-            else:
-                ags = c_default_genome_size
-                print( "Missing genome size information for sample:",
-                       name, file=sys.stderr )
-            # approximation for CPG normalization from RPKM (v) units
-            dd[name] = {k: v * ags * 1e-9 for k, v in sdict.items( )}
-    # sum-normalize?
-    if args.sum_normalize:
-        for name, sdict in dd.items( ):
-            total = sum( sdict.values( ) )
-            if total > 0.0:
-                dd[name] = {k: v / total for k, v in sdict.items( )}
-            else:
-                dd[name] = {k: 0 for k, v in sdict.items( )}
-    # write out the proteins file
-    write_nested_dict( dd, args.protein_abundance_file )
-    # collapse proteins to clusters
+    return dd
+
+def genome_size_normalize( dd, sizes ):
+    """ new abundances scaled by each sample's average genome size """
+    ndd = {}
+    for name, sdict in dd.items( ):
+        if name in sizes:
+            ags = sizes[name]
+        else:
+            ags = c_default_genome_size
+            print( "Missing genome size information for sample:",
+                   name, file=sys.stderr )
+        # approximation for CPG normalization from RPKM (v) units
+        ndd[name] = {k: v * ags * 1e-9 for k, v in sdict.items( )}
+    return ndd
+
+def sum_normalize( dd ):
+    """ new abundances with each sample summing to 1.0 """
+    ndd = {}
+    for name, sdict in dd.items( ):
+        total = sum( sdict.values( ) )
+        if total > 0.0:
+            ndd[name] = {k: v / total for k, v in sdict.items( )}
+        else:
+            ndd[name] = {k: 0 for k, v in sdict.items( )}
+    return ndd
+
+def collapse_clusters( dd ):
+    """ new abundances summed over the proteins of each cluster """
+    ndd = {}
     for name, sdict in dd.items( ):
         cdict = {}
         for k, v in sdict.items( ):
             cluster, protein = k.split( c_delim )
             cdict[cluster] = cdict.get( cluster, 0 ) + v
-        dd[name] = cdict
-    # write out the clusters file
-    write_nested_dict( dd, args.cluster_abundance_file )
-            
+        ndd[name] = cdict
+    return ndd
+
+def write_tables( dd, protein_path, cluster_path, sparse=None ):
+    write_nested_dict( dd, protein_path, sparse=sparse )
+    write_nested_dict( collapse_clusters( dd ), cluster_path, sparse=sparse )
+
+#-------------------------------------------------------------------------------
+# matrix backend
+#-------------------------------------------------------------------------------
+
+class SampleMatrix( object ):
+    """ 
+    abundances of features (cluster|protein or cluster rows) in samples (columns)
+
+    Only the values that are present in a sample are kept, as coordinate 
+    arrays ordered by column and, within a column, in sample file order. 
+    numpy sums in array order, so the sums here are done in the same order 
+    as the dict backend's and the tables it writes are byte-identical.
+    """
+
+    def __init__( self, samples, features, rows, cols, values ):
+        self.samples = samples
+        self.features = features
+        self.rows = rows
+        self.cols = cols
+        self.values = values
+
+    @staticmethod
+    def read_store( path ):
+        """ accessions and sample name -> (rows, values) of a merge store, both empty if there is none yet """
+        if not os.path.exists( path ):
+            return [], {}
+        with np.load( path ) as store:
+            if int( store["version"] ) != c_store_version:
+                sys.exit( "Unsupported merge store version in %s" % ( path ) )
+            accs = store["accessions"].tolist( )
+            samples = store["samples"].tolist( )
+            counts = store["counts"]
+            rows = store["rows"]
+            values = store["values"]
+        ends = np.cumsum( counts )
+        starts = ends - counts
+        sdata = {n: ( rows[b:e], values[b:e] ) for n, b, e in zip( samples, starts, ends )}
+        return accs, sdata
+
+    @staticmethod
+    def write_store( path, accs, samples, counts, rows, values ):
+        """ replace the merge store at path """
+        folder = os.path.dirname( path )
+        if folder and not os.path.isdir( folder ):
+            os.makedirs( folder )
+        # write a new file and move it over the old one, so an interrupted run leaves the old store
+        temp = path + ".tmp"
+        with open( temp, "wb" ) as fh:
+            np.savez( fh, version=c_store_version,
+                      accessions=np.array( accs, dtype=str ), samples=np.array( samples, dtype=str ),
+                      counts=np.array( counts, dtype=np.int64 ), rows=rows, values=values )
+        os.rename( temp, path )
+
+    @classmethod
+    def load( cls, paths, cmap, workers=1, store=None ):
+        """ 
+        read the ShortBRED outputs in paths; with a store, add them to the 
+        samples already in it, save it and return all of its samples
+        """
+        return cls.from_samples( read_samples( paths, workers ), cmap, store )
+
+    @classmethod
+    def from_samples( cls, samples, cmap, store=None ):
+        """ matrix of (name, {accession: abundance}) pairs, added to the store if given """
+        accs, sdata = [], {}
+        if store is not None:
+            accs, sdata = cls.read_store( store )
+        index = {k: i for i, k in enumerate( accs )}
+        # row of each accession as written in the sample files, so clean_acc runs once per protein
+        raw_index = {}
+        def row_of( k ):
+            r = raw_index.get( k )
+            if r is None:
+                r = raw_index[k] = index.setdefault( clean_acc( k ), len( index ) )
+            return r
+        for name, sdict in samples:
+            rows = [row_of( k ) for k in sdict]
+            if len( set( rows ) ) < len( rows ):
+                # accessions that are the same once cleaned; rebuild dict with clean acc
+                sdict = {clean_acc( k ): v for k, v in sdict.items( )}
+                rows = [index[k] for k in sdict]
+            # a later file with the same sample name replaces the earlier one
+            sdata[name] = ( np.array( rows, dtype=np.int64 ), 
+                            np.array( list( sdict.values( ) ), dtype=np.float64 ) )
+        samples = sorted( sdata )
+        rows = np.concatenate( [sdata[n][0] for n in samples] + [np.zeros( 0, dtype=np.int64 )] )
+        values = np.concatenate( [sdata[n][1] for n in samples] + [np.zeros( 0 )] )
+        cols = np.repeat( np.arange( len( samples ) ), [len( sdata[n][0] ) for n in samples] )
+        accs = accs + [None] * ( len( index ) - len( accs ) )
+        for k, i in index.items( ):
+            accs[i] = k
+        # drop proteins only seen in replaced files
+        used = np.zeros( len( accs ), dtype=bool )
+        used[rows] = True
+        if not used.all( ):
+            remap = np.cumsum( used ) - 1
+            rows = remap[rows]
+            accs = [k for k, u in zip( accs, used ) if u]
+        if store is not None:
+            cls.write_store( store, accs, samples, [len( sdata[n][0] ) for n in samples], rows, values )
+        features = [c_delim.join( [cmap.get( k, c_na ), k] ) for k in accs]
+        return cls( samples, features, rows, cols, values )
+
+    def column_starts( self ):
+        return np.searchsorted( self.cols, np.arange( len( self.samples ) + 1 ) )
+
+    def genome_size_normalize( self, sizes ):
+        ags = []
+        for name in self.samples:
+            if name in sizes:
+                ags.append( sizes[name] )
+            else:
+                ags.append( c_default_genome_size )
+                print( "Missing genome size information for sample:",
+                       name, file=sys.stderr )
+        # approximation for CPG normalization from RPKM (v) units
+        values = self.values * np.array( ags, dtype=np.float64 )[self.cols] * 1e-9
+        return SampleMatrix( self.samples, self.features, self.rows, self.cols, values )
+
+    def sum_normalize( self ):
+        starts = self.column_starts( )
+        totals = np.zeros( len( self.samples ) )
+        for i in range( len( self.samples ) ):
+            # cumsum adds one value at a time, like the dict backend's sum()
+            if starts[i+1] > starts[i]:
+                totals[i] = np.cumsum( self.values[starts[i]:starts[i+1]] )[-1]
+        totals = totals[self.cols]
+        positive = totals > 0.0
+        values = np.zeros( len( self.values ) )
+        values[positive] = self.values[positive] / totals[positive]
+        return SampleMatrix( self.samples, self.features, self.rows, self.cols, values )
+
+    def collapse_clusters( self ):
+        clusters = [k.split( c_delim )[0] for k in self.features]
+        names = sorted( set( clusters ) )
+        cindex = {c: i for i, c in enumerate( names )}
+        cluster_of = np.array( [cindex[c] for c in clusters], dtype=np.int64 )
+        keys = cluster_of[self.rows] * len( self.samples ) + self.cols
+        keys, inverse = np.unique( keys, return_inverse=True )
+        # bincount adds the weights in array order, so each cluster sums in file order
+        values = np.bincount( inverse.ravel( ), weights=self.values, minlength=len( keys ) )
+        return SampleMatrix( self.samples, names, keys // len( self.samples ), 
+                             keys % len( self.samples ), values )
+
+    def write( self, path, missing=0, sparse=None, binary=False ):
+        order = sorted( range( len( self.features ) ), key=lambda i: strat_sort( self.features[i] ) )
+        rank = np.zeros( len( order ), dtype=np.int64 )
+        rank[order] = np.arange( len( order ) )
+        rows = rank[self.rows]
+        entries = np.lexsort( ( self.cols, rows ) )
+        rows = rows[entries]
+        cols = self.cols[entries]
+        values = self.values[entries]
+        blank = "%.6g" % missing
+        with try_open( path, "w" ) as fh:
+            print( "\t".join( ["Feature \ Sample"] + self.samples ), file=fh )
+            # fill the table a block of rows at a time, formatting only the values present
+            for first in range( 0, len( order ), c_block_rows ):
+                last = min( first + c_block_rows, len( order ) )
+                lo, hi = np.searchsorted( rows, [first, last] )
+                grid = np.full( ( last - first, len( self.samples ) ), blank, dtype=object )
+                grid[rows[lo:hi] - first, cols[lo:hi]] = ["%.6g" % k for k in values[lo:hi].tolist( )]
+                fh.write( "".join( "\t".join( [self.features[order[first + i]]] + line ) + "\n"
+                                   for i, line in enumerate( grid.tolist( ) ) ) )
+        if sparse is not None:
+            nonzero = values != 0
+            with open_sparse( path, sparse ) as fh:
+                fh.write( ( c_sparse_header + "\n" ).encode( "utf-8" ) )
+                for first in range( 0, len( order ), c_block_rows ):
+                    lo, hi = np.searchsorted( rows, [first, first + c_block_rows] )
+                    keep = nonzero[lo:hi]
+                    lines = ["%s\t%s\t%.6g\n" % ( self.features[order[r]], self.samples[c], v ) for r, c, v in
+                             zip( rows[lo:hi][keep].tolist( ), cols[lo:hi][keep].tolist( ), values[lo:hi][keep].tolist( ) )]
+                    fh.write( "".join( lines ).encode( "utf-8" ) )
+        if binary:
+            self.write_hdf5( os.path.splitext( path )[0] + ".h5", order, rows, cols, values, missing )
+
+    def write_hdf5( self, path, order, rows, cols, values, missing=0 ):
+        """ the table at full precision, with rows in the given order """
+        matrix = np.full( ( len( order ), len( self.samples ) ), float( missing ) )
+        matrix[rows, cols] = values
+        with h5py.File( path, "w" ) as hdf:
+            # contiguous storage, so readers can memory-map the matrix
+            hdf.create_dataset( "values", data=matrix )
+            hdf.create_dataset( "features", data=np.array( [self.features[i].encode( "utf-8" ) for i in order], dtype=bytes ) )
+            hdf.create_dataset( "samples", data=np.array( [n.encode( "utf-8" ) for n in self.samples], dtype=bytes ) )
+
+    def write_tables( self, protein_path, cluster_path, sparse=None, binary=False ):
+        self.write( protein_path, sparse=sparse, binary=binary )
+        self.collapse_clusters( ).write( cluster_path, sparse=sparse, binary=binary )
+
+#-------------------------------------------------------------------------------
+# main
+#-------------------------------------------------------------------------------
+
+def main( ):
+    args = get_args()
+    # load cluster mapping
+    cmap = read_dict( try_open( args.clusters_file ), kdex=1, vdex=0, dialect="excel-tab" )
+    sizes = None
+    if args.genome_size_normalize is not None:
+        sizes = read_dict( try_open( args.genome_size_normalize ),
+                           func=float, dialect="excel-tab" )
+    options = {"sparse": args.sparse}
+    if args.hdf5:
+        options["binary"] = True
+    if args.backend == "matrix":
+        load, genome_norm, sum_norm, write = ( SampleMatrix.load, SampleMatrix.genome_size_normalize,
+                                               SampleMatrix.sum_normalize, SampleMatrix.write_tables )
+    else:
+        load, genome_norm, sum_norm, write = load_samples, genome_size_normalize, sum_normalize, write_tables
+    def load_list( stat, paths ):
+        if args.store is None:
+            return load( paths, cmap, args.workers )
+        return SampleMatrix.load( paths, cmap, args.workers, os.path.join( args.store, stat + ".npz" ) )
+    if not args.output:
+        dd = load_list( "samples", args.shortbred_outputs )
+        # genome-size-normalize?
+        if sizes is not None:
+            dd = genome_norm( dd, sizes )
+        # sum-normalize?
+        if args.sum_normalize:
+            dd = sum_norm( dd )
+        write( dd, args.protein_abundance_file, args.cluster_abundance_file, **options )
+        return
+    # every table of a quantify job from one load of each file list
+    for stat in c_stats:
+        outputs = [o for o in args.output if o[0] == stat]
+        if not outputs:
+            continue
+        dd = load_list( stat, getattr( args, stat + "_files" ) )
+        for stat, norm, protein_path, cluster_path in outputs:
+            if norm == "sum":
+                write( sum_norm( dd ), protein_path, cluster_path, **options )
+            elif norm == "genome":
+                write( genome_norm( dd, sizes ), protein_path, cluster_path, **options )
+            else:
+                write( dd, protein_path, cluster_path, **options )
+
 if __name__ == "__main__":
     main( )
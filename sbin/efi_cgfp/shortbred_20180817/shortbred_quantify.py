@@ -26,7 +26,6 @@
 
 import sys
 import argparse
-import re
 import os
 import datetime
 import tarfile
@@ -40,8 +39,6 @@ import src
 import src.quantify_functions
 sq = src.quantify_functions
 
-from Bio import SeqIO
-
 VERSION="0.9.5"
 
 
@@ -67,6 +64,8 @@ grpInput.add_argument('--wgs', type=str, dest='strWGS',nargs='+',
 help='Enter the path and name of the WGS file (nucleotide reads).')
 grpInput.add_argument('--genome', type=str, dest='strGenome',
 help='Enter the path and name of the genome file (faa expected).')
+grpInput.add_argument('--catalog', type=str, dest='strCatalog', default="",
+help='Enter the path and name of the marker catalog. It is built from the markers when missing or out of date, and reused otherwise. Default is the markers file name + ".catalog".')
 
 
 #Output
@@ -82,6 +81,7 @@ help='Enter the name of the blast/diamond-formatted output file from USEARCH/DIA
 grpOutput.add_argument('--marker_results', type=str, dest='strMarkerResults', default="",
 help='Enter the name of the output for marker level results.')
 grpOutput.add_argument('--tmp', type=str, dest='strTmp', default ="",help='Enter the path and name of the tmp directory.')
+grpOutput.add_argument('--dbcache', type=str, dest='strDBCache', default ="",help='Enter the path of a directory where marker databases are kept and shared by runs on the same markers. Default is the tmp directory.')
 
 grpPrograms = parser.add_argument_group('Programs:')
 grpPrograms.add_argument('--search_program', default ="diamond", type=str, dest='strSearchProg', help='Choose program for wgs and unannotated genome search. Default is \"usearch\".')
@@ -91,6 +91,7 @@ grpPrograms.add_argument('--makeblastdb', default ="makeblastdb", type=str, dest
 grpPrograms.add_argument('--prerapsearch2', default ="prerapsearch", type=str, dest='strPrerapPath', help='Provide the path to prerapsearch2. Default call will be \"prerapsearch\".')
 grpPrograms.add_argument('--rapsearch2', default ="rapsearch2", type=str, dest='strRap2Path', help='Provide the path to rapsearch2. Default call will be \"rapsearch2\".')
 grpPrograms.add_argument('--diamond', default ="diamond", type=str, dest='strDIAMOND', help='Provide the path to  makeblastdb. Default call will be to \"diamond\".')
+grpPrograms.add_argument('--stream', action='store_true', dest='bStream', default=False, help='Count the hits as usearch, rapsearch2 or diamond produces them for wgs input, instead of writing the full search output to disk first. The output is still saved if --searchout is given.')
 
 #Parameters - Matching Settings
 grpParam = parser.add_argument_group('Parameters:')
@@ -120,6 +121,7 @@ grpParam.add_argument('--threads', type=int, dest='iThreads', help='Enter the nu
 grpParam.add_argument('--notmarkers', type=str, dest='strCentroids',default="N", help='This flag is used when testing centroids for evaluation purposes.')
 grpParam.add_argument('--cent_match_length', type=int, dest='iAlnCentroids',default=30, help='This flag is used when working with centroids. It sets the minimum matching length.')
 grpParam.add_argument('--small', type=bool, dest='bSmall',default=False, help='This flag is used to indicate the input file is small enough for USEARCH.')
+grpParam.add_argument('--pipeline', type=int, dest='iPipeline',default=0, help='For large WGS files, the number of read chunks that may be converted ahead of the USEARCH search on a separate thread. The default (0) converts and searches one chunk at a time.')
 
 #parser.add_argument('--length', type=int, dest='iLength', help='Enter the minimum length of the markers.')
 
@@ -160,6 +162,9 @@ if(dirTmp==""):
 dirTmp = src.check_create_dir( dirTmp )
 dirTmp = os.path.abspath(dirTmp)
 
+# Marker databases are built once per marker set, program and program version.
+dirDBCache = args.strDBCache if args.strDBCache != "" else dirTmp
+
 # Assign file names
 if args.strHits != "":
     strHitsFile = args.strHits
@@ -231,15 +236,7 @@ if strMethod=="annotated_genome":
 
 
 ##############################################################################
-#Initialize Dictionaries, Some Output Files
-
-dictMarkerLen = {}
-dictCountsForMarker = {}  # sum of read lengths in valid hits for each marker
-dictMarkerCount = {}
-dictHitsForMarker = {}
-dictQMPossibleOverlap = {}
-dictType = {}
-
+#Initialize Some Output Files
 
 if (args.strSearch == ""):
     strSearch = str(dirTmp) + os.sep + strMethod+ "full_results.tab"
@@ -248,57 +245,16 @@ else:
 
 ###############################################################################
 #Step 1: Prepare markers.
-# Sum up the marker lengths by family, put them in a dictionary.
+# Catalog the marker families, types and lengths, and number the markers;
+# hits and counts are kept by that number.
 # Make them into a USEARCH/DIAMOND database.
 
-astrQMs = []
-for seq in SeqIO.parse(args.strMarkers, "fasta"):
-    #For Cenrtoids...
-    if args.strCentroids=="Y":
-        strStub = seq.id
-    
-    #For ShortBRED Markers
-    else:
-        mtchStub = re.search(r'(.*)_([TJQ]M)[0-9]*_\#([0-9]*)',seq.id)
-        strStub = mtchStub.group(1)
-        strType = mtchStub.group(2)
-    
-    dictMarkerCount[strStub] = dictMarkerCount.get(strStub,0) + 1
-    dictHitsForMarker[seq.id] = 0
-    dictCountsForMarker[seq.id] = 0
-    dictMarkerLen[seq.id] = len(seq)    # record the length of each marker
-    
-    if args.strCentroids!="Y":
-        dictType[strStub] = strType
-        
-        if strType == "QM":
-            astrQMs.append(seq.id)
-            astrAllFams = re.search(r'\__\[(.*)\]',seq.id).group(1).split(",")
-	       
-            # Example: __[ZP_04174269_w=0.541,ZP_04300309_w=0.262,NP_242644_w=0.098]
-            iQM = 0
-            iJM = 0
-            iTM = 0
-            
-            astrFams =[]
-            # Only retain those families which could validly map to this QM at the given settings.
-            for strFam in astrAllFams:
-                #print strFam
-                mtchFam = re.search(r'(.*)_w=(.*)',strFam)
-                strID = mtchFam.group(1)
-                dProp = float(mtchFam.group(2))
-                
-                if strID == strStub:
-                    dMainFamProp = dProp
-                dLenOverlap = (dProp/dMainFamProp) * len(seq)
-                
-                # Reads from current family can map to the QM if overlap is as long
-                # as the minimum accepted read length. Or if it nearly overlaps
-                # the entire marker
-                if (dLenOverlap >= (args.iMinReadBP/3)) or (dProp/dMainFamProp) >= args.dAlnLength:
-                    astrFams.append(strID)
-            
-            dictQMPossibleOverlap[seq.id] = astrFams
+catMarkers = sq.GetMarkerCatalog(args.strMarkers, bCentroids=(args.strCentroids=="Y"), strCatalog=args.strCatalog)
+if args.strCentroids!="Y":
+    catMarkers.SetQMOverlap(args.iMinReadBP, args.dAlnLength)
+
+aiHitsForMarker = [0]*len(catMarkers)
+adCountsForMarker = [0]*len(catMarkers)  # sum of read lengths in valid hits for each marker
 
 ##################################################################################
 #Step 2: Get information on WGS file(s), put it into aaFileInfo.
@@ -362,9 +318,7 @@ if strMethod=="wgs":
 # Step 3: Call USEARCH on each WGS file, (break into smaller files if needed), store hit counts.
 #         OR run USEARCH on each individual genome.
 # Initialize values for the sample
-iTotalReadCount = 0
-dAvgReadLength  = 0.0
-iMin = 999 #Can be any large integer. Just a value to initialize iMin before calculations begin.
+statsReads = sq.ReadStats()
 iWGSFileCount = 1
 
 
@@ -372,40 +326,31 @@ if strMethod=="annotated_genome":
     
     # If running on an *annotated_genome*, use usearch.
     if args.strSearchProg=="usearch":  
-        strDBName = str(dirTmp) + os.sep + os.path.basename(os.path.splitext(str(args.strMarkers))[0]) + ".udb"
-        strDBName = os.path.abspath(strDBName)
         log.write(time.strftime("%Y-%m-%d %H:%M:%S") + " Making USEARCH database for the annotated_genome reads \n")
-        sq.MakedbUSEARCH (args.strMarkers, strDBName,args.strUSEARCH)
+        strDBName = sq.GetMarkerDB(args.strMarkers, catMarkers.strChecksum, "usearch", args.strUSEARCH, dirDBCache)
         log.write( time.strftime("%Y-%m-%d %H:%M:%S") + " USEARCHing the markers against the annotated_genome reads \n")
         sq.RunUSEARCHGenome(strGenome=args.strGenome, strDB=strDBName, strSearchOut = strSearch,iThreads=args.iThreads,dID=args.dID, dirTmp=dirTmp,
                             iAccepts=args.iMaxHits, iRejects=args.iMaxRejects,strUSEARCH=args.strUSEARCH )
-        sq.StoreHitCounts(strSearchOut=strSearch,strValidHits=strHitsFile,dictHitsForMarker=dictHitsForMarker,
-                          dictMarkerLen=dictMarkerLen,dictCountsForMarker=dictCountsForMarker,dID=args.dID,
+        sq.StoreHitCounts(strSearchOut=strSearch,strValidHits=strHitsFile,catMarkers=catMarkers,aiHitsForMarker=aiHitsForMarker,
+                          adCountsForMarker=adCountsForMarker,dID=args.dID,
                           strCentCheck=args.strCentroids,dAlnLength=args.dAlnLength,
                           iMinReadBP=args.iMinReadBP,iAvgMarkerAA=int(math.floor(args.iAvgReadBP/3)),
                           strShortBREDMode=strMethod,iAlnCentroids=args.iAlnCentroids,strSearchMethod = args.strSearchProg,
                           version_control = strVersionUSEARCH)
         
     elif args.strSearchProg=="diamond":
-        strDBName = str(dirTmp) + os.sep + os.path.basename(os.path.splitext(str(args.strMarkers))[0]) + ".diamdb"
-        strDBName = os.path.abspath(strDBName)
         log.write(time.strftime("%Y-%m-%d %H:%M:%S") + " Making DIAMOND database for the annotated_genome reads \n")
-        sq.MakedbDIAMOND ( args.strMarkers, strDBName, args.strDIAMOND)
+        strDBName = sq.GetMarkerDB(args.strMarkers, catMarkers.strChecksum, "diamond", args.strDIAMOND, dirDBCache)
         log.write( time.strftime("%Y-%m-%d %H:%M:%S") + " DIAMONDing the markers against the annotated_genome reads database \n")
         sq.RunDIAMONDp (strDIAMOND = args.strDIAMOND, strDB=strDBName, strGenome=args.strGenome, strDiamondOut = strSearch,iThreads=args.iThreads)
-        sq.StoreHitCounts(strSearchOut=strSearch,strValidHits=strHitsFile,dictHitsForMarker=dictHitsForMarker,
-                          dictMarkerLen=dictMarkerLen,dictCountsForMarker=dictCountsForMarker,dID=args.dID,
+        sq.StoreHitCounts(strSearchOut=strSearch,strValidHits=strHitsFile,catMarkers=catMarkers,aiHitsForMarker=aiHitsForMarker,
+                          adCountsForMarker=adCountsForMarker,dID=args.dID,
                           strCentCheck=args.strCentroids,dAlnLength=args.dAlnLength,
                           iMinReadBP=args.iMinReadBP,iAvgMarkerAA=int(math.floor(args.iAvgReadBP/3)),
                           strShortBREDMode=strMethod,iAlnCentroids=args.iAlnCentroids,strSearchMethod = args.strSearchProg)
         
     
-    iWGSReads = 0
-    for seq in SeqIO.parse(args.strGenome, "fasta"):
-        iWGSReads+=1
-        iTotalReadCount+=1
-        dAvgReadLength = ((dAvgReadLength * (iTotalReadCount-1)) + len(seq))/float(iTotalReadCount)
-        iMin = min(iMin,len(seq))
+    statsReads.Merge(sq.ScanReadStats(args.strGenome))
 
 elif strMethod=="unannotated_genome":
     # If running on *unannotated_genome*, use tblastn.
@@ -419,26 +364,19 @@ elif strMethod=="unannotated_genome":
         sq.RunTBLASTN (args.strTBLASTN, strDBName,args.strWGS, strSearch, args.iThreads)
     
     elif args.strSearchProg=="diamond":
-        strDBName = str(dirTmp) + os.sep + os.path.basename(os.path.splitext(str(args.strMarkers))[0]) + ".diamdb"
-        strDBName = os.path.abspath(strDBName)
         log.write(time.strftime("%Y-%m-%d %H:%M:%S") + " Making DIAMOND database for the unannotated_genome reads \n")
-        sq.MakedbDIAMOND ( args.strMarkers, strDBName, args.strDIAMOND)
+        strDBName = sq.GetMarkerDB(args.strMarkers, catMarkers.strChecksum, "diamond", args.strDIAMOND, dirDBCache)
         log.write( time.strftime("%Y-%m-%d %H:%M:%S") + " DIAMONDing the markers against the unannotated_genome reads database \n")
         sq.RunDIAMONDx (strDIAMOND = args.strDIAMOND, strDB=strDBName, strWGS=args.strWGS, strDiamondOut = strSearch,iThreads=args.iThreads)
         
     
-    sq.StoreHitCounts(strSearchOut=strSearch,strValidHits=strHitsFile,dictHitsForMarker=dictHitsForMarker,
-                      dictMarkerLen=dictMarkerLen,dictCountsForMarker=dictCountsForMarker,dID=args.dID,
+    sq.StoreHitCounts(strSearchOut=strSearch,strValidHits=strHitsFile,catMarkers=catMarkers,aiHitsForMarker=aiHitsForMarker,
+                      adCountsForMarker=adCountsForMarker,dID=args.dID,
                       strCentCheck=args.strCentroids,dAlnLength=args.dAlnLength,
                       iMinReadBP=args.iMinReadBP,iAvgMarkerAA=int(math.floor(args.iAvgReadBP/3)),
                       strShortBREDMode=strMethod,iAlnCentroids=args.iAlnCentroids,strSearchMethod = args.strSearchProg)
 
-    iWGSReads = 0
-    for seq in SeqIO.parse(args.strMarkers, "fasta"):
-        iWGSReads+=1
-        iTotalReadCount+=1
-        dAvgReadLength = ((dAvgReadLength * (iTotalReadCount-1)) + len(seq))/float(iTotalReadCount)
-        iMin = min(iMin,len(seq))
+    statsReads.Merge(sq.ScanReadStats(args.strMarkers))
 
 # Otherwise, profile wgs data with usearch or rapsearch2 or diamond
 else:
@@ -455,59 +393,56 @@ else:
         #If it's a small fasta file, just give it to USEARCH or rapsearch or DIAMOND directly.
         
         if args.strSearchProg=="diamond":
-            strDBName = str(dirTmp) + os.sep + os.path.basename(os.path.splitext(str(args.strMarkers))[0]) + ".diamdb"
-            strDBName = os.path.abspath(strDBName)
+            #Count the reads while diamond searches them.
+            scanWGS = sq.ReadStatsScanner(strWGS)
             log.write(time.strftime("%Y-%m-%d %H:%M:%S") + " Making DIAMOND database for the wgs reads \n")
-            sq.MakedbDIAMOND ( args.strMarkers, strDBName, args.strDIAMOND)
+            strDBName = sq.GetMarkerDB(args.strMarkers, catMarkers.strChecksum, "diamond", args.strDIAMOND, dirDBCache)
             log.write( time.strftime("%Y-%m-%d %H:%M:%S") + " DIAMONDing the markers against the wgs reads database \n")
-            sq.RunDIAMONDx(strDIAMOND = args.strDIAMOND, strDB=strDBName, strWGS=strWGS, strDiamondOut = strSearch,iThreads=args.iThreads)
-            sq.StoreHitCounts(strSearchOut=strSearch,strValidHits=strHitsFile,dictHitsForMarker=dictHitsForMarker,
-                              dictMarkerLen=dictMarkerLen,dictCountsForMarker=dictCountsForMarker,dID=args.dID,
+            objSearch = sq.RunDIAMONDx(strDIAMOND = args.strDIAMOND, strDB=strDBName, strWGS=strWGS, strDiamondOut = strSearch,iThreads=args.iThreads,bStream=args.bStream)
+            sq.StoreHitCounts(strSearchOut=objSearch,strValidHits=strHitsFile,catMarkers=catMarkers,aiHitsForMarker=aiHitsForMarker,
+                              adCountsForMarker=adCountsForMarker,dID=args.dID,
                               strCentCheck=args.strCentroids,dAlnLength=args.dAlnLength,
                               iMinReadBP=args.iMinReadBP,iAvgMarkerAA=int(math.floor(args.iAvgReadBP/3)),
-                              strShortBREDMode=strMethod,iAlnCentroids=args.iAlnCentroids,strSearchMethod = args.strSearchProg)
+                              strShortBREDMode=strMethod,iAlnCentroids=args.iAlnCentroids,strSearchMethod = args.strSearchProg,
+                              strSearchCopy=args.strSearch)
            
-            for seq in SeqIO.parse(strWGS, "fasta"):
-                iWGSReads+=1
-                iTotalReadCount+=1
-                dAvgReadLength = ((dAvgReadLength * (iTotalReadCount-1)) + len(seq))/float(iTotalReadCount)
-                iMin = min(iMin,len(seq))
+            statsWGS = scanWGS.Result()
+            iWGSReads = statsWGS.iReads
+            statsReads.Merge(statsWGS)
+            log.write("Reads: " + str(statsWGS.iReads) + "\tBases: " + str(statsWGS.iBases) + "\tMin: " + str(statsWGS.iMin) + "\tMax: " + str(statsWGS.iMax) + '\n')
                 
         elif strFormat=="fasta" and strSize=="small":
+            scanWGS = sq.ReadStatsScanner(strWGS)
             if args.strSearchProg=="rapsearch2":
-                strDBName = str(dirTmp) + os.sep + os.path.basename(os.path.splitext(str(args.strMarkers))[0]) + ".rap2db"
-                strDBName = os.path.abspath(strDBName)
                 log.write(time.strftime("%Y-%m-%d %H:%M:%S") + " Making RAPSEARCH2 database for the small wgs reads \n")
-                sq.MakedbRapsearch2(args.strMarkers, strDBName,args.strPrerapPath)
+                strDBName = sq.GetMarkerDB(args.strMarkers, catMarkers.strChecksum, "rapsearch2", args.strPrerapPath, dirDBCache)
                 log.write( time.strftime("%Y-%m-%d %H:%M:%S") + " RAPSEARCHing the markers against the wgs reads database \n")
-                sq.RunRAPSEARCH2(strWGS=strWGS,strDB=strDBName, strSearchOut  = strSearch,iThreads=args.iThreads,dID=args.dID, dirTmp=dirTmp,
-                                 iAccepts=args.iMaxHits, iRejects=args.iMaxRejects,strRAPSEARCH2=args.strRap2Path )
-                sq.StoreHitCounts(strSearchOut=strSearch,strValidHits=strHitsFile,dictHitsForMarker=dictHitsForMarker,
-                                  dictMarkerLen=dictMarkerLen,dictCountsForMarker=dictCountsForMarker,dID=args.dID,
+                objSearch = sq.RunRAPSEARCH2(strWGS=strWGS,strDB=strDBName, strSearchOut  = strSearch,iThreads=args.iThreads,dID=args.dID, dirTmp=dirTmp,
+                                 iAccepts=args.iMaxHits, iRejects=args.iMaxRejects,strRAPSEARCH2=args.strRap2Path,bStream=args.bStream )
+                sq.StoreHitCounts(strSearchOut=objSearch,strValidHits=strHitsFile,catMarkers=catMarkers,aiHitsForMarker=aiHitsForMarker,
+                                  adCountsForMarker=adCountsForMarker,dID=args.dID,
                                   strCentCheck=args.strCentroids,dAlnLength=args.dAlnLength,
                                   iMinReadBP=args.iMinReadBP,iAvgMarkerAA=int(math.floor(args.iAvgReadBP/3)),
-                                  strShortBREDMode=strMethod,iAlnCentroids=args.iAlnCentroids,strSearchMethod = args.strSearchProg)
+                                  strShortBREDMode=strMethod,iAlnCentroids=args.iAlnCentroids,strSearchMethod = args.strSearchProg,
+                                  strSearchCopy=args.strSearch)
          
             elif args.strSearchProg=="usearch":
-                strDBName = str(dirTmp) + os.sep + os.path.basename(os.path.splitext(str(args.strMarkers))[0]) + ".udb"
-                strDBName = os.path.abspath(strDBName)
                 log.write(time.strftime("%Y-%m-%d %H:%M:%S") + " Making USEARCH database for the small wgs reads \n")
-                sq.MakedbUSEARCH(args.strMarkers, strDBName,args.strUSEARCH)
+                strDBName = sq.GetMarkerDB(args.strMarkers, catMarkers.strChecksum, "usearch", args.strUSEARCH, dirDBCache)
                 log.write( time.strftime("%Y-%m-%d %H:%M:%S") + " USEARCHing the markers against the wgs reads databse \n")
-                sq.RunUSEARCH(strWGS=strWGS, strDB=strDBName, strSearchOut  = strSearch,iThreads=args.iThreads,dID=args.dID, dirTmp=dirTmp,
-                              iAccepts=args.iMaxHits, iRejects=args.iMaxRejects,strUSEARCH=args.strUSEARCH )
-                sq.StoreHitCounts(strSearchOut=strSearch,strValidHits=strHitsFile,dictHitsForMarker=dictHitsForMarker,
-                                  dictMarkerLen=dictMarkerLen,dictCountsForMarker=dictCountsForMarker,dID=args.dID,
+                objSearch = sq.RunUSEARCH(strWGS=strWGS, strDB=strDBName, strSearchOut  = strSearch,iThreads=args.iThreads,dID=args.dID, dirTmp=dirTmp,
+                              iAccepts=args.iMaxHits, iRejects=args.iMaxRejects,strUSEARCH=args.strUSEARCH,bStream=args.bStream )
+                sq.StoreHitCounts(strSearchOut=objSearch,strValidHits=strHitsFile,catMarkers=catMarkers,aiHitsForMarker=aiHitsForMarker,
+                                  adCountsForMarker=adCountsForMarker,dID=args.dID,
                                   strCentCheck=args.strCentroids,dAlnLength=args.dAlnLength,
                                   iMinReadBP=args.iMinReadBP,iAvgMarkerAA=int(math.floor(args.iAvgReadBP/3)),
                                   strShortBREDMode=strMethod,iAlnCentroids=args.iAlnCentroids,strSearchMethod = args.strSearchProg,
-                                  version_control = strVersionUSEARCH)
+                                  version_control = strVersionUSEARCH,strSearchCopy=args.strSearch)
                        
-            for seq in SeqIO.parse(strWGS, "fasta"):
-                iWGSReads+=1
-                iTotalReadCount+=1
-                dAvgReadLength = ((dAvgReadLength * (iTotalReadCount-1)) + len(seq))/float(iTotalReadCount)
-                iMin = min(iMin,len(seq))
+            statsWGS = scanWGS.Result()
+            iWGSReads = statsWGS.iReads
+            statsReads.Merge(statsWGS)
+            log.write("Reads: " + str(statsWGS.iReads) + "\tBases: " + str(statsWGS.iBases) + "\tMin: " + str(statsWGS.iMin) + "\tMax: " + str(statsWGS.iMax) + '\n')
             
             """
             #Skip the file if the format is unknown.
@@ -519,15 +454,9 @@ else:
         
         #Otherwise, convert the file as needed into small fasta files. Call USEARCH and store the counts for each small file.
         else:
-            strDBName = str(dirTmp) + os.sep + os.path.basename(os.path.splitext(str(args.strMarkers))[0]) + ".udb"
-            strDBName = os.path.abspath(strDBName)
             log.write(time.strftime("%Y-%m-%d %H:%M:%S") + " Making USEARCH database for the large wgs reads \n")
-            sq.MakedbUSEARCH(args.strMarkers, strDBName,args.strUSEARCH)
+            strDBName = sq.GetMarkerDB(args.strMarkers, catMarkers.strChecksum, "usearch", args.strUSEARCH, dirDBCache)
             
-            iReadsInSmallFile = 0
-            iFileCount = 1
-            
-            strFASTAName = str(dirTmp) + os.sep + 'fasta.fna'
             #Unpack file with appropriate extract method
             if (strExtractMethod== 'r:bz2' or strExtractMethod=='r:gz'):
                 sys.stderr.write("Unpacking tar file... this often takes several minutes. ")
@@ -546,9 +475,6 @@ else:
                 streamWGS = open(strWGS,'r')
                 
             
-            #Open file for writing
-            fileFASTA = open(strFASTAName, 'w')
-            
             """
             if strFormat=="unknown":
                 strFormat="fastq"
@@ -556,55 +482,26 @@ else:
                 log.write("File was empty." + '\n')
             """
             
-            #Start the main loop to get everything in streamWGS -> small fasta file -> counted and stored
-            for seq in SeqIO.parse(streamWGS, strFormat):
-                #Added to keep usearch from hitting seqs that are too long.
-                if len(seq)< 50000:
-                    SeqIO.write(seq,fileFASTA,"fasta")
-                    iReadsInSmallFile+=1
-                    iTotalReadCount+=1
-                    iWGSReads+=1
-                    
-                    # Have a running average of the read length. This covers all of the reads in the original input file.
-                    dAvgReadLength = ((dAvgReadLength * (iTotalReadCount-1)) + len(seq))/float(iTotalReadCount)
-                    iMin = min(len(seq),iMin)
-                
-                #Close the temp fasta file once it has enough reads.
-                if (iReadsInSmallFile>=c_iReadsForFile):
-                    fileFASTA.close()
-                    
-                    strOutputName = str(dirTmp) + os.sep + "wgs_" + str(iWGSFileCount).zfill(2) + "out_" + str(iFileCount).zfill(2) + ".out"
-                    #Run Usearch, store results
-                    if args.strSearchProg=="usearch":
-                        sq.RunUSEARCH(strWGS=strFASTAName,strDB=strDBName, strSearchOut  = strOutputName,dirTmp=dirTmp,
-                                      iThreads=args.iThreads,dID=args.dID, iAccepts=args.iMaxHits, iRejects=args.iMaxRejects,strUSEARCH=args.strUSEARCH  )
-                        sq.StoreHitCounts(strSearchOut=strOutputName,strValidHits=strHitsFile,dictHitsForMarker=dictHitsForMarker,
-                                          dictMarkerLen=dictMarkerLen,dictCountsForMarker=dictCountsForMarker,dID=args.dID,
-                                          strCentCheck=args.strCentroids,dAlnLength=args.dAlnLength,
-                                          iMinReadBP=args.iMinReadBP,iAvgMarkerAA=int(math.floor(args.iAvgReadBP/3)),
-                                          strShortBREDMode=strMethod,iAlnCentroids=args.iAlnCentroids,strSearchMethod = "usearch",
-                                          version_control = strVersionUSEARCH)
-
-                    #Reset count, make new file
-                    iReadsInSmallFile = 0
-                    iFileCount+=1
-                    fileFASTA = open(strFASTAName, 'w')
-            
-            if(iReadsInSmallFile>0):
-                fileFASTA.close()
-                
+            #Start the main loop to get everything in streamWGS -> small fasta files -> counted and stored.
+            #With --pipeline, the next small file is written while usearch searches the current one.
+            chunkerWGS = sq.FastaChunker(streamWGS, strFormat, str(dirTmp) + os.sep + "fasta", c_iReadsForFile)
+            iFileCount = 0
+            for strFASTAName in chunkerWGS.Chunks(args.iPipeline):
+                iFileCount+=1
                 #Run Usearch, store results
                 strOutputName = str(dirTmp) + os.sep + "wgs_" + str(iWGSFileCount).zfill(2) + "out_" + str(iFileCount).zfill(2) + ".out"
-                sq.RunUSEARCH(strWGS=strFASTAName,strDB=strDBName, strSearchOut  = strOutputName,dirTmp=dirTmp,
-                              iThreads=args.iThreads,dID=args.dID,iAccepts=args.iMaxHits, iRejects=args.iMaxRejects,strUSEARCH=args.strUSEARCH )
-                sq.StoreHitCounts(strSearchOut=strOutputName,strValidHits=strHitsFile,dictHitsForMarker=dictHitsForMarker,
-                                  dictMarkerLen=dictMarkerLen,dictCountsForMarker=dictCountsForMarker,dID=args.dID,
+                objSearch = sq.RunUSEARCH(strWGS=strFASTAName,strDB=strDBName, strSearchOut  = strOutputName,dirTmp=dirTmp,
+                              iThreads=args.iThreads,dID=args.dID,iAccepts=args.iMaxHits, iRejects=args.iMaxRejects,strUSEARCH=args.strUSEARCH,bStream=args.bStream )
+                sq.StoreHitCounts(strSearchOut=objSearch,strValidHits=strHitsFile,catMarkers=catMarkers,aiHitsForMarker=aiHitsForMarker,
+                                  adCountsForMarker=adCountsForMarker,dID=args.dID,
                                   strCentCheck=args.strCentroids,dAlnLength=args.dAlnLength,
                                   iMinReadBP=args.iMinReadBP,iAvgMarkerAA=int(math.floor(args.iAvgReadBP/3)),
                                   strShortBREDMode=strMethod,iAlnCentroids=args.iAlnCentroids,strSearchMethod = "usearch",
                                   version_control = strVersionUSEARCH)
                 os.remove(strFASTAName)
             
+            iWGSReads = chunkerWGS.statsReads.iReads
+            statsReads.Merge(chunkerWGS.statsReads)
             log.write(str(iWGSReads) + '\n')
         
             iWGSFileCount += 1
@@ -628,11 +525,11 @@ elif strMethod=="wgs":
 
 if strMethod=="wgs":
     atupCounts = sq.CalculateCounts(strResultsMedian = args.strResultsMedian, strResultsMean = strResultsMean, strMarkerResults=strMarkerResults,
-                                    dictHitsForMarker = dictHitsForMarker, dictCountsForMarker=dictCountsForMarker,dictMarkerLen=dictMarkerLen, 
-                                    iWGSReads = iTotalReadCount, strCentCheck=args.strCentroids,
+                                    catMarkers = catMarkers, aiHitsForMarker=aiHitsForMarker,adCountsForMarker=adCountsForMarker, 
+                                    iWGSReads = statsReads.iReads, strCentCheck=args.strCentroids,
                                     dAlnLength=args.dAlnLength,strFile = strInputFile)
 
-	# Row of atupCounts = (strProtFamily,strMarker, dCount,dictHitsForMarker[strMarker],dictMarkerLen[strMarker],dReadLength,iPossibleHitSpace)
+	# Row of atupCounts = (strProtFamily,strMarker, dCount,aiHitsForMarker[iMarker],catMarkers.aiLength[iMarker],dReadLength,iPossibleHitSpace)
 
 
 
@@ -658,10 +555,12 @@ if strMethod=="annotated_genome" or strMethod=="unannotated_genome":
 
 # Add final details to log
 log.write(time.strftime("%Y-%m-%d %H:%M:%S") +  "\nProcessing complete! \n\n")
-log.write("Total Reads Processed: " + str(iTotalReadCount) + "\n")
+log.write("Total Reads Processed: " + str(statsReads.iReads) + "\n")
+log.write("Total Bases Processed: " + str(statsReads.iBases) + "\n")
 log.write("Average Read Length Specified by User: " + str(args.iAvgReadBP) + "\n")
-log.write("Average Read Length Calculated by ShortBRED: " + str(dAvgReadLength) + "\n")
-log.write("Min Read Length: " + str(iMin) + "\n")
+log.write("Average Read Length Calculated by ShortBRED: " + str(statsReads.Average()) + "\n")
+log.write("Min Read Length: " + str(statsReads.iMin) + "\n")
+log.write("Max Read Length: " + str(statsReads.iMax) + "\n")
 
 
 sys.stderr.write("Processing complete. \n")
@@ -669,6 +568,8 @@ sys.stderr.write("Processing complete. \n")
 # This is part of a possible EM application that is not fully implemented yet.
 ########################################################################################
 #if (args.strBayes != ""):
+#    astrQMs, dictQMPossibleOverlap and dictType would now come from catMarkers
+#    (astrType, aastrQMOverlap by marker index).
 #    sq.BayesUpdate(atupCounts=atupCounts,strBayesResults=args.strBayes,strBayesLog=strQMOut,astrQMs=astrQMs,
 #                   dictQMPossibleOverlap=dictQMPossibleOverlap,dictType=dictType)
 
@@ -8,7 +8,11 @@ Created on Wed Sep 26 14:33:52 2012
 import os
 import subprocess
 import sys
-import distutils.spawn
+try:
+    from shutil import which as find_executable
+except ImportError:
+    # python 2
+    from distutils.spawn import find_executable
 
 def check_create_dir( strDir ):
 
@@ -32,7 +36,7 @@ def CheckDependency(strCmd,strArg,strIntendedProgram):
     #print distutils.spawn.find_executable("muscle")
     #print distutils.spawn.find_executable("cd-hit")
         
-    if ((distutils.spawn.find_executable(strCmd))==None):
+    if ((find_executable(strCmd))==None):
         raise IOError("\nShortBRED was unable to find " +  strIntendedProgram + " at the path *" + strCmd +  "*\nPlease check that the program is installed and the path is correct. Please note that ShortBRED will not be able to use the unix alias for the program.")
         #print "\nShortBRED was unable to load " +  strIntendedProgram + "at the path " + strCmd +  "\nPlease check to make sure the program is installed and the path is correct."
         sys.exit(1)
@@ -31,13 +31,32 @@ ToDo:
 
 
 import subprocess
-from subprocess import Popen, PIPE,STDOUT
+from subprocess import Popen, PIPE
 import csv
 import re
 import sys
 import math
 import os
-import io
+import json
+import hashlib
+import threading
+import shutil
+try:
+    from shutil import which as find_executable
+except ImportError:
+    # python 2
+    from distutils.spawn import find_executable
+import gzip
+import itertools
+from collections import Counter
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 import Bio
 from Bio.Seq import Seq
@@ -94,6 +113,72 @@ def MakedbDIAMOND (strMarkers, strDBName, strDIAMOND):
     return
     
 
+c_dictMarkerDBSuffix = {"usearch": ".udb", "diamond": ".diamdb", "rapsearch2": ".rap2db"}
+
+def ProgramVersion(strProgram, strPath):
+    # The version of the program that builds a marker database, for the
+    # database cache key. When the program cannot report one, the resolved
+    # executable's path, size and modification time stand in for it.
+    try:
+        if strProgram == "usearch":
+            return CheckUSEARCH(strPath)
+        elif strProgram == "diamond":
+            strOutput = subprocess.check_output([strPath, "version"]).decode('utf-8')
+            return strOutput.strip().split(" ")[-1]
+    except (OSError, subprocess.CalledProcessError, IndexError):
+        pass
+    strExe = find_executable(strPath)
+    if strExe is None:
+        return "unknown"
+    statExe = os.stat(strExe)
+    return hashlib.md5((os.path.realpath(strExe) + ":" + str(statExe.st_size) + ":" +
+                        str(int(statExe.st_mtime))).encode('utf-8')).hexdigest()[:12]
+
+def GetMarkerDB(strMarkers, strChecksum, strProgram, strBuilder, dirCache):
+    # Returns the path of the strProgram ("usearch", "diamond" or "rapsearch2")
+    # database of strMarkers, building it with strBuilder (usearch, diamond or
+    # prerapsearch) only if dirCache does not have it yet. Databases are kept
+    # under the marker file checksum, program and program version, so runs on
+    # the same markers share one database. A lock file per database makes
+    # concurrent runs wait for the one that builds it instead of building it
+    # again; the "complete" file is written once the database is usable.
+    strVersion = re.sub(r'[^A-Za-z0-9_.-]', "_", ProgramVersion(strProgram, strBuilder))
+    dirDB = os.path.join(os.path.abspath(dirCache), strProgram + "-" + strVersion + "-" + strChecksum)
+    strDBName = os.path.join(dirDB, "markers" + c_dictMarkerDBSuffix[strProgram])
+    strComplete = os.path.join(dirDB, "complete")
+    if os.path.isfile(strComplete):
+        return strDBName
+
+    if not os.path.isdir(dirCache):
+        try:
+            os.makedirs(dirCache)
+        except OSError:
+            if not os.path.isdir(dirCache):
+                raise
+    with open(dirDB + ".lock", 'a') as fileLock:
+        if fcntl is not None:
+            fcntl.flock(fileLock, fcntl.LOCK_EX)
+        try:
+            if not os.path.isfile(strComplete):
+                # Start over from anything a failed build left behind.
+                if os.path.isdir(dirDB):
+                    shutil.rmtree(dirDB)
+                os.makedirs(dirDB)
+                sys.stderr.write("Making the " + strProgram + " marker database in " + dirDB + "\n")
+                if strProgram == "usearch":
+                    MakedbUSEARCH(strMarkers, strDBName, strBuilder)
+                elif strProgram == "diamond":
+                    MakedbDIAMOND(strMarkers, strDBName, strBuilder)
+                else:
+                    MakedbRapsearch2(strMarkers, strDBName, strBuilder)
+                open(strComplete, 'w').close()
+            else:
+                sys.stderr.write("Using the " + strProgram + " marker database in " + dirDB + "\n")
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fileLock, fcntl.LOCK_UN)
+    return strDBName
+
 def CheckFormat ( strFile):
 	if strFile.find("fastq") > -1:
 		strFormat = "fastq"
@@ -147,6 +232,126 @@ def MakeDictFamilyCounts (strMarkers,strFamilyOut):
 				dictFamMarkerCounts[strFam] = 1
 	return dictFamMarkerCounts
 
+class MarkerCatalog:
+    # Everything quantify needs to know about each marker, worked out once when
+    # the markers are loaded. Markers are numbered in the order of the marker
+    # fasta; StoreHitCounts and CalculateCounts keep hits and counts in lists
+    # addressed by that number instead of parsing the marker ID for every hit.
+    # The catalog is saved next to the marker fasta and reused while the
+    # fasta is unchanged.
+
+    c_iVersion = 1
+
+    def __init__(self,astrMarkers,astrFamily,astrType,aiLength,dictQMWeights,bCentroids=False,strChecksum=""):
+        self.astrMarkers = astrMarkers
+        self.dictIndex = dict((strMarker,iMarker) for iMarker,strMarker in enumerate(astrMarkers))
+        self.astrFamily = astrFamily
+        self.astrType = astrType
+        self.aiLength = aiLength                               # amino acids
+        self.aiMarkerNucs = [iLength*3 for iLength in aiLength]
+        # QM index -> [(family, weight)] from the __[...] part of the marker ID
+        self.dictQMWeights = dictQMWeights
+        self.aastrQMOverlap = [None]*len(astrMarkers)
+        self.bCentroids = bCentroids
+        self.strChecksum = strChecksum
+
+    def __len__(self):
+        return len(self.astrMarkers)
+
+    @classmethod
+    def FromFasta(cls,strMarkers,bCentroids=False,strChecksum=""):
+        astrMarkers = []
+        astrFamily = []
+        astrType = []
+        aiLength = []
+        dictQMWeights = {}
+        for seq in SeqIO.parse(strMarkers, "fasta"):
+            mtchStub = re.search(r'(.*)_(.M)[0-9]*_\#([0-9]*)',seq.id)
+            strType = None
+            if not bCentroids:
+                strType = mtchStub.group(2)
+                if strType == "QM":
+                    # Example: __[ZP_04174269_w=0.541,ZP_04300309_w=0.262,NP_242644_w=0.098]
+                    atupWeights = []
+                    for strFam in re.search(r'\__\[(.*)\]',seq.id).group(1).split(","):
+                        mtchFam = re.search(r'(.*)_w=(.*)',strFam)
+                        atupWeights.append((mtchFam.group(1),float(mtchFam.group(2))))
+                    dictQMWeights[len(astrMarkers)] = atupWeights
+            astrMarkers.append(seq.id)
+            astrFamily.append(mtchStub.group(1) if mtchStub else seq.id)
+            astrType.append(strType)
+            aiLength.append(len(seq))
+        return cls(astrMarkers,astrFamily,astrType,aiLength,dictQMWeights,bCentroids,strChecksum)
+
+    @classmethod
+    def Load(cls,strCatalog):
+        with open(strCatalog, 'r') as fileCatalog:
+            dictCatalog = json.load(fileCatalog)
+        if dictCatalog.get("version") != cls.c_iVersion:
+            raise ValueError("unsupported marker catalog version in " + strCatalog)
+        dictQMWeights = dict((iMarker,[tuple(tupWeight) for tupWeight in atupWeights])
+                             for iMarker,atupWeights in dictCatalog["qm_weights"])
+        return cls(dictCatalog["markers"],dictCatalog["families"],dictCatalog["types"],dictCatalog["lengths"],
+                   dictQMWeights,dictCatalog["centroids"],dictCatalog["checksum"])
+
+    def Save(self,strCatalog):
+        # Written under a temporary name and renamed, as quantify jobs running
+        # in parallel on the same markers may all try to save the catalog.
+        dictCatalog = {"version": self.c_iVersion, "checksum": self.strChecksum, "centroids": self.bCentroids,
+                       "markers": self.astrMarkers, "families": self.astrFamily, "types": self.astrType,
+                       "lengths": self.aiLength, "qm_weights": sorted(self.dictQMWeights.items())}
+        strTmp = strCatalog + ".tmp" + str(os.getpid())
+        with open(strTmp, 'w') as fileCatalog:
+            json.dump(dictCatalog, fileCatalog)
+        os.rename(strTmp, strCatalog)
+
+    def SetQMOverlap(self,iMinReadBP,dAlnLength):
+        # Only retain those families which could validly map to each QM at the given settings.
+        dMainFamProp = None
+        for iMarker in sorted(self.dictQMWeights.keys()):
+            astrFams = []
+            for strID,dProp in self.dictQMWeights[iMarker]:
+                if strID == self.astrFamily[iMarker]:
+                    dMainFamProp = dProp
+                dLenOverlap = (dProp/dMainFamProp) * self.aiLength[iMarker]
+
+                # Reads from current family can map to the QM if overlap is as long
+                # as the minimum accepted read length. Or if it nearly overlaps
+                # the entire marker
+                if (dLenOverlap >= (iMinReadBP/3)) or (dProp/dMainFamProp) >= dAlnLength:
+                    astrFams.append(strID)
+            self.aastrQMOverlap[iMarker] = astrFams
+
+def MarkerChecksum(strMarkers):
+    md5 = hashlib.md5()
+    with open(strMarkers, 'rb') as fileMarkers:
+        for abBlock in iter(lambda: fileMarkers.read(1 << 20), b""):
+            md5.update(abBlock)
+    return md5.hexdigest()
+
+def GetMarkerCatalog(strMarkers,bCentroids=False,strCatalog=""):
+    # Returns the MarkerCatalog of strMarkers, from strCatalog (default: the
+    # marker fasta name + ".catalog") if it was built from the same markers,
+    # otherwise built from the fasta and saved there for the next run.
+    if strCatalog == "":
+        strCatalog = strMarkers + ".catalog"
+    strChecksum = MarkerChecksum(strMarkers)
+    if os.path.isfile(strCatalog):
+        try:
+            catMarkers = MarkerCatalog.Load(strCatalog)
+            if catMarkers.strChecksum == strChecksum and catMarkers.bCentroids == bCentroids:
+                sys.stderr.write("Using the marker catalog " + strCatalog + "\n")
+                return catMarkers
+        except (ValueError, KeyError, IOError):
+            pass
+    sys.stderr.write("Building the marker catalog... \n")
+    catMarkers = MarkerCatalog.FromFasta(strMarkers,bCentroids,strChecksum)
+    try:
+        catMarkers.Save(strCatalog)
+    except (IOError, OSError) as e:
+        sys.stderr.write("WARNING: could not save the marker catalog to " + strCatalog + ": " + str(e) + "\n")
+    return catMarkers
+
 def CalcFinalCount (dictORFMatches,dictFamMarkerCounts,bUnannotated,dPctORFScoreThresh,dPctMarkerThresh):
     # Takes two dictionaries, each have protein families has the keys.
 	# One has the number of markers hitting the ORF, the other has all possible markers.
@@ -256,24 +461,40 @@ def NormalizeGenomeCounts (strValidHits,dictFamCounts,bUnannotated,dPctORFScoreT
 	return dictFinalCounts
 
 
-def RunUSEARCH (strWGS,strSearchOut , strDB,iThreads,dID, dirTmp, iAccepts, iRejects,strUSEARCH):
+def StreamSearch(astrCmd, **kwargs):
+    # Starts a search program that writes its tabular results to stdout. The
+    # process is handed to StoreHitCounts, which counts the hits as they are
+    # produced, so the full search output never has to be written to disk.
+    return Popen(astrCmd, stdout=PIPE, universal_newlines=True, **kwargs)
+
+def RunUSEARCH (strWGS,strSearchOut , strDB,iThreads,dID, dirTmp, iAccepts, iRejects,strUSEARCH,bStream=False):
     # Calls usearch, strFields specifies the output format from usearch.
+    # Returns what StoreHitCounts should read: strSearchOut, or with bStream
+    # the running usearch process.
 
 	strFields = "query+target+id+alnlen+ql+mism+opens+qlo+qhi+tlo+thi+evalue+bits+ql"
 
-	subprocess.check_call([
+	astrCmd = [
 #		"time","-o", str(dirTmp) + os.sep + os.path.basename(strWGS) + ".time",
 		strUSEARCH, "--usearch_local", strWGS, "--db", strDB,
-		"--id", str(dID),"--userout", strSearchOut ,"--userfields", strFields,"--maxaccepts",str(iAccepts),
-		"--maxrejects",str(iRejects),"--threads", str(iThreads)])
+		"--id", str(dID),"--userout", "/dev/stdout" if bStream else strSearchOut ,"--userfields", strFields,"--maxaccepts",str(iAccepts),
+		"--maxrejects",str(iRejects),"--threads", str(iThreads)]
+
+	if bStream:
+		return StreamSearch(astrCmd)
+	subprocess.check_call(astrCmd)
+	return strSearchOut
   
-def RunRAPSEARCH2 (strWGS,strSearchOut , strDB,iThreads,dID, dirTmp, iAccepts, iRejects,strRAPSEARCH2):
+def RunRAPSEARCH2 (strWGS,strSearchOut , strDB,iThreads,dID, dirTmp, iAccepts, iRejects,strRAPSEARCH2,bStream=False):
     # Calls rapsearch2. It currently does not output the length of the wgs reads, which we use use to 1) filter low reads and .
+    # With bStream, "-u 1" makes rapsearch2 write its m8 results to stdout and the running process is returned.
 
     with open(strWGS,"r") as streamSeq:
+        if bStream:
+            return StreamSearch([strRAPSEARCH2,"-q","stdin","-d", strDB,"-o",strSearchOut,"-u","1" ],stdin=streamSeq)
         p = Popen([strRAPSEARCH2,"-q","stdin","-d", strDB,"-o",strSearchOut ],stdin=streamSeq,stdout=PIPE)
         p.communicate()
-        return
+        return strSearchOut
     
 
     """
@@ -325,7 +546,7 @@ def RunTBLASTN ( strTBLASTN, strDB,strGenome, strSearchOut , iThreads):
 	subprocess.check_call(
 		[strTBLASTN, "-db", strDB,"-query", strGenome,"-out",strSearchOut ] +  astrBlastParams)
 
-def RunDIAMONDx (strDIAMOND, strDB, strWGS, strDiamondOut, iThreads):
+def RunDIAMONDx (strDIAMOND, strDB, strWGS, strDiamondOut, iThreads, bStream=False):
     astrDIAMONDParams = ["--outfmt", "6","qseqid","sseqid","pident","length","qlen","mismatch","gaps","qstart","qend","sstart","send",
                          "evalue","bitscore","qlen", "--matrix", "BLOSUM62",
                        "--comp-based-stats","0","--window","0","--ungapped-score","20",
@@ -336,12 +557,16 @@ def RunDIAMONDx (strDIAMOND, strDB, strWGS, strDiamondOut, iThreads):
     
     cmdRun = [
 #        "time", "-o", dirTime + os.sep +"goisearch.time",
-        strDIAMOND,"blastx", "--query", strWGS, "--db", strDB,
-        "--out", strDiamondOut] + astrDIAMONDParams
+        strDIAMOND,"blastx", "--query", strWGS, "--db", strDB] + astrDIAMONDParams
+
+    # Without --out, diamond writes the results to stdout.
+    if bStream:
+        return StreamSearch(cmdRun)
+    cmdRun += ["--out", strDiamondOut]
             
     #sys.stderr.write(" ".join(cmdRun))
     subprocess.check_call(cmdRun)    
-    return
+    return strDiamondOut
 
 def RunDIAMONDp (strDIAMOND, strDB, strGenome, strDiamondOut, iThreads):
     astrDIAMONDParams = ["--outfmt", "6","qseqid","sseqid","pident","length","mismatch","gaps","qstart","qend","sstart","send",
@@ -376,11 +601,289 @@ def Mean(adValues):
     dMean = sum(adValues) / iLen
     return dMean
 
-def StoreHitCounts(strSearchOut ,strValidHits,dictHitsForMarker,dictMarkerLen,dictCountsForMarker, dID,strCentCheck,dAlnLength,iMinReadBP,iAvgMarkerAA,strSearchMethod, strShortBREDMode="wgs",iAlnCentroids=30,version_control = 1):
+class ReadStats:
+    # Read count, total bases, minimum and maximum read length and a read
+    # length histogram of one wgs file. ScanReadStats works them out from the
+    # raw bytes, and they are saved next to the wgs file (strWGS + ".readstats")
+    # so later runs on the same, unchanged file skip the scan.
+
+    # Version 1 sidecars could count text before the first fasta header as a read.
+    c_iVersion = 2
+
+    def __init__(self,iReads=0,iBases=0,iMin=None,iMax=0,dictHistogram=None):
+        self.iReads = iReads
+        self.iBases = iBases
+        self.iMin = iMin
+        self.iMax = iMax
+        self.dictHistogram = Counter(dictHistogram or {})
+
+    def Add(self,aiLengths):
+        if not aiLengths:
+            return
+        self.iReads += len(aiLengths)
+        self.iBases += sum(aiLengths)
+        iMin = min(aiLengths)
+        self.iMin = iMin if self.iMin is None else min(self.iMin, iMin)
+        self.iMax = max(self.iMax, max(aiLengths))
+        self.dictHistogram.update(aiLengths)
+
+    def Merge(self,statsOther):
+        self.iReads += statsOther.iReads
+        self.iBases += statsOther.iBases
+        if statsOther.iMin is not None:
+            self.iMin = statsOther.iMin if self.iMin is None else min(self.iMin, statsOther.iMin)
+        self.iMax = max(self.iMax, statsOther.iMax)
+        self.dictHistogram.update(statsOther.dictHistogram)
+
+    def Average(self):
+        return self.iBases / float(self.iReads) if self.iReads > 0 else 0.0
+
+    @staticmethod
+    def FileKey(strWGS):
+        statWGS = os.stat(strWGS)
+        return [statWGS.st_size, int(statWGS.st_mtime)]
+
+    @classmethod
+    def Load(cls,strSidecar,strWGS):
+        # Returns the saved stats, or None if there are none for this version of strWGS.
+        try:
+            with open(strSidecar, 'r') as fileStats:
+                dictStats = json.load(fileStats)
+            if dictStats.get("version") != cls.c_iVersion or dictStats.get("file") != cls.FileKey(strWGS):
+                return None
+            return cls(dictStats["reads"],dictStats["bases"],dictStats["min"],dictStats["max"],
+                       dict((int(iLength),iCount) for iLength,iCount in dictStats["histogram"]))
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+    def Save(self,strSidecar,strWGS):
+        dictStats = {"version": self.c_iVersion, "file": self.FileKey(strWGS), "reads": self.iReads,
+                     "bases": self.iBases, "min": self.iMin, "max": self.iMax,
+                     "histogram": sorted(self.dictHistogram.items())}
+        strTmp = strSidecar + ".tmp" + str(os.getpid())
+        with open(strTmp, 'w') as fileStats:
+            json.dump(dictStats, fileStats)
+        os.rename(strTmp, strSidecar)
+
+def FastaRecordLength(abRecord):
+    # Sequence length of one fasta record (header line first, without its
+    # ">"), leaving out line breaks and spaces as SeqIO does.
+    iHeaderEnd = abRecord.find(b"\n")
+    if iHeaderEnd < 0:
+        return 0
+    return (len(abRecord) - iHeaderEnd - abRecord.count(b"\n", iHeaderEnd) -
+            abRecord.count(b"\r", iHeaderEnd) - abRecord.count(b" ", iHeaderEnd))
+
+def ScanReadStats(strWGS,iBlock=1 << 24):
+    # ReadStats of a fasta or fastq file (gzipped if it ends in .gz), read in
+    # large blocks of bytes instead of one SeqIO record at a time.
+    statsWGS = ReadStats()
+    fileWGS = gzip.open(strWGS, 'rb') if strWGS.endswith(".gz") else open(strWGS, 'rb')
+    try:
+        abFirst = fileWGS.read(iBlock)
+        if abFirst.lstrip()[:1] == b"@":
+            # fastq: four lines per read, the second one is the sequence
+            fileWGS.seek(0)
+            for abLines in iter(lambda: list(itertools.islice(fileWGS, 4 * 100000)), []):
+                statsWGS.Add([len(abLine.rstrip()) for abLine in abLines[1::4]])
+            return statsWGS
+
+        # fasta: every record starts with "\n>"; the last, possibly incomplete,
+        # record of each block is carried over to the next one. Text before
+        # the first header line is not a read, as in SeqIO, however the blocks
+        # happen to split it.
+        abTail = b"\n"
+        bInRecords = False
+        abBlock = abFirst
+        while abBlock:
+            aabRecords = (abTail + abBlock).split(b"\n>")
+            abTail = aabRecords.pop()
+            if aabRecords:
+                if not bInRecords:
+                    aabRecords = aabRecords[1:]
+                    bInRecords = True
+                statsWGS.Add([FastaRecordLength(abRecord) for abRecord in aabRecords])
+            elif not bInRecords:
+                # still before the first header: only a line end can matter
+                abTail = abTail[-1:]
+            abBlock = fileWGS.read(iBlock)
+        if bInRecords:
+            statsWGS.Add([FastaRecordLength(abTail + b"\n")])
+    finally:
+        fileWGS.close()
+    return statsWGS
+
+class ReadStatsScanner:
+    # Gets the ReadStats of a wgs file: from its sidecar file if an earlier
+    # run saved them, otherwise by scanning it on a separate thread, so the
+    # scan runs while the file is searched. Result() waits for the scan and
+    # saves the sidecar for the next run.
+
+    def __init__(self,strWGS):
+        self.strWGS = strWGS
+        self.strSidecar = strWGS + ".readstats"
+        self.excScan = None
+        self.threadScan = None
+        self.statsWGS = ReadStats.Load(self.strSidecar, strWGS)
+        if self.statsWGS is None:
+            self.threadScan = threading.Thread(target=self.Scan)
+            self.threadScan.daemon = True
+            self.threadScan.start()
+
+    def Scan(self):
+        try:
+            self.statsWGS = ScanReadStats(self.strWGS)
+        except Exception as e:
+            self.excScan = e
+
+    def Result(self):
+        if self.threadScan is not None:
+            self.threadScan.join()
+            self.threadScan = None
+            if self.excScan is not None:
+                raise self.excScan
+            try:
+                self.statsWGS.Save(self.strSidecar, self.strWGS)
+            except (IOError, OSError) as e:
+                sys.stderr.write("WARNING: could not save the read statistics to " + self.strSidecar + ": " + str(e) + "\n")
+        return self.statsWGS
+
+class FastaChunker:
+    # Splits the reads of a (possibly compressed) wgs stream into fasta files of
+    # iReadsPerFile reads for usearch, skipping reads of iMaxReadLength or more,
+    # and collects the ReadStats of the reads it keeps as it goes.
+    #
+    # Chunks() yields the chunk files in order. With iInFlight > 0 they are
+    # written on a separate thread, so the next chunk is converted while the
+    # caller searches the current one; at most iInFlight finished chunks wait
+    # on disk for the search. Callers remove each chunk once it is searched.
+
+    def __init__(self,streamWGS,strFormat,strPrefix,iReadsPerFile,iMaxReadLength=50000):
+        self.streamWGS = streamWGS
+        self.strFormat = strFormat
+        self.strPrefix = strPrefix
+        self.iReadsPerFile = iReadsPerFile
+        self.iMaxReadLength = iMaxReadLength
+        self.statsReads = ReadStats()
+        self.evStop = threading.Event()
+
+    def Write(self):
+        iFileCount = 1
+        aiLengths = []
+        strFASTAName = self.strPrefix + "_" + str(iFileCount).zfill(2) + ".fna"
+        fileFASTA = open(strFASTAName, 'w')
+        for seq in SeqIO.parse(self.streamWGS, self.strFormat):
+            if self.evStop.is_set():
+                break
+            #Added to keep usearch from hitting seqs that are too long.
+            if len(seq)< self.iMaxReadLength:
+                SeqIO.write(seq,fileFASTA,"fasta")
+                aiLengths.append(len(seq))
+
+            #Close the temp fasta file once it has enough reads.
+            if (len(aiLengths)>=self.iReadsPerFile):
+                fileFASTA.close()
+                self.statsReads.Add(aiLengths)
+                yield strFASTAName
+                aiLengths = []
+                iFileCount+=1
+                strFASTAName = self.strPrefix + "_" + str(iFileCount).zfill(2) + ".fna"
+                fileFASTA = open(strFASTAName, 'w')
+
+        fileFASTA.close()
+        self.statsReads.Add(aiLengths)
+        if aiLengths:
+            yield strFASTAName
+        else:
+            os.remove(strFASTAName)
+
+    def Produce(self,queueChunks):
+        try:
+            for strFASTAName in self.Write():
+                queueChunks.put(strFASTAName)
+                if self.evStop.is_set():
+                    break
+        except Exception as e:
+            queueChunks.put(e)
+        queueChunks.put(None)
+
+    def Chunks(self,iInFlight=0):
+        if iInFlight <= 0:
+            for strFASTAName in self.Write():
+                yield strFASTAName
+            return
+
+        queueChunks = queue.Queue(iInFlight)
+        threadProducer = threading.Thread(target=self.Produce, args=(queueChunks,))
+        threadProducer.daemon = True
+        threadProducer.start()
+        try:
+            while True:
+                objChunk = queueChunks.get()
+                if objChunk is None:
+                    break
+                if isinstance(objChunk, Exception):
+                    raise objChunk
+                yield objChunk
+        finally:
+            # If the search failed, stop the producer, unblock it and remove
+            # the chunks it wrote ahead.
+            self.evStop.set()
+            while threadProducer.is_alive() or not queueChunks.empty():
+                try:
+                    objChunk = queueChunks.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if objChunk is not None and not isinstance(objChunk, Exception):
+                    os.remove(objChunk)
+            threadProducer.join()
+
+class OpenSearchOut(object):
+    # Opens the search output read by StoreHitCounts: either a file, or the
+    # stdout of a process started by StreamSearch. For a process, the lines are
+    # copied to strSearchCopy (if given) and closing waits for the search to
+    # finish, raising CalledProcessError if it failed, as check_call does.
+    def __init__(self, objSearchOut, strSearchCopy=""):
+        self.pSearch = objSearchOut if isinstance(objSearchOut, Popen) else None
+        self.fileCopy = None
+        if self.pSearch is None:
+            self.fileSearch = open(objSearchOut, 'r')
+        else:
+            self.fileSearch = self.pSearch.stdout
+            if strSearchCopy != "":
+                self.fileCopy = open(strSearchCopy, 'w')
+
+    def __iter__(self):
+        for strLine in self.fileSearch:
+            if self.fileCopy is not None:
+                self.fileCopy.write(strLine)
+            yield strLine
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if self.fileCopy is not None:
+            self.fileCopy.close()
+        if self.pSearch is None:
+            self.fileSearch.close()
+            return False
+        if excType is not None and self.pSearch.poll() is None:
+            self.pSearch.kill()
+        self.fileSearch.close()
+        iReturn = self.pSearch.wait()
+        if excType is None and iReturn != 0:
+            raise subprocess.CalledProcessError(iReturn, self.pSearch.args if hasattr(self.pSearch, "args") else "search")
+        return False
+
+def StoreHitCounts(strSearchOut ,strValidHits,catMarkers,aiHitsForMarker,adCountsForMarker, dID,strCentCheck,dAlnLength,iMinReadBP,iAvgMarkerAA,strSearchMethod, strShortBREDMode="wgs",iAlnCentroids=30,version_control = 1,strSearchCopy=""):
 # Reads in the USEARCH output (strSearchOut ), marks which hits are valid (id>=dID &
-# len >= min(95% of read,dictMarkerLen[Marker]) and adds to count in dictHitsForMarker[strMarker].
+# len >= min(95% of read,marker length) and adds to count in aiHitsForMarker[iMarker],
+# where iMarker is the index of the marker in catMarkers.
 # Valid hits are also copied to the file in strValidHits. strCentCheck is used to flag centroids,
 # and handle their counting
+# strSearchOut may also be a search process from StreamSearch; its output is then
+# counted as it is produced, and copied to strSearchCopy if one is given.
     
     
 
@@ -389,14 +892,22 @@ def StoreHitCounts(strSearchOut ,strValidHits,dictHitsForMarker,dictMarkerLen,di
     else:
         len_control = version_control
     
+    dictIndex = catMarkers.dictIndex
+    aiLength = catMarkers.aiLength
+    aiMarkerNucs = catMarkers.aiMarkerNucs
+
     # If the version in use is newer than 6.0.307,     
     with open(strValidHits, 'a') as csvfileHits:
         csvwHits = csv.writer( csvfileHits, csv.excel_tab )
         sys.stderr.write("Processing %s results... \n" % strSearchMethod.upper())
         #Go through the usearch output, for each prot family, record the number of valid
-        with open(strSearchOut , 'r') as csvfileSearch:
+        with OpenSearchOut(strSearchOut, strSearchCopy) as csvfileSearch:
             for aLine in csv.reader( csvfileSearch, delimiter='\t' ):
+                # rapsearch2 starts its m8 output with comment lines
+                if not aLine or aLine[0].startswith("#"):
+                    continue
                 strMarker 	= aLine[1]
+                iMarker     = dictIndex[strMarker]
                 dHitID		= aLine[2]      # percentage of alignment
                 iAlnLen     = int(aLine[3])   # alignment length
                 RLen        = int(aLine[4])          # read length
@@ -415,19 +926,14 @@ def StoreHitCounts(strSearchOut ,strValidHits,dictHitsForMarker,dictMarkerLen,di
                 # (Note that this in AA's.)
                 #If using centroids (Typically only used for evaluation purposes.)....
                 if strCentCheck=="Y":
-                    strProtFamily = strMarker
-                    
                     if ( (int(iAlnLen)>= iAlnCentroids) and ( float(dHitID)/100) >= dID):
-                        dictHitsForMarker[strProtFamily] = dictHitsForMarker.setdefault(strProtFamily,0) + 1
+                        aiHitsForMarker[iMarker] += 1
                         csvwHits.writerow( aLine )
                     
                 
                 #If using ShortBRED Markers (and not centroids)...
                 else:
-                    iAlnMin = min(dictMarkerLen[strMarker],math.floor(RLen*dAlnLength/3)) # marker length
-                    #Get the Family Name
-                    mtchProtStub = re.search(r'(.*)_(.M)[0-9]*_\#([0-9]*)',strMarker)
-                    strProtFamily = mtchProtStub.group(1)
+                    iAlnMin = min(aiLength[iMarker],math.floor(RLen*dAlnLength/3)) # marker length
                     """
                     if(float(dHitID)>.9):
                         sys.stderr.write( " ".join([str(iAlnLen),str(iAlnMin),str(dHitID),str(dID),str(iReadLenAA),str(iMinMarkerAA)] ) +"\n")
@@ -440,7 +946,7 @@ def StoreHitCounts(strSearchOut ,strValidHits,dictHitsForMarker,dictMarkerLen,di
                         # that shortbred will process
                         
                         #Add 1 to count of hits for that marker, and family
-                        iMarkerNucs = dictMarkerLen[strMarker]*3
+                        iMarkerNucs = aiMarkerNucs[iMarker]
                         dPctAdditionalTargetSeq = ((1.0 - dAlnLength)*2.0)*RLen
                         
                         if (iMarkerNucs > (RLen*dAlnLength)):
@@ -449,8 +955,8 @@ def StoreHitCounts(strSearchOut ,strValidHits,dictHitsForMarker,dictMarkerLen,di
                         else:
                             iPossibleHitSpace = RLen-iMarkerNucs -1
 
-                        dictHitsForMarker[aLine[1]] = dictHitsForMarker.setdefault(aLine[1],0) + 1
-                        dictCountsForMarker[aLine[1]] += float(1/iPossibleHitSpace)
+                        aiHitsForMarker[iMarker] += 1
+                        adCountsForMarker[iMarker] += float(1/iPossibleHitSpace)
                         csvwHits.writerow( aLine )
     return
 
@@ -534,13 +1040,13 @@ def PrintStats(atupCurFamData, strMarkerFile, strFamFileMedian, strFamFileMean):
 
 	return
 
-def CalculateCounts(strResultsMedian, strResultsMean, strMarkerResults, dictHitsForMarker, dictCountsForMarker,dictMarkerLen,iWGSReads,strCentCheck,
+def CalculateCounts(strResultsMedian, strResultsMean, strMarkerResults, catMarkers, aiHitsForMarker, adCountsForMarker,iWGSReads,strCentCheck,
 dAlnLength,strFile):
     #strResultsMedian - Name of text file with final ShortBRED Counts
     #strSearchOut - BLAST-formatted output from USEARCH/RAPSEARCH2/DIAMOND
     #strValidHits - File of BLAST hits that meet ShortBRED's ID and Length criteria. Mainly used for evaluation/debugging.
-    #dictMarkerLenAll - Contains the sum of marker lengths for all markers in a family
-    #dictMarkerLen - Contains each marker/centroid length
+    #catMarkers - MarkerCatalog with each marker/centroid family and length
+    #aiHitsForMarker, adCountsForMarker - Hits and counts from StoreHitCounts, by marker index
     
     atupMarkerCounts = []
     
@@ -549,19 +1055,18 @@ dAlnLength,strFile):
     #csvwResults.writerow(["Marker","Normalized Count","Hits","MarkerLength","ReadLength"])
     
     sys.stderr.write("Tabulating results for each marker... \n")
-    for strMarker in dictHitsForMarker.keys():
-        iHits = dictHitsForMarker.get(strMarker,0)        
-        iMarkerNucs = dictMarkerLen[strMarker]*3
+    for iMarker,strMarker in enumerate(catMarkers.astrMarkers):
+        iHits = aiHitsForMarker[iMarker]
+        iMarkerNucs = catMarkers.aiMarkerNucs[iMarker]
         if strCentCheck=="Y":
             strProtFamily = strMarker
             dCount = iHits / (float(iMarkerNucs)/1000)
             iPossibleHitSpace = float(iMarkerNucs)
             dCount = iHits/(float(iPossibleHitSpace)/1000)
         else:
-            dCount = dictCountsForMarker[strMarker]
+            dCount = adCountsForMarker[iMarker]
             
-        mtchProtStub = re.search(r'(.*)_(.M)[0-9]*_\#([0-9]*)',strMarker)
-        strProtFamily = mtchProtStub.group(1)
+        strProtFamily = catMarkers.astrFamily[iMarker]
         
         if iWGSReads >0:
             dCount =  dCount /  (iWGSReads / 1e9 )
@@ -571,7 +1076,7 @@ dAlnLength,strFile):
             sys.stderr.write(str(strFile))            
             sys.stderr.write("WARNING: 0 Reads found in file:" + strFile )
         
-        tupCount = (strProtFamily,strMarker, dCount,dictHitsForMarker[strMarker],dictMarkerLen[strMarker])
+        tupCount = (strProtFamily,strMarker, dCount,iHits,catMarkers.aiLength[iMarker])
         atupMarkerCounts.append(tupCount)
     
     ProcessHitData(atupMarkerCounts, strMarkerResults=strMarkerResults, strFamFileMedian = strResultsMedian, strFamFileMean = strResultsMean)
@@ -1,178 +1,1426 @@
 #!/usr/bin/env python
 
+from __future__ import print_function
+
 import h5py
+import numpy as np
+import bz2
 import collections
+import io
+import json
 import math
+import mmap
+import multiprocessing
+import os
 import argparse
 import re
+import resource
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+try:
+  import queue
+except ImportError:
+  import Queue as queue
+
+try:
+  import zstandard
+except ImportError:
+  zstandard=None
+
+LOG2=math.log(2)
+LOG10=math.log(10)
+
+#the query and subject id columns at the start of each 1.out line
+ID_COLUMNS=re.compile(r'(?m)^[^\t\n]*\t[^\t\n]*\t')
+
+#numpy 1.23 replaced the python loadtxt implementation with a much faster C parser
+FAST_LOADTXT=np.lib.NumpyVersion(np.__version__)>='1.23.0'
+
+#columns of the /summary/align and /summary/perid datasets, one row per e-value bin
+SUMMARY_COLUMNS=['min','lowerhinge','median','upperhinge','max','lowerwhisker','upperwhisker','n']
+
+#value of the root version attribute for files with the csr layout; files without the attribute use the bins layout
+CSR_VERSION=2
+
+#value of the root partial attribute of files written with --partial
+PARTIAL_VERSION=1
+
+#bytes at each end of the fasta file included in the length cache checksum
+CACHE_CHECK_BYTES=1024*1024
+
+#leading bytes of compressed inputs
+GZIP_MAGIC=b'\x1f\x8b'
+BZIP2_MAGIC=b'BZh'
+ZSTD_MAGIC=b'\x28\xb5\x2f\xfd'
+
+#decompressed blocks that may wait between the reading thread and the parser
+QUEUE_DEPTH=4
+
+#image sizes in pixels of the graphs drawn with --png-dir, the same as the R scripts and the graph job use
+BOX_PLOT_SIZE=(2000, 900)
+BAR_PLOT_SIZE=(1800, 900)
+SMALL_PLOT_SIZE=(700, 315)
+
+#multiplier of the 64 bit sequence id hashes used to count distinct nodes
+ID_HASH_PRIME=np.uint64(1099511628211)
+
+#bytes held in memory per buffered edge in streaming mode (one int64 and one float64)
+EDGE_BYTES=16
+
+#--storage profiles: compression filter, filter level and target bytes per chunk of the value datasets;
+#"default" keeps the uncompressed -c/2 row chunks of earlier versions
+STORAGE_PROFILES=collections.OrderedDict([
+  ('default', (None, None, None)),
+  ('fast-write', ('lzf', None, 1024*1024)),
+  ('small', ('gzip', 9, 512*1024)),
+  ('remote-read', ('gzip', 4, 4*1024*1024)),
+])
+
+
+def name_value(value):
+  """ argparse type for NAME=VALUE options """
+  name, sep, path=value.partition('=')
+  if not sep or not name or not path or '/' in name:
+    raise argparse.ArgumentTypeError("expected NAME=VALUE, got %s" % value)
+  return name, path
+
+
+def get_args():
+  parser=argparse.ArgumentParser(description='create hdf5 file for creating quartile plots of blast out put in R')
+  parser.add_argument('-f','--hdf5',dest='hdf',help='path to the hdf5 file', type=str, required=True)
+  parser.add_argument('-b','--blast',dest='blast',help='path to the 1.out blast file output, which may be gzip, bzip2 or zstd compressed, or - for stdin', type=str)
+  parser.add_argument('-c','--chunksize',dest='chunksize',help='size of hdf5 chunks to process', default=10000, type=int)
+  parser.add_argument('--storage',dest='storage',help='chunking and compression of the hdf5 datasets: "fast-write" uses lzf, "small" gzip level 9 and "remote-read" gzip with large chunks for fewer reads over network file systems, all with shuffle; R needs rhdf5filters to read lzf data', choices=list(STORAGE_PROFILES), default='default')
+  parser.add_argument('-i','--incfrac',dest='incfrac',help='center fraction of all sequences to keep',default=0.99, type=float)
+  parser.add_argument('-a','--fasta',dest='fasta',help='path of the fasta file, which may be gzip, bzip2 or zstd compressed, or - for stdin',type=str)
+  parser.add_argument('-s','--stream',dest='stream',help='write edges to the hdf5 file as 1.out is read instead of holding them all in memory', action='store_true')
+  parser.add_argument('-m','--max-memory',dest='maxmem',help='approximate ceiling in MB on the edge data buffered in streaming mode', default=1024, type=int)
+  parser.add_argument('--summary',dest='summary',help='write exact box plot statistics per e-value bin to /summary instead of the raw /align and /perid values', action='store_true')
+  parser.add_argument('--perid-precision',dest='peridprec',help='number of decimal places of percent identity kept when edges are counted into histograms (--summary, --workers or --partial)', default=2, type=int)
+  parser.add_argument('-w','--workers',dest='workers',help='read 1.out with this many processes; each counts part of the file into histograms that are merged afterwards', default=1, type=int)
+  parser.add_argument('-l','--layout',dest='layout',help='how raw values are stored: "bins" writes one /align/<bin> and /perid/<bin> dataset per e-value bin, "csr" writes single /align/values and /perid/values arrays indexed by /offsets', choices=['bins','csr'], default='bins')
+  parser.add_argument('--read-size',dest='readsize',help='number of bytes of 1.out to read per block', default=16*1024*1024, type=int)
+  parser.add_argument('--no-length-cache',dest='lengthcache',help='do not read or write the <fasta>.lenhisto.json sequence length cache', action='store_false')
+  parser.add_argument('-n','--length',dest='lengths',help='also write the length histogram of PATH, a fasta file or a length<TAB>count table such as length_uniprot.tab, to /lenhisto/NAME; the -a histogram then goes to /lenhisto/sequences', type=name_value, action='append', default=[], metavar='NAME=PATH')
+  parser.add_argument('--no-thresholds',dest='thresholds',help='do not count the distinct sequences at each alignment score for /thresholds/nodes, which saves reading the ids in 1.out', action='store_false')
+  parser.add_argument('--png-dir',dest='pngdir',help='also draw the alignment length, percent identity, edge and length graphs as png files in this directory (needs matplotlib)', type=str)
+  parser.add_argument('--job-id',dest='jobid',help='job id shown in the titles of the --png-dir graphs', type=str, default='')
+  parser.add_argument('--length-title',dest='lengthtitles',help='title shown with the --png-dir graph of length source NAME', type=name_value, action='append', default=[], metavar='NAME=TITLE')
+  parser.add_argument('--timings',dest='timings',help='write the time taken by each phase, the peak memory use and the output size to this json file', type=str)
+  parser.add_argument('-p','--partial',dest='partial',help='only count the edges of -b (e.g. one blast shard) into histograms and write them to -f for a later --reduce', action='store_true')
+  parser.add_argument('-r','--reduce',dest='reduce',help='build the graph data from files written with --partial instead of reading -b', nargs='+', metavar='PARTIAL')
+  args=parser.parse_args()
+  if args.reduce and (args.blast or args.partial):
+    parser.error('--reduce reads partial files and cannot be used with -b or --partial')
+  if not args.reduce and not args.blast:
+    parser.error('-b is required unless --reduce is given')
+  if not args.partial and not args.fasta:
+    parser.error('-a is required unless --partial is given')
+  if args.blast=='-' and args.fasta=='-':
+    parser.error('only one of -b and -a can be read from stdin')
+  names=[name for name, path in args.lengths]
+  if 'sequences' in names or len(set(names))!=len(names):
+    parser.error('--length names must be unique and cannot be "sequences"')
+  if args.summary and args.layout!='bins':
+    parser.error('--layout only applies to raw values and cannot be used with --summary')
+  return args
+
+
+#-------------------------------------------------------------------------------
+# opening inputs
+#-------------------------------------------------------------------------------
+
+def open_raw(path):
+  if path=='-':
+    return getattr(sys.stdin, 'buffer', sys.stdin)
+  return io.open(path, 'rb')
+
 
-parser=argparse.ArgumentParser(description='create hdf5 file for creating quartile plots of blast out put in R')
-parser.add_argument('-f','--hdf5',dest='hdf',help='path to the hdf5 file', type=str, required=True)
-parser.add_argument('-b','--blast',dest='blast',help='path to the 1.out blast file output', type=file, required=True)
-parser.add_argument('-c','--chunksize',dest='chunksize',help='size of hdf5 chunks to process', default=10000, type=int)
-parser.add_argument('-i','--incfrac',dest='incfrac',help='center fraction of all sequences to keep',default=0.99, type=float)
-parser.add_argument('-a','--fasta',dest='fasta',help='path of the fasta file',type=file, required=True)
-args=parser.parse_args()
-
-hdfFile = h5py.File(args.hdf, "w")
-blastIn=args.blast
-chunksize=args.chunksize
-incfrac=args.incfrac
-
-dataSetHash=collections.defaultdict(dict)
-evalueHisto=[]
-size=0
-maxy=0
-
-#read the blast output and populate data structure
-#there is a bug in h5py that prevents us form adding data to the hdf as we go
-print("read blast")
-for line in blastIn:
-  #print(line.rstrip())
-  lineary=line.rstrip().split('\t')
-  evalue=int(-(math.log(int(lineary[5])*int(lineary[6]))/math.log(10))+float(lineary[4])*math.log(2)/math.log(10))
+def is_plain_file(path):
+  """ True for an uncompressed file that can be memory mapped or read in byte ranges """
+  if path=='-' or not os.path.isfile(path):
+    return False
+  with io.open(path, 'rb') as fh:
+    magic=fh.read(4)
+  return not (magic.startswith(GZIP_MAGIC) or magic.startswith(BZIP2_MAGIC) or magic.startswith(ZSTD_MAGIC))
+
+
+def zstd_process_blocks(raw, data, blocksize):
+  """ yield the output of a zstd -dc process fed with data and the rest of raw """
+  proc=subprocess.Popen(['zstd', '-dc'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+  def feed():
+    chunk=data
+    try:
+      while chunk:
+        proc.stdin.write(chunk)
+        chunk=raw.read(blocksize)
+    except (IOError, OSError, ValueError):
+      #zstd was stopped or the input closed early
+      pass
+    finally:
+      proc.stdin.close()
+  feeder=threading.Thread(target=feed)
+  feeder.daemon=True
+  feeder.start()
   try:
-    dataSetHash['align'][evalue]
-  except:
-    dataSetHash['align'][evalue]=[]
-    dataSetHash['perid'][evalue]=[]
-    evalueHisto.extend([0]*(evalue-len(evalueHisto)+1))
-  dataSetHash['align'][evalue].append(int(lineary[3]))
-  dataSetHash['perid'][evalue].append(float(lineary[2]))
-  evalueHisto[evalue]+=1
-  size += 1
-  if int(lineary[3])>maxy:
-    maxy=int(lineary[3])
-
-#print(evalueHisto)
-print("length of histogram is %s" % len(evalueHisto))
-#how many sequences are we trimming off each end
-print("find sequence to remove")
-chopnumber=int((size-int(size*incfrac))/2)
-print("removing %s of %s sequences from each end" % (chopnumber, size))
-
-#find sequences to remove from head
-print("find values to remove from head")
-tmpcount=0
-evalRemove=[]
-for key in sorted(dataSetHash['align'].keys()):
-  tmpcount+=len(dataSetHash['align'][key])
-  if tmpcount < chopnumber:
-    print("head remove %s" % key)
-    evalRemove.append(key)
-
-#find sequences to remove from tail
-print("find values to remove from tail")
-tmpcount=0
-for key in sorted(dataSetHash['align'].keys(), reverse=True):
-  tmpcount+=len(dataSetHash['align'][key])
-  if tmpcount < chopnumber:
-    print("tail remove %s" % key)
-    evalRemove.append(key)
-
-#remove values from data structure
-for key in evalRemove:
-  print("remove %s" % key)
-  del dataSetHash['align'][key]
-  del dataSetHash['perid'][key]
-
-
-
-#ensure datasets exist for all numbers from start to end (will cause R to crash)
-print("ensure existance from head to tail")
-start=sorted(dataSetHash['align'].keys())[0]
-end=sorted(dataSetHash['align'].keys())[len(dataSetHash['align'].keys())-1]
-print("checking from %s to %s" % (start,end))
-for key in range(start, end):
+    while True:
+      block=proc.stdout.read(blocksize)
+      if not block:
+        break
+      yield block
+  finally:
+    #stop zstd if the caller gave up before the end
+    if proc.poll() is None and feeder.is_alive():
+      proc.kill()
+    proc.stdout.close()
+  feeder.join()
+  if proc.wait()!=0:
+    raise IOError("zstd exited with status %s" % proc.returncode)
+
+
+def decompressed_blocks(path, blocksize):
+  """ yield the bytes of path (or stdin for -) in blocks of about blocksize, decompressing gzip, bzip2 and zstd data """
+  raw=open_raw(path)
   try:
-    dataSetHash['align'][key]
-  except:
-    print("evalue %s was missing" % key)
-    dataSetHash['align'][key]=[]
-    dataSetHash['perid'][key]=[]
-
-#write out the data structure to the hdf5 file
-print("write out start, stop, and max alignment length")
-hdfFile.create_dataset('/stats/start',(1,1),maxshape=(1,1),chunks=(1,1),dtype=int,data=start)
-hdfFile.create_dataset('/stats/stop',(1,1),maxshape=(1,1),chunks=(1,1),dtype=int,data=end)
-hdfFile.create_dataset('/stats/maxy',(1,1),maxshape=(1,1),chunks=(1,1),dtype=int,data=maxy)
-print("write quartile hdf data from head to tail")
-for key in dataSetHash['align']:
-  hdfFile.create_dataset('/align/'+str(key),(len(dataSetHash['align'][key]),1),maxshape=(None,1),chunks=(chunksize/2,1),dtype=int,data=dataSetHash['align'][key])
-  hdfFile.create_dataset('/perid/'+str(key),(len(dataSetHash['perid'][key]),1),maxshape=(None,1),chunks=(chunksize/2,1),dtype=float,data=dataSetHash['perid'][key])
-
-#fix the data for the evalue histogram
-print("size of histo is %s - %s" % (chopnumber, (len(evalueHisto)-chopnumber)))
-evalueHisto=evalueHisto[start:end]
-
-print("write out evalue histogram data to hdf file")
-print(evalueHisto)
-hdfFile.create_dataset('/edgehisto',(len(evalueHisto),1),maxshape=(None,None),chunks=(chunksize/2,1),dtype=int,data=evalueHisto)
-
-#process data necessary for length histogram
-print("reading sequences.fa for length histogram")
-lengthAry=[]
-fastaLen=0
-fastaNum=0
-for line in args.fasta:
-  if(re.match('\A>',line)):
-    fastaNum+=1
-    if(fastaLen !=0):
+    data=raw.read(blocksize)
+    if data.startswith(GZIP_MAGIC):
+      newDecoder=lambda: zlib.decompressobj(16+zlib.MAX_WBITS)
+    elif data.startswith(BZIP2_MAGIC):
+      newDecoder=bz2.BZ2Decompressor
+    elif data.startswith(ZSTD_MAGIC) and zstandard is not None:
+      newDecoder=lambda: zstandard.ZstdDecompressor().decompressobj()
+    elif data.startswith(ZSTD_MAGIC):
+      for block in zstd_process_blocks(raw, data, blocksize):
+        yield block
+      return
+    else:
+      while data:
+        yield data
+        data=raw.read(blocksize)
+      return
+    decoder=newDecoder()
+    while data:
+      #files from pigz, bgzip, pbzip2 and cat have several compressed members
+      if getattr(decoder, 'eof', False):
+        decoder=newDecoder()
+      block=decoder.decompress(data)
+      if block:
+        yield block
+      #a member can end exactly at the end of data, with the next one still to be read
+      data=(getattr(decoder, 'eof', False) and decoder.unused_data) or raw.read(blocksize)
+    if not getattr(decoder, 'eof', True):
+      raise IOError("%s ends in the middle of a compressed stream" % path)
+  finally:
+    if raw is not getattr(sys.stdin, 'buffer', sys.stdin):
+      raw.close()
+
+
+class ThreadedReader(object):
+  """ read-only text stream filled by a background thread
+
+  The thread reads (and decompresses) blocks while the caller parses the
+  previous ones; at most QUEUE_DEPTH blocks wait in between, which bounds
+  the memory used when the parser is the slower side.
+  """
+
+  def __init__(self, blocks):
+    self.queue=queue.Queue(QUEUE_DEPTH)
+    self.pending=[]
+    self.size=0
+    self.done=False
+    self.thread=threading.Thread(target=self.fill, args=(blocks,))
+    self.thread.daemon=True
+    self.thread.start()
+
+  def fill(self, blocks):
+    try:
+      for block in blocks:
+        self.queue.put(block)
+      self.queue.put(None)
+    except Exception as e:
+      self.queue.put(e)
+
+  def next_block(self):
+    """ return the next block from the thread, or None at the end """
+    block=self.queue.get()
+    if isinstance(block, Exception):
+      raise block
+    if block is None:
+      self.done=True
+    return block
+
+  def blocks(self):
+    """ yield the blocks as bytes, for callers that scan them without decoding """
+    while not self.done:
+      block=self.next_block()
+      if block is not None:
+        yield block
+
+  def read(self, size):
+    while self.size<size and not self.done:
+      block=self.next_block()
+      if block is not None:
+        self.pending.append(block)
+        self.size+=len(block)
+    data=b''.join(self.pending)
+    self.pending=[data[size:]] if len(data)>size else []
+    self.size=len(data)-size if len(data)>size else 0
+    return data[:size].decode('latin-1')
+
+  def close(self):
+    self.done=True
+
+
+def open_input(path, readsize):
+  """ return a text stream of path (or stdin for -), decompressed in a background thread """
+  return ThreadedReader(decompressed_blocks(path, readsize))
+
+
+def threaded_blocks(path, readsize):
+  """ yield the blocks of path (or stdin for -) as bytes, decompressed in a background thread """
+  return ThreadedReader(decompressed_blocks(path, readsize)).blocks()
+
+
+#-------------------------------------------------------------------------------
+# reading 1.out
+#-------------------------------------------------------------------------------
+
+def read_blocks(fh, readsize):
+  """ yield successive blocks of about readsize bytes that end on a line boundary """
+  rest=''
+  while True:
+    block=fh.read(readsize)
+    if not block:
+      if rest:
+        yield rest
+      break
+    block=rest+block
+    cut=block.rfind('\n')+1
+    rest=block[cut:]
+    if cut:
+      yield block[:cut]
+
+
+def parse_blast_block(block):
+  """ return pident, alignment length, bitscore, query length and subject length arrays for a block of 1.out lines """
+  if FAST_LOADTXT:
+    try:
+      values=np.loadtxt(io.StringIO(block), usecols=(2,3,4,5,6), delimiter='\t', ndmin=2)
+      return values[:,0], values[:,1], values[:,2], values[:,3], values[:,4]
+    except ValueError:
+      pass
+  else:
+    firstline=block[:block.find('\n')]
+    numcols=firstline.count('\t')-1
+    if numcols>=5:
+      #drop the two id columns, the rest of the block is all numbers
       try:
-        lengthAry[fastaLen]
-      except:
-        if len(lengthAry) < fastaLen+1:
-          lengthAry.extend([0]*(fastaLen-len(lengthAry)+1))
-        #print("length is %s" % fastaLen)
-        #print("array size is %s" % len(lengthAry))
-        lengthAry[fastaLen]=1
-      else:
-        lengthAry[fastaLen]+=1
-    fastaLen=0
+        values=np.fromstring(ID_COLUMNS.sub('', block), sep=' ')
+      except ValueError:
+        #newer numpy raises instead of stopping at text it cannot parse
+        values=np.zeros(0)
+      if len(values)%numcols==0 and len(values)//numcols==block.count('\n')+(not block.endswith('\n')):
+        values=values.reshape(-1, numcols)
+        return values[:,0], values[:,1], values[:,2], values[:,3], values[:,4]
+  #ragged or malformed block, parse it one line at a time
+  rows=[]
+  for line in block.splitlines():
+    if not line.strip():
+      continue
+    lineary=line.rstrip().split('\t')
+    rows.append((float(lineary[2]), int(lineary[3]), float(lineary[4]), int(lineary[5]), int(lineary[6])))
+  values=np.array(rows, dtype=np.float64).reshape(-1, 5)
+  return values[:,0], values[:,1], values[:,2], values[:,3], values[:,4]
+
+
+def read_blast_blocks(blastIn, readsize, nodes=None):
+  """ yield (evalue, align, perid) arrays for successive blocks of 1.out, adding the ids of each block to nodes if given """
+  for block in read_blocks(blastIn, readsize):
+    #a range of blank lines has no edges
+    if block.isspace():
+      continue
+    perid, align, bitscore, qlen, slen=parse_blast_block(block)
+    evalues=(-(np.log(qlen*slen)/LOG10)+bitscore*LOG2/LOG10).astype(np.int64)
+    if nodes is not None:
+      nodes.add(block, evalues)
+    yield evalues, align.astype(np.int64), perid
+
+
+class EdgeBins(object):
+  """ per e-value bin alignment length and percent identity values
+
+  Values are kept as arrays.  When a hdf5 file is given, the buffered values
+  are appended to resizable /align/<bin> and /perid/<bin> datasets whenever
+  more than maxEdges values are held, so memory use stays bounded no matter
+  how large 1.out is.  Otherwise everything is held until write() is called.
+
+  HDF5 does not reuse the space of deleted datasets, so when incfrac is
+  given the bins that trimming is likely to drop (those in the outer
+  1-incfrac of the edges so far, twice what will be trimmed) stay in memory
+  instead of being flushed.  If a flushed bin is trimmed after all, deleted
+  is set and the file should be repacked.
+  """
+
+  def __init__(self, storage, hdfFile=None, maxEdges=None, incfrac=None):
+    self.storage=storage
+    self.hdfFile=hdfFile
+    self.maxEdges=maxEdges
+    self.incfrac=incfrac
+    self.align=collections.defaultdict(list)
+    self.perid=collections.defaultdict(list)
+    self.counts=collections.defaultdict(int)
+    self.size=0
+    self.maxy=0
+    self.buffered=0
+    self.held=0
+    self.deleted=False
+
+  def add(self, evalues, align, perid):
+    if len(evalues)==0:
+      return
+    low=int(evalues.min())
+    binidx=evalues-low
+    if binidx.max()<65536:
+      binidx=binidx.astype(np.uint16)
+    histo=np.bincount(binidx)
+    #stable sort keeps the values of each bin in file order
+    order=np.argsort(binidx, kind='mergesort')
+    align=align[order]
+    perid=perid[order]
+    offset=0
+    for idx in np.flatnonzero(histo):
+      key=low+int(idx)
+      count=int(histo[idx])
+      self.align[key].append(align[offset:offset+count])
+      self.perid[key].append(perid[offset:offset+count])
+      self.counts[key]+=count
+      offset+=count
+    self.maxy=max(self.maxy, int(align.max()))
+    self.size+=len(evalues)
+    self.buffered+=len(evalues)
+    if self.hdfFile is not None and self.buffered-self.held>self.maxEdges:
+      self.flush()
+
+  def tail_keys(self):
+    """ the bins at either end that hold less than 1-incfrac of the edges so far """
+    if self.incfrac is None:
+      return set()
+    margin=self.size-int(self.size*self.incfrac)
+    keys=sorted(self.counts)
+    tails=set()
+    for ordered in (keys, reversed(keys)):
+      total=0
+      for key in ordered:
+        total+=self.counts[key]
+        if total>=margin:
+          break
+        tails.add(key)
+    return tails
+
+  def flush(self, keys=None, complete=False):
+    """ append the buffered values to the hdf5 datasets; complete means no more values will follow """
+    if keys is None:
+      tails=self.tail_keys()
+      keys=[key for key in sorted(self.align) if key not in tails]
+    for key in keys:
+      append_dataset(self.hdfFile, '/align/'+str(key), self.align.pop(key, []), int, self.storage, complete)
+      append_dataset(self.hdfFile, '/perid/'+str(key), self.perid.pop(key, []), float, self.storage, complete)
+    self.buffered=self.held=sum(len(values) for bins in self.align.values() for values in bins)
+
+  def values(self, key):
+    """ return all alignment length and percent identity values of a bin """
+    align=list(self.align.get(key, []))
+    perid=list(self.perid.get(key, []))
+    name=str(key)
+    if self.hdfFile is not None and '/align/'+name in self.hdfFile:
+      align.insert(0, self.hdfFile['/align/'+name][:,0])
+      perid.insert(0, self.hdfFile['/perid/'+name][:,0])
+    if not align:
+      return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+    return np.concatenate(align), np.concatenate(perid)
+
+  def write(self, hdfFile, start, end):
+    """ write the datasets for every bin from start to end, dropping the others """
+    self.hdfFile=hdfFile
+    self.flush(range(start, end+1), True)
+    for key in self.counts:
+      if (key<start or key>end) and '/align/'+str(key) in hdfFile:
+        del hdfFile['/align/'+str(key)]
+        del hdfFile['/perid/'+str(key)]
+        self.deleted=True
+
+
+class BinnedHistogram(object):
+  """ counts of non-negative integer values per e-value bin
+
+  The count matrix has one row per bin from self.low up and one column per
+  value, and grows as new bins and larger values are added.
+  """
+
+  def __init__(self):
+    self.low=0
+    self.counts=np.zeros((0,0), dtype=np.int64)
+
+  def grow(self, low, high, maxval):
+    if self.counts.size==0:
+      self.low=low
+      self.counts=np.zeros((high-low+1, maxval+1), dtype=np.int64)
+      return
+    newlow=min(low, self.low)
+    rows=max(high, self.low+self.counts.shape[0]-1)-newlow+1
+    cols=max(maxval+1, self.counts.shape[1])
+    if (rows, cols)!=self.counts.shape:
+      counts=np.zeros((rows, cols), dtype=np.int64)
+      offset=self.low-newlow
+      counts[offset:offset+self.counts.shape[0], :self.counts.shape[1]]=self.counts
+      self.low=newlow
+      self.counts=counts
+
+  def add(self, evalues, values):
+    if len(evalues)==0:
+      return
+    low=int(evalues.min())
+    high=int(evalues.max())
+    self.grow(low, high, int(values.max()))
+    width=self.counts.shape[1]
+    counts=np.bincount((evalues-low)*width+values, minlength=(high-low+1)*width)
+    self.counts[low-self.low:high-self.low+1]+=counts.reshape(-1, width)
+
+  def merge(self, other):
+    if other.counts.size==0:
+      return
+    rows, cols=other.counts.shape
+    self.grow(other.low, other.low+rows-1, cols-1)
+    self.counts[other.low-self.low:other.low-self.low+rows, :cols]+=other.counts
+
+  def save(self, hdfFile, name):
+    dset=hdfFile.create_dataset(name,data=self.counts,compression='gzip',shuffle=True)
+    dset.attrs['low']=self.low
+
+  @classmethod
+  def load(cls, hdfFile, name):
+    hist=cls()
+    hist.counts=hdfFile[name][...].astype(np.int64)
+    hist.low=int(hdfFile[name].attrs['low'])
+    return hist
+
+  def row(self, key):
+    if key<self.low or key>=self.low+self.counts.shape[0]:
+      return np.zeros(self.counts.shape[1], dtype=np.int64)
+    return self.counts[key-self.low]
+
+
+def box_stats(counts, scale=1):
+  """ R boxplot statistics for a histogram of value counts
+
+  Returns min, lower hinge, median, upper hinge, max (the same Tukey five
+  number summary R's boxplot draws), the 1.5 IQR whisker ends and the number
+  of values, with values divided by scale.
+  """
+  n=int(counts.sum())
+  if n==0:
+    return [float('nan')]*7+[0]
+  cum=np.cumsum(counts)
+  n4=math.floor((n+3)/2.0)/2.0
+  five=[]
+  for d in (1, n4, (n+1)/2.0, n+1-n4, n):
+    #value at 1-based rank d of the sorted values, averaging the neighbors for half ranks
+    lower=np.searchsorted(cum, math.floor(d))
+    upper=np.searchsorted(cum, math.ceil(d))
+    five.append(0.5*(lower+upper))
+  iqr=five[3]-five[1]
+  present=np.flatnonzero(counts)
+  wlow=present[present>=five[1]-1.5*iqr].min()
+  whigh=present[present<=five[3]+1.5*iqr].max()
+  return [float(v)/scale for v in five+[wlow, whigh]]+[n]
+
+
+class EdgeHistograms(object):
+  """ per e-value bin histograms of alignment length and percent identity
+
+  Memory use depends on the number of bins and the range of the values
+  rather than on the number of edges, and histograms built from different
+  parts of 1.out can be merged.  Percent identity is kept as an integer
+  number of 1/peridScale steps.
+  """
+
+  def __init__(self, peridScale, storage):
+    self.peridScale=peridScale
+    self.storage=storage
+    self.align=BinnedHistogram()
+    self.perid=BinnedHistogram()
+    self.size=0
+    self.maxy=0
+
+  @property
+  def counts(self):
+    rows=self.align.counts.sum(axis=1)
+    return dict((self.align.low+i, int(rows[i])) for i in np.flatnonzero(rows))
+
+  def add(self, evalues, align, perid):
+    if len(evalues)==0:
+      return
+    self.align.add(evalues, align)
+    self.perid.add(evalues, np.rint(perid*self.peridScale).astype(np.int64))
+    self.maxy=max(self.maxy, int(align.max()))
+    self.size+=len(evalues)
+
+  def merge(self, other):
+    if other.peridScale!=self.peridScale:
+      sys.exit("cannot merge percent identity histograms kept at different precisions")
+    self.align.merge(other.align)
+    self.perid.merge(other.perid)
+    self.maxy=max(self.maxy, other.maxy)
+    self.size+=other.size
+
+  def save(self, hdfFile):
+    """ write the histograms to a partial file that merge() can combine later """
+    self.align.save(hdfFile, '/partial/align')
+    self.perid.save(hdfFile, '/partial/perid')
+    for name in ('size', 'maxy', 'peridScale'):
+      hdfFile['/partial'].attrs[name]=getattr(self, name)
+    hdfFile.attrs['partial']=PARTIAL_VERSION
+
+  @classmethod
+  def load(cls, hdfFile, storage):
+    """ read the histograms of a partial file written by save() """
+    if hdfFile.attrs.get('partial')!=PARTIAL_VERSION:
+      sys.exit("%s was not written with --partial" % hdfFile.filename)
+    attrs=hdfFile['/partial'].attrs
+    edges=cls(int(attrs['peridScale']), storage)
+    edges.align=BinnedHistogram.load(hdfFile, '/partial/align')
+    edges.perid=BinnedHistogram.load(hdfFile, '/partial/perid')
+    edges.size=int(attrs['size'])
+    edges.maxy=int(attrs['maxy'])
+    return edges
+
+  def values(self, key):
+    """ return the sorted alignment length and percent identity values of a bin """
+    align=self.align.row(key)
+    perid=self.perid.row(key)
+    return np.repeat(np.arange(len(align)), align), np.repeat(np.arange(len(perid))/float(self.peridScale), perid)
+
+  def write(self, hdfFile, start, end):
+    """ write the /align/<bin> and /perid/<bin> datasets for every bin from start to end """
+    for key in range(start, end+1):
+      align, perid=self.values(key)
+      append_dataset(hdfFile, '/align/'+str(key), [align], int, self.storage, True)
+      append_dataset(hdfFile, '/perid/'+str(key), [perid], float, self.storage, True)
+
+  def write_summary(self, hdfFile, start, end):
+    """ write box plot statistics for every bin from start to end """
+    for name, hist, scale in (('align', self.align, 1), ('perid', self.perid, self.peridScale)):
+      stats=[box_stats(hist.row(key), scale) for key in range(start, end+1)]
+      hdfFile.create_dataset('/summary/'+name,data=np.array(stats, dtype=np.float64))
+    hdfFile['/summary'].attrs['columns']=np.bytes_(','.join(SUMMARY_COLUMNS))
+
+
+def hash_ids(buf, begins, ends):
+  """ 64 bit hashes of the byte strings buf[begins[i]:ends[i]]; buf must be followed by 8 padding bytes """
+  #every offset of buf read as a little endian 64 bit word, so ids are hashed 8 bytes at a time
+  words=np.ndarray((len(buf)-7,), dtype='<u8', buffer=buf, strides=(1,))
+  lengths=ends-begins
+  hashes=lengths.astype(np.uint64)
+  for k in range(0, int(lengths.max()) if len(lengths) else 0, 8):
+    left=np.clip(lengths-k, 0, 8)
+    masks=np.where(left==8, np.uint64(0xffffffffffffffff), (np.uint64(1)<<(8*np.minimum(left, 7)).astype(np.uint64))-np.uint64(1))
+    hashes=hashes*ID_HASH_PRIME+(words[np.minimum(begins+k, len(words)-1)] & masks)
+  return hashes
+
+
+class NodeScores(object):
+  """ highest e-value bin among the edges of each sequence
+
+  Sequences are identified by a 64 bit hash of their id and kept in a
+  sorted table, so each block costs a binary search per edge; the table
+  only has to be rebuilt when a block has sequences that were not seen
+  before.  Scores from different parts of 1.out can be merged.
+  """
+
+  def __init__(self):
+    self.ids=np.zeros(0, dtype=np.uint64)
+    self.best=np.zeros(0, dtype=np.int64)
+
+  def add(self, block, evalues):
+    if len(evalues)==0:
+      return
+    if not isinstance(block, bytes):
+      block=block.encode('latin-1')
+    buf=np.frombuffer(block+b'\0'*8, dtype=np.uint8)
+    n=len(block)
+    newlines=np.flatnonzero(buf[:n]==10)
+    begins=np.concatenate(([0], newlines+1))
+    ends=np.append(newlines, n)
+    #skip blank lines the same way the parser does
+    begins=begins[ends>begins]
+    tabs=np.flatnonzero(buf[:n]==9)
+    first=np.searchsorted(tabs, begins)
+    if len(begins)!=len(evalues) or len(tabs)==0 or first.max()+1>=len(tabs):
+      sys.exit("unable to find the sequence ids of a block of 1.out")
+    ids=np.concatenate((hash_ids(buf, begins, tabs[first]), hash_ids(buf, tabs[first]+1, tabs[first+1])))
+    self.update(ids, np.concatenate((evalues, evalues)))
+
+  def update(self, ids, bins):
+    """ raise the best bin of each id to bins where higher """
+    if len(ids)==0:
+      return
+    idx=np.searchsorted(self.ids, ids)
+    found=idx<len(self.ids)
+    found[found]=self.ids[idx[found]]==ids[found]
+    if not found.all():
+      newIds=np.unique(ids[~found])
+      where=np.searchsorted(self.ids, newIds)
+      self.ids=np.insert(self.ids, where, newIds)
+      self.best=np.insert(self.best, where, np.iinfo(np.int64).min)
+      idx=np.searchsorted(self.ids, ids)
+    #an id can occur many times in ids, which a plain fancy assignment would not combine
+    np.maximum.at(self.best, idx, bins)
+
+  def merge(self, other):
+    #parts of 1.out without edges, such as an empty blast shard, have no ids
+    if len(other.ids)==0:
+      return
+    self.update(other.ids, other.best)
+
+  def counts(self, start, end):
+    """ return the number of sequences with an edge in bin key or higher for every key from start to end """
+    histo=np.bincount(np.clip(self.best, start, end)-start, minlength=end-start+1)
+    return np.cumsum(histo[::-1])[::-1]
+
+  def save(self, hdfFile):
+    hdfFile.create_dataset('/partial/nodes/ids',data=self.ids,compression='gzip')
+    hdfFile.create_dataset('/partial/nodes/best',data=self.best,compression='gzip',shuffle=True)
+
+  @classmethod
+  def load(cls, hdfFile):
+    nodes=cls()
+    nodes.ids=hdfFile['/partial/nodes/ids'][...]
+    nodes.best=hdfFile['/partial/nodes/best'][...]
+    return nodes
+
+
+#-------------------------------------------------------------------------------
+# storage
+#-------------------------------------------------------------------------------
+class StorageProfile(object):
+  """ chunk shapes and filters of the datasets written to the output file, see STORAGE_PROFILES """
+
+  def __init__(self, name, chunksize):
+    self.name=name
+    self.chunksize=chunksize
+    self.compression, self.level, self.chunkBytes=STORAGE_PROFILES[name]
+
+  def chunk_rows(self, rows, dtype):
+    """ rows per chunk of a dataset that will have the given number of rows, or None if it keeps growing """
+    if self.compression is None:
+      return self.chunksize//2
+    #a chunk near the target size, but no larger than the whole dataset
+    target=max(1, self.chunkBytes//np.dtype(dtype).itemsize)
+    return target if rows is None else max(1, min(rows, target))
+
+  def options(self, rows, dtype, columns=True):
+    """ create_dataset keyword arguments for a dataset of rows values (None if it keeps growing), shaped (rows,1) if columns else (rows,) """
+    chunkRows=self.chunk_rows(rows, dtype)
+    options={'chunks': (chunkRows,1) if columns else (chunkRows,)}
+    if self.compression is not None:
+      options.update(compression=self.compression, compression_opts=self.level, shuffle=True)
+    return options
+
+  def report(self, path, seconds):
+    """ print and return the bytes of data, the bytes stored and the compression ratio of the datasets in path """
+    sizes=[0, 0]
+    def add(name, obj):
+      if isinstance(obj, h5py.Dataset):
+        sizes[0]+=obj.size*obj.dtype.itemsize
+        sizes[1]+=obj.id.get_storage_size()
+    hdfFile=h5py.File(path, "r")
+    hdfFile.visititems(add)
+    hdfFile.close()
+    ratio=float(sizes[0])/sizes[1] if sizes[1] else 1.0
+    print("storage profile %s: %s bytes of data stored in %s bytes (compression ratio %.2f), written in %.2f seconds" % (self.name, sizes[0], sizes[1], ratio, seconds))
+    return {'profile': self.name, 'data_bytes': sizes[0], 'stored_bytes': sizes[1], 'ratio': ratio, 'write_seconds': seconds}
+
+
+def append_dataset(hdfFile, name, values, dtype, storage, complete=False):
+  values=np.concatenate(values) if values else []
+  if name not in hdfFile:
+    hdfFile.create_dataset(name,(0,1),maxshape=(None,1),dtype=dtype,**storage.options(len(values) if complete else None, dtype))
+  if len(values)==0:
+    return
+  dset=hdfFile[name]
+  offset=dset.shape[0]
+  dset.resize((offset+len(values),1))
+  dset[offset:,0]=values
+
+
+def repack_file(path):
+  """ copy everything in a hdf5 file to a new file in its place, leaving out the space of deleted datasets """
+  tmpPath=path+'.repack'
+  source=h5py.File(path, "r")
+  target=h5py.File(tmpPath, "w")
+  for name in source:
+    source.copy(name, target)
+  for name, value in source.attrs.items():
+    target.attrs[name]=value
+  source.close()
+  target.close()
+  os.rename(tmpPath, path)
+
+
+def write_csr(hdfFile, edges, start, end, storage):
+  """ write the values of every bin from start to end as single arrays
+
+  /align/values and /perid/values hold the values of each bin in turn, each
+  bin sorted on its own, and the values of bin start+i are at
+  offsets[i]:offsets[i+1] of the /offsets dataset.
+  """
+  counts=edges.counts
+  offsets=np.zeros(end-start+2, dtype=np.int64)
+  offsets[1:]=np.cumsum([counts.get(key, 0) for key in range(start, end+1)])
+  options={}
+  if storage.compression is not None:
+    options=storage.options(int(offsets[-1]), np.int64, False)
+  align=hdfFile.create_dataset('/align/values',(offsets[-1],),dtype=int,**options)
+  perid=hdfFile.create_dataset('/perid/values',(offsets[-1],),dtype=float,**options)
+  for i in range(end-start+1):
+    if offsets[i+1]>offsets[i]:
+      alignValues, peridValues=edges.values(start+i)
+      align[offsets[i]:offsets[i+1]]=np.sort(alignValues)
+      perid[offsets[i]:offsets[i+1]]=np.sort(peridValues)
+  if storage.compression is not None:
+    options=storage.options(len(offsets), np.int64, False)
+  hdfFile.create_dataset('/offsets',data=offsets,**options)
+  hdfFile.attrs['version']=CSR_VERSION
+
+
+def write_thresholds(hdfFile, counts, nodes):
+  """ write edge and node counts for choosing an alignment score threshold
+
+  /thresholds/score runs over every e-value bin from the lowest to the
+  highest, before trimming.  For each, /thresholds/edges has the edges in
+  that bin, /thresholds/cumulative the edges in that bin or higher and
+  /thresholds/nodes the sequences left with at least one edge when edges
+  in lower bins are dropped (if nodes were counted).
+  """
+  if not counts:
+    return
+  start=min(counts)
+  end=max(counts)
+  edgeCounts=np.array([counts.get(key, 0) for key in range(start, end+1)], dtype=np.int64)
+  hdfFile.create_dataset('/thresholds/score',data=np.arange(start, end+1))
+  hdfFile.create_dataset('/thresholds/edges',data=edgeCounts)
+  hdfFile.create_dataset('/thresholds/cumulative',data=np.cumsum(edgeCounts[::-1])[::-1])
+  if nodes is not None:
+    hdfFile.create_dataset('/thresholds/nodes',data=nodes.counts(start, end))
+
+
+#-------------------------------------------------------------------------------
+# parallel reading
+#-------------------------------------------------------------------------------
+
+class FileRange(object):
+  """ read-only view of bytes begin to end of a file, decoded as text """
+
+  def __init__(self, path, begin, end):
+    self.fh=io.open(path, 'rb')
+    self.fh.seek(begin)
+    self.remaining=end-begin
+
+  def read(self, size):
+    data=self.fh.read(min(size, self.remaining))
+    self.remaining-=len(data)
+    return data.decode('latin-1')
+
+  def close(self):
+    self.fh.close()
+
+
+def split_file(path, parts):
+  """ return (begin, end) byte ranges that cover path in about equal parts and start on line boundaries """
+  size=os.path.getsize(path)
+  bounds=[0]
+  with io.open(path, 'rb') as fh:
+    for i in range(1, parts):
+      fh.seek(max(size*i//parts, bounds[-1]+1)-1)
+      fh.readline()
+      bounds.append(min(fh.tell(), size))
+  bounds.append(size)
+  return [(begin, end) for begin, end in zip(bounds, bounds[1:]) if end>begin]
+
+
+def aggregate_range(job):
+  """ worker: build the histograms for one byte range of 1.out """
+  path, begin, end, readsize, peridScale, storage, countNodes=job
+  edges=EdgeHistograms(peridScale, storage)
+  nodes=NodeScores() if countNodes else None
+  blastIn=FileRange(path, begin, end)
+  for evalues, align, perid in read_blast_blocks(blastIn, readsize, nodes):
+    edges.add(evalues, align, perid)
+  blastIn.close()
+  return edges, nodes
+
+
+def aggregate_parallel(path, workers, readsize, peridScale, storage, countNodes):
+  """ build the histograms for all of 1.out with a pool of worker processes """
+  #several ranges per worker evens out the load when some parts of the file parse slower
+  ranges=split_file(path, workers*4)
+  print("read blast with %s workers in %s parts" % (workers, len(ranges)))
+  edges=EdgeHistograms(peridScale, storage)
+  nodes=NodeScores() if countNodes else None
+  pool=multiprocessing.Pool(workers)
+  try:
+    for partialEdges, partialNodes in pool.imap_unordered(aggregate_range, [(path, begin, end, readsize, peridScale, storage, countNodes) for begin, end in ranges]):
+      edges.merge(partialEdges)
+      if nodes is not None:
+        nodes.merge(partialNodes)
+  finally:
+    pool.close()
+    pool.join()
+  return edges, nodes
+
+
+def reduce_partials(paths, storage):
+  """ merge the histograms of the partial files written with --partial """
+  print("merge %s partial files" % len(paths))
+  edges=None
+  nodes=NodeScores()
+  for path in paths:
+    partialFile=h5py.File(path, "r")
+    partial=EdgeHistograms.load(partialFile, storage)
+    #node counts are only possible if every partial has them
+    if nodes is not None and '/partial/nodes' in partialFile:
+      nodes.merge(NodeScores.load(partialFile))
+    else:
+      nodes=None
+    partialFile.close()
+    if edges is None:
+      edges=partial
+    else:
+      edges.merge(partial)
+  return edges, nodes
+
+
+#-------------------------------------------------------------------------------
+# trimming
+#-------------------------------------------------------------------------------
+
+def find_bin_range(counts, size, incfrac):
+  """ return the first and last e-value bins left after trimming the tails """
+  #how many sequences are we trimming off each end
+  print("find sequence to remove")
+  chopnumber=int((size-int(size*incfrac))/2)
+  print("removing %s of %s sequences from each end" % (chopnumber, size))
+
+  keys=sorted(key for key in counts if counts[key])
+  evalRemove=set()
+
+  #find sequences to remove from head
+  print("find values to remove from head")
+  tmpcount=0
+  for key in keys:
+    tmpcount+=counts[key]
+    if tmpcount < chopnumber:
+      print("head remove %s" % key)
+      evalRemove.add(key)
+
+  #find sequences to remove from tail
+  print("find values to remove from tail")
+  tmpcount=0
+  for key in reversed(keys):
+    tmpcount+=counts[key]
+    if tmpcount < chopnumber:
+      print("tail remove %s" % key)
+      evalRemove.add(key)
+
+  keys=[key for key in keys if key not in evalRemove]
+  if not keys:
+    sys.exit("no edges left after removing %s from each end" % chopnumber)
+  return keys[0], keys[-1]
+
+
+#-------------------------------------------------------------------------------
+# length histogram
+#-------------------------------------------------------------------------------
+
+def mapped_blocks(path, readsize):
+  """ yield successive readsize byte blocks of a memory mapped file as numpy arrays """
+  with io.open(path, 'rb') as fh:
+    size=os.fstat(fh.fileno()).st_size
+    if size==0:
+      return
+    data=mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    #the map is closed when the last block array that uses it is freed
+    for offset in range(0, size, readsize):
+      yield np.frombuffer(data, dtype=np.uint8, count=min(readsize, size-offset), offset=offset)
+
+
+def scan_fasta_lengths(path, readsize):
+  """ return the number of fasta records and the histogram of their lengths
+
+  Plain files are memory mapped, other inputs are read through threaded_blocks,
+  and scanned readsize bytes at a time with numpy.  A record's length is the
+  number of residue bytes on the lines after its header, not counting line
+  ends, other whitespace or control bytes.
+  """
+  if is_plain_file(path):
+    blocks=mapped_blocks(path, readsize)
   else:
-    fastaLen+=len(line.rstrip())
+    blocks=(np.frombuffer(block, dtype=np.uint8) for block in threaded_blocks(path, readsize))
+  lengths=[]
+  fastaNum=0
+  fastaLen=0
+  inHeader=False
+  prev=10
+  for buf in blocks:
+    n=len(buf)
+    #whitespace and control bytes are rare, so they are located rather than the residues counted
+    blanks=np.flatnonzero(buf<=32)
+    newlines=blanks[buf[blanks]==10]
+    #headers are lines that start with >
+    heads=np.flatnonzero(buf==62)
+    before=buf[np.maximum(heads-1, 0)]
+    before[heads==0]=prev
+    heads=heads[before==10]
+    prev=int(buf[-1])
+    if inHeader:
+      #the last header line of the previous block continues into this one
+      if len(newlines)==0:
+        continue
+      heads=np.concatenate(([0], heads))
+      fastaNum-=1
+    #index just past the end of each header line, or n if it runs past the block
+    headEnds=np.full(len(heads), n, dtype=np.int64)
+    found=np.searchsorted(newlines, heads)
+    headEnds[found<len(newlines)]=newlines[found[found<len(newlines)]]+1
+    #the residues of each record lie between the end of its header line and the next header
+    segStarts=np.insert(headEnds, 0, 0)
+    segEnds=np.append(heads, n)
+    segs=segEnds-segStarts-(np.searchsorted(blanks, segEnds)-np.searchsorted(blanks, segStarts))
+    if len(heads):
+      done=np.append(fastaLen+segs[0], segs[1:-1])
+      lengths.append(done[done!=0])
+      fastaLen=int(segs[-1])
+      inHeader=bool(headEnds[-1]==n and prev!=10)
+    else:
+      fastaLen+=int(segs[0])
+    fastaNum+=len(heads)
+  lengths.append([fastaLen])
+  return fastaNum, np.bincount(np.concatenate(lengths).astype(np.int64))
 
-try:
-  lengthAry[fastaLen]
-except:
-  lengthAry[fastaLen]=1
-else:
-  lengthAry[fastaLen]+=1
-
-lenstart=0
-lenstop=0
-counter=0
-chopnumber=int((1-incfrac)*fastaNum)
-#print("chopnumber is %s" % chopnumber)
-for i in lengthAry:
-  if counter>chopnumber:
-    print("start at %s" % lenstart)
-    break
+
+def fasta_checksum(path, size):
+  """ checksum of the start and end of a file, used to notice files rewritten in place """
+  with io.open(path, 'rb') as fh:
+    checksum=zlib.crc32(fh.read(CACHE_CHECK_BYTES))
+    fh.seek(max(0, size-CACHE_CHECK_BYTES))
+    checksum=zlib.crc32(fh.read(CACHE_CHECK_BYTES), checksum)
+  return checksum & 0xffffffff
+
+
+def fasta_lengths(path, readsize, useCache):
+  """ return the number of fasta records and their length histogram, using <path>.lenhisto.json when it is current """
+  if path=='-':
+    print("reading stdin for length histogram")
+    return scan_fasta_lengths(path, readsize)
+  cachePath=path+'.lenhisto.json'
+  info=os.stat(path)
+  key={'size': info.st_size, 'mtime': info.st_mtime, 'checksum': fasta_checksum(path, info.st_size)}
+  if useCache and os.path.exists(cachePath):
+    try:
+      with open(cachePath) as fh:
+        cache=json.load(fh)
+      if all(cache.get(name)==value for name, value in key.items()):
+        print("using cached sequence lengths from %s" % cachePath)
+        return cache['count'], np.array(cache['histogram'], dtype=np.int64)
+    except (IOError, OSError, ValueError, KeyError):
+      pass
+  print("reading %s for length histogram" % path)
+  fastaNum, lengthHisto=scan_fasta_lengths(path, readsize)
+  if useCache:
+    key.update(count=fastaNum, histogram=lengthHisto.tolist())
+    try:
+      with open(cachePath, 'w') as fh:
+        json.dump(key, fh)
+    except (IOError, OSError):
+      print("unable to write sequence length cache %s" % cachePath)
+  return fastaNum, lengthHisto
+
+
+def read_length_table(path, readsize):
+  """ return the histogram of a length<TAB>count table written by EFI::LengthHistogram and its first and last+1 lengths """
+  text=b''.join(threaded_blocks(path, readsize)).decode('latin-1')
+  table=np.loadtxt(io.StringIO(text), dtype=np.int64, ndmin=2).reshape(-1, 2)
+  if len(table)==0:
+    return [], 0, 0
+  lenstart=int(table[:,0].min())
+  lenstop=int(table[:,0].max())+1
+  lengthAry=np.bincount(table[:,0]-lenstart, weights=table[:,1], minlength=lenstop-lenstart)
+  return lengthAry.astype(np.int64).tolist(), lenstart, lenstop
+
+
+def is_fasta(path):
+  if path=='-':
+    return True
+  blocks=decompressed_blocks(path, 65536)
+  first=next(blocks, b'')
+  blocks.close()
+  return first[:1]==b'>'
+
+
+def trim_length_histogram(fastaNum, lengthAry, incfrac):
+  """ return the center incfrac of a sequence length histogram and its first and last+1 lengths """
+  lengthAry=list(lengthAry)
+  lenstart=0
+  lenstop=0
+  counter=0
+  chopnumber=int((1-incfrac)*fastaNum)
+  #print("chopnumber is %s" % chopnumber)
+  for i in lengthAry:
+    if counter>chopnumber:
+      print("start at %s" % lenstart)
+      break
+    else:
+      counter+=i
+      lenstart+=1
+
+  counter=0
+  lenstop=len(lengthAry)
+  for i in reversed(lengthAry):
+    if counter>chopnumber:
+      print("stop at %s" % lenstop)
+      break
+    else:
+      counter+=i
+      lenstop-=1
+
+  print("start is %s, stop is %s" % (lenstart,lenstop))
+  lengthAry=lengthAry[lenstart:lenstop]
+  return lengthAry, lenstart, lenstop
+
+
+def length_histogram(path, incfrac, readsize, useCache):
+  """ return the length histogram of a fasta file or length table and its first and last+1 lengths """
+  if is_fasta(path):
+    fastaNum, lengthHisto=fasta_lengths(path, readsize, useCache)
+    return trim_length_histogram(fastaNum, lengthHisto, incfrac)
+  #tables are written already trimmed
+  print("reading length table %s" % path)
+  return read_length_table(path, readsize)
+
+
+def write_length_histogram(hdfFile, lengthAry, lenstart, lenstop, storage, group=None):
+  """ write a length histogram to /lenhisto and /stats/len*, or to the counts, start, stop and max datasets of group """
+  lenmax=0
+  for i in lengthAry:
+    if lenmax<i:
+      lenmax=i
+
+  print("Write length histogram data to hdfFile")
+
+  if group is None:
+    names=('/lenhisto', '/stats/lenstart', '/stats/lenstop', '/stats/lenmax')
+  else:
+    names=(group+'/counts', group+'/start', group+'/stop', group+'/max')
+  hdfFile.create_dataset(names[0],(len(lengthAry),1),maxshape=(None,None),dtype=int,data=lengthAry,**storage.options(len(lengthAry), int))
+  hdfFile.create_dataset(names[1],(1,1),maxshape=(1,1),chunks=(1,1),dtype=int,data=lenstart)
+  hdfFile.create_dataset(names[2],(1,1),maxshape=(1,1),chunks=(1,1),dtype=int,data=lenstop)
+  hdfFile.create_dataset(names[3],(1,1),maxshape=(1,1),chunks=(1,1),dtype=int,data=lenmax)
+
+
+#-------------------------------------------------------------------------------
+# graphs
+#-------------------------------------------------------------------------------
+
+def five_numbers(values):
+  """ Tukey five number summary of raw values, as drawn by R's boxplot(range=0) """
+  values=np.sort(values)
+  n=len(values)
+  n4=math.floor((n+3)/2.0)/2.0
+  return [0.5*(values[int(math.floor(d))-1]+values[int(math.ceil(d))-1]) for d in (1, n4, (n+1)/2.0, n+1-n4, n)]
+
+
+def bin_boxes(edges, start, end):
+  """ return the e-value bins from start to end that have edges with the five number summaries of their alignment length and percent identity """
+  boxes=[]
+  for key in range(start, end+1):
+    if isinstance(edges, EdgeHistograms):
+      align=box_stats(edges.align.row(key))
+      perid=box_stats(edges.perid.row(key), edges.peridScale)
+      if align[-1]:
+        boxes.append((key, align[:5], perid[:5]))
+    else:
+      align, perid=edges.values(key)
+      if len(align):
+        boxes.append((key, five_numbers(align), five_numbers(perid)))
+  return boxes
+
+
+def load_matplotlib():
+  """ return the matplotlib package with the modules used here imported, or None if it is not installed """
+  try:
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.collections
+    import matplotlib.pyplot
+    import matplotlib.ticker
+  except ImportError:
+    return None
+  return matplotlib
+
+
+def plot_title(text, jobId, extra=''):
+  if jobId:
+    text+=' for Job ID %s' % jobId
+  if extra:
+    text+=' (%s)' % extra
+  return text
+
+
+def new_plot(mpl, size, title, xlabel, ylabel):
+  width, height=size
+  fig=mpl.pyplot.figure(figsize=(width/100.0, height/100.0), dpi=100)
+  ax=fig.add_subplot(1, 1, 1)
+  ax.set_title(title, fontweight='bold')
+  ax.set_xlabel(xlabel)
+  ax.set_ylabel(ylabel)
+  ax.xaxis.set_major_locator(mpl.ticker.MaxNLocator(integer=True))
+  return fig, ax
+
+
+def add_rectangles(mpl, ax, left, right, bottom, top, lineWidth):
+  """ draw red rectangles with blue borders as a single collection, which is much faster than one patch each """
+  corners=np.stack([np.column_stack(corner) for corner in ((left, bottom), (left, top), (right, top), (right, bottom))], axis=1)
+  ax.add_collection(mpl.collections.PolyCollection(corners, facecolors='red', edgecolors='blue', linewidths=lineWidth))
+
+
+def draw_boxes(mpl, path, size, title, ylabel, boxes, column, start, end, ylim, yticks=None):
+  """ draw the box plot of one value per e-value bin like quart-align.r and quart-perid.r """
+  fig, ax=new_plot(mpl, size, title, 'Alignment Score', ylabel)
+  numBoxes=end-start+1
+  stepSize=int(math.ceil(10/(size[0]/float(numBoxes))))
+  whiskColor='0.4'
+  if size[0]<1000 and stepSize>1:
+    whiskColor='0.6'
+  lineWidth=0.5 if stepSize>1 else 1.0
+  #borders would hide the fill of boxes only a few pixels wide
+  borderWidth=lineWidth if size[0]/float(numBoxes)>=6 else 0
+  if boxes:
+    keys=np.array([box[0] for box in boxes], dtype=np.float64)
+    stats=np.array([box[column] for box in boxes], dtype=np.float64)
+    ax.vlines(keys, stats[:,0], stats[:,1], colors=whiskColor, linestyles='dashed', linewidths=lineWidth)
+    ax.vlines(keys, stats[:,3], stats[:,4], colors=whiskColor, linestyles='dashed', linewidths=lineWidth)
+    ax.hlines(np.concatenate((stats[:,0], stats[:,4])), np.tile(keys-0.2, 2), np.tile(keys+0.2, 2), colors=whiskColor, linewidths=lineWidth)
+    add_rectangles(mpl, ax, keys-0.4, keys+0.4, stats[:,1], stats[:,3], borderWidth)
+    ax.hlines(stats[:,2], keys-0.4, keys+0.4, colors='blue', linewidths=2*lineWidth)
+  ax.set_xlim(start-1, end+1)
+  ax.set_ylim(*ylim)
+  if yticks is not None:
+    ax.set_yticks(yticks)
+  for side in ('top', 'right'):
+    ax.spines[side].set_visible(False)
+  fig.tight_layout()
+  fig.savefig(path)
+  mpl.pyplot.close(fig)
+
+
+def draw_bars(mpl, path, size, title, xlabel, ylabel, counts, first):
+  """ draw a bar plot of counts for first, first+1, ... like hist-edges.r and hist-length.r """
+  fig, ax=new_plot(mpl, size, title, xlabel, ylabel)
+  counts=np.asarray(counts, dtype=np.float64).ravel()
+  keys=np.arange(first, first+len(counts), dtype=np.float64)
+  if len(counts):
+    add_rectangles(mpl, ax, keys-0.5, keys+0.5, np.zeros(len(counts)), counts, 0.5 if size[0]/float(len(counts))>=6 else 0)
+    ax.set_xlim(first-1, first+len(counts))
+    ax.set_ylim(0, max(1, counts.max())*1.04)
+  fig.tight_layout()
+  fig.savefig(path)
+  mpl.pyplot.close(fig)
+
+
+def draw_graphs(pngDir, jobId, boxes, start, end, maxy, evalueHisto, lengthHistos):
+  """ draw the eight graphs of the graph job (and two per extra length source) without starting R
+
+  lengthHistos holds (file name, title, counts, first length) for each
+  length histogram.
+  """
+  mpl=load_matplotlib()
+  if mpl is None:
+    print("matplotlib is not available, leaving the graphs to the R scripts")
+    return False
+  print("draw graphs in %s" % pngDir)
+  for suffix, boxSize, barSize in (('', BOX_PLOT_SIZE, BAR_PLOT_SIZE), ('_sm', SMALL_PLOT_SIZE, SMALL_PLOT_SIZE)):
+    draw_boxes(mpl, os.path.join(pngDir, 'alignment_length%s.png' % suffix), boxSize, plot_title('Alignment Length vs Alignment Score', jobId),
+      'Alignment Length', boxes, 1, start, end, (0, maxy))
+    yticks=range(0, 101, 20 if boxSize[1]<500 else 10)
+    draw_boxes(mpl, os.path.join(pngDir, 'percent_identity%s.png' % suffix), boxSize, plot_title('Percent Identity vs Alignment Score', jobId),
+      'Percent Identity', boxes, 2, start, end, (0, 100), yticks)
+    for name, title, counts, first in lengthHistos:
+      draw_bars(mpl, os.path.join(pngDir, '%s%s.png' % (name, suffix)), barSize, plot_title('Number of Sequences at Each Length', jobId, title),
+        'Length', 'Number of Sequences', counts, first)
+    draw_bars(mpl, os.path.join(pngDir, 'number_of_edges%s.png' % suffix), barSize, plot_title('Number of Edges at Alignment Score', jobId),
+      'Alignment Score', 'Number of Edges', evalueHisto, start)
+  return True
+
+
+#-------------------------------------------------------------------------------
+# phase timings
+#-------------------------------------------------------------------------------
+class PhaseTimer(object):
+  """ wall clock seconds spent in each named phase of a run, for --timings """
+
+  def __init__(self):
+    self.phases=collections.OrderedDict()
+    self.name=None
+    self.started=time.time()
+    self.last=self.started
+
+  def phase(self, name):
+    """ end the current phase and start the named one """
+    now=time.time()
+    if self.name is not None:
+      self.phases[self.name]=self.phases.get(self.name, 0)+now-self.last
+    self.name=name
+    self.last=now
+
+  def save(self, path, hdfPath, extra=None):
+    self.phase(None)
+    result={'phases': self.phases,
+      'total': time.time()-self.started,
+      'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0,
+      'output_bytes': os.path.getsize(hdfPath)}
+    result.update(extra or {})
+    with open(path, 'w') as out:
+      json.dump(result, out, indent=2)
+
+
+#-------------------------------------------------------------------------------
+# main
+#-------------------------------------------------------------------------------
+
+def main():
+  args=get_args()
+  timer=PhaseTimer()
+
+  hdfFile = h5py.File(args.hdf, "w")
+  scratchFile=None
+  chunksize=args.chunksize
+  storage=StorageProfile(args.storage, chunksize)
+  incfrac=args.incfrac
+
+  #read the blast output and populate data structure
+  timer.phase('ingest')
+  if args.reduce:
+    edges, nodes=reduce_partials(args.reduce, storage)
+  elif args.workers>1 and is_plain_file(args.blast):
+    edges, nodes=aggregate_parallel(args.blast, args.workers, args.readsize, 10**args.peridprec, storage, args.thresholds)
+  else:
+    if args.summary or args.partial:
+      print("read blast, keeping per bin histograms")
+      edges=EdgeHistograms(10**args.peridprec, storage)
+    elif args.stream:
+      maxEdges=max(chunksize, args.maxmem*1024*1024//EDGE_BYTES)
+      print("read blast, streaming to hdf5 with at most %s edges in memory" % maxEdges)
+      if args.layout=='csr':
+        #bins are only known to be complete at the end, so collect them in a scratch file first
+        scratchFile=h5py.File(args.hdf+'.tmp', "w")
+        edges=EdgeBins(storage, scratchFile, maxEdges)
+      else:
+        edges=EdgeBins(storage, hdfFile, maxEdges, incfrac)
+    else:
+      print("read blast")
+      edges=EdgeBins(storage)
+    nodes=NodeScores() if args.thresholds else None
+    if args.workers>1:
+      print("%s is compressed or a stream, reading it with one process" % args.blast)
+    for evalues, align, perid in read_blast_blocks(open_input(args.blast, args.readsize), args.readsize, nodes):
+      edges.add(evalues, align, perid)
+
+  if args.partial:
+    edges.save(hdfFile)
+    if nodes is not None:
+      nodes.save(hdfFile)
+    hdfFile.close()
+    if args.timings:
+      timer.save(args.timings, args.hdf)
+    print("peak memory use was %s MB" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss//1024))
+    return
+
+  timer.phase('trim')
+  counts=edges.counts
+  print("length of histogram is %s" % (max(counts)+1 if counts else 0))
+  start, end=find_bin_range(counts, edges.size, incfrac)
+
+  #ensure datasets exist for all numbers from start to end (will cause R to crash)
+  print("checking from %s to %s" % (start,end))
+  for key in range(start, end):
+    if key not in counts:
+      print("evalue %s was missing" % key)
+
+  #write out the data structure to the hdf5 file
+  timer.phase('write')
+  print("write out start, stop, and max alignment length")
+  hdfFile.create_dataset('/stats/start',(1,1),maxshape=(1,1),chunks=(1,1),dtype=int,data=start)
+  hdfFile.create_dataset('/stats/stop',(1,1),maxshape=(1,1),chunks=(1,1),dtype=int,data=end)
+  hdfFile.create_dataset('/stats/maxy',(1,1),maxshape=(1,1),chunks=(1,1),dtype=int,data=edges.maxy)
+  print("write quartile hdf data from head to tail")
+  if args.summary:
+    edges.write_summary(hdfFile, start, end)
+  elif args.layout=='csr':
+    write_csr(hdfFile, edges, start, end, storage)
   else:
-    counter+=i
-    lenstart+=1
-
-counter=0
-lenstop=len(lengthAry)
-for i in reversed(lengthAry):
-  if counter>chopnumber:
-    print("stop at %s" % lenstop)
-    break
+    edges.write(hdfFile, start, end)
+  if args.pngdir:
+    #collect the box plot data now, the values of streamed csr bins go away with the scratch file
+    boxes=bin_boxes(edges, start, end)
+  if scratchFile is not None:
+    scratchFile.close()
+    os.remove(args.hdf+'.tmp')
+
+  #fix the data for the evalue histogram
+  evalueHisto=[counts.get(key, 0) for key in range(start, end)]
+
+  print("write out evalue histogram data to hdf file")
+  print(evalueHisto)
+  hdfFile.create_dataset('/edgehisto',(len(evalueHisto),1),maxshape=(None,None),dtype=int,data=evalueHisto,**storage.options(len(evalueHisto), int))
+
+  print("write out edge and node counts per alignment score threshold")
+  write_thresholds(hdfFile, counts, nodes)
+
+  timer.phase('lengths')
+  lengthHistos=[]
+  lengthTitles=dict(args.lengthtitles)
+  if not args.lengths:
+    lengthAry, lenstart, lenstop=length_histogram(args.fasta, incfrac, args.readsize, args.lengthcache)
+    write_length_histogram(hdfFile, lengthAry, lenstart, lenstop, storage)
+    lengthHistos.append(('length_histogram', '', lengthAry, lenstart))
   else:
-    counter+=i
-    lenstop-=1
+    for name, path in [('sequences', args.fasta)]+args.lengths:
+      if not os.path.exists(path) and path!='-':
+        print("length source %s does not exist, skipping %s" % (path, name))
+        continue
+      lengthAry, lenstart, lenstop=length_histogram(path, incfrac, args.readsize, args.lengthcache)
+      write_length_histogram(hdfFile, lengthAry, lenstart, lenstop, storage, '/lenhisto/'+name)
+      lengthHistos.append(('length_histogram' if name=='sequences' else 'length_histogram_'+name, lengthTitles.get(name, ''), lengthAry, lenstart))
+  hdfFile.close()
+  if getattr(edges, 'deleted', False):
+    timer.phase('repack')
+    print("repack %s to reclaim the space of trimmed bins that were already written" % args.hdf)
+    repack_file(args.hdf)
+  #streamed values are written while 1.out is read, so their time counts towards ingest
+  storageReport=storage.report(args.hdf, timer.phases.get('write', 0))
 
-print("start is %s, stop is %s" % (lenstart,lenstop))
-lengthAry=lengthAry[lenstart:lenstop]
+  if args.pngdir:
+    timer.phase('graphs')
+    draw_graphs(args.pngdir, args.jobid, boxes, start, end, edges.maxy, evalueHisto, lengthHistos)
 
-lenmax=0
-for i in lengthAry:
-  if lenmax<i:
-    lenmax=i
+  if args.timings:
+    timer.save(args.timings, args.hdf, {'storage': storageReport})
+  print("peak memory use was %s MB" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss//1024))
 
-print("Write length histogram data to hdfFile")
 
-hdfFile.create_dataset('/lenhisto',(len(lengthAry),1),maxshape=(None,None),chunks=(chunksize/2,1),dtype=int,data=lengthAry)
-hdfFile.create_dataset('/stats/lenstart',(1,1),maxshape=(1,1),chunks=(1,1),dtype=int,data=lenstart)
-hdfFile.create_dataset('/stats/lenstop',(1,1),maxshape=(1,1),chunks=(1,1),dtype=int,data=lenstop)
-hdfFile.create_dataset('/stats/lenmax',(1,1),maxshape=(1,1),chunks=(1,1),dtype=int,data=lenmax)
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,30 @@
+""" loading the scripts under sbin as modules for the tests """
+
+import os
+import sys
+
+#the top of the repository
+ROOT=os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+
+def script_path(relpath):
+  return os.path.join(ROOT, *relpath.split('/'))
+
+
+def load_script(relpath, name=None):
+  """ import the script at relpath (from the top of the repository) as a module """
+  path=script_path(relpath)
+  name=name or os.path.splitext(os.path.basename(path))[0]
+  if name in sys.modules:
+    return sys.modules[name]
+  try:
+    import importlib.util
+  except ImportError:
+    import imp
+    return imp.load_source(name, path)
+  spec=importlib.util.spec_from_file_location(name, path)
+  module=importlib.util.module_from_spec(spec)
+  #registered first so multiprocessing workers can pickle the script's classes
+  sys.modules[name]=module
+  spec.loader.exec_module(module)
+  return module
@@ -0,0 +1,38 @@
+""" smoke tests of misc/benchmark_hdf5_graph_data.py, run with python -m pytest test/python """
+
+from __future__ import print_function
+
+import argparse
+import json
+import subprocess
+import sys
+
+import pytest
+
+from scripts import load_script, script_path
+
+pytest.importorskip('numpy')
+pytest.importorskip('h5py')
+
+benchmark=load_script('misc/benchmark_hdf5_graph_data.py')
+
+
+def test_benchmark_runs(tmpdir):
+  output=tmpdir.join('graph.json')
+  subprocess.check_call([sys.executable, script_path('misc/benchmark_hdf5_graph_data.py'), '-s', '5K', '-d', str(tmpdir.join('work')),
+    '-c', 'default=', '-c', 'workers=--summary -w 2', '-o', str(output)], stderr=subprocess.DEVNULL)
+  results=json.loads(output.read())
+  assert [(run['edges'], run['config']) for run in results['runs']]==[(5000, 'default'), (5000, 'workers')]
+  for run in results['runs']:
+    assert run['wall']>0
+    assert run['peak_rss_mb']>0
+
+
+@pytest.mark.parametrize('code, status', [('sys.exit(3)', 3), ('os.kill(os.getpid(), signal.SIGKILL)', -9)], ids=['exit', 'signal'])
+def test_failed_run_status(tmpdir, code, status):
+  script=tmpdir.join('fail.py')
+  script.write('import os, signal, sys\n%s\n' % code)
+  args=argparse.Namespace(python=sys.executable, script=str(script))
+  with pytest.raises(RuntimeError) as error:
+    benchmark.run_once(args, 'blast', 'fasta', str(tmpdir), [])
+  assert 'exited with status %s,' % status in str(error.value)
@@ -0,0 +1,28 @@
+""" smoke tests of misc/benchmark_merge_shortbred.py, run with python -m pytest test/python """
+
+import json
+import subprocess
+import sys
+
+import pytest
+
+from scripts import script_path
+
+c_phases = ["load", "relabel", "normalize", "write_proteins", "collapse", "write_clusters"]
+
+@pytest.mark.parametrize( "workers", [1, 2] )
+def test_benchmark_runs_every_phase( tmpdir, workers ):
+    pytest.importorskip( "numpy" )
+    output = tmpdir.join( "merge.json" )
+    subprocess.check_call( [sys.executable, script_path( "misc/benchmark_merge_shortbred.py" ), "-s", "4", "-f", "5",
+                            "--workers", str( workers ), "-d", str( tmpdir.join( "work" ) ), "-o", str( output )],
+                           stderr=subprocess.DEVNULL )
+    results = json.loads( output.read( ) )
+    assert results["workers"] == workers
+    assert [run["backend"] for run in results["runs"]] == ["matrix", "dict"]
+    for run in results["runs"]:
+        assert [phase["phase"] for phase in run["phases"]] == c_phases
+        assert run["phases"][0]["files"] == 4
+    # both backends write the same tables
+    for name in ( "protein_abundance.txt", "cluster_abundance.txt" ):
+        assert tmpdir.join( "work", "out_matrix", name ).read( ) == tmpdir.join( "work", "out_dict", name ).read( )
@@ -0,0 +1,562 @@
+""" tests of sbin/make_hdf5_graph_data.py, run with python -m pytest test/python """
+
+from __future__ import print_function
+
+import bz2
+import collections
+import gzip
+import io
+import math
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from scripts import load_script, script_path
+
+np=pytest.importorskip('numpy')
+h5py=pytest.importorskip('h5py')
+
+graph=load_script('sbin/make_hdf5_graph_data.py')
+
+
+def run_graph_data(*args):
+  subprocess.check_call([sys.executable, script_path('sbin/make_hdf5_graph_data.py')]+[str(arg) for arg in args], stdout=subprocess.DEVNULL)
+
+
+def write_file(path, data):
+  with open(str(path), 'wb') as out:
+    out.write(data)
+  return str(path)
+
+
+def read_datasets(path):
+  """ every dataset of a hdf5 file by name """
+  datasets={}
+  with h5py.File(path, 'r') as hdfFile:
+    hdfFile.visititems(lambda name, obj: datasets.__setitem__(name, obj[...]) if isinstance(obj, h5py.Dataset) else None)
+  return datasets
+
+
+def random_blast(count, seed=1):
+  """ 1.out lines with normally distributed scores, so the outer e-value bins hold few edges """
+  rng=np.random.RandomState(seed)
+  qlen=rng.randint(100, 600, count)
+  slen=rng.randint(100, 600, count)
+  align=np.minimum(qlen, slen)-rng.randint(0, 50, count)
+  bits=np.maximum(30, rng.normal(200, 40, count))
+  return ''.join('Q%d\tS%d\t%.2f\t%d\t%.1f\t%d\t%d\n' % row for row in
+    zip(rng.randint(0, count//5, count).tolist(), rng.randint(0, count//5, count).tolist(), rng.uniform(20, 100, count).tolist(),
+      align.tolist(), bits.tolist(), qlen.tolist(), slen.tolist())).encode()
+
+
+def random_fasta(count, seed=1):
+  """ fasta records of random lengths, 60 residues per line """
+  rng=np.random.RandomState(seed)
+  records=[]
+  for index, length in enumerate(rng.randint(50, 700, count).tolist()):
+    residues=b'ACDEFGHIKLMNPQRSTVWY'*(length//20+1)
+    records.append(b'>A0A%07d\n' % index+b''.join(residues[pos:min(pos+60, length)]+b'\n' for pos in range(0, length, 60)))
+  return b''.join(records)
+
+
+def reference_edges(blast):
+  """ (evalue, align, perid) of each 1.out line, computed like the original line by line script """
+  edges=[]
+  for line in blast.decode().splitlines():
+    if not line.strip():
+      continue
+    row=line.rstrip().split('\t')
+    evalue=int(-(math.log(int(row[5])*int(row[6]))/math.log(10))+float(row[4])*math.log(2)/math.log(10))
+    edges.append((evalue, int(row[3]), float(row[2])))
+  return edges
+
+
+def reference_bins(blast, incfrac=0.99):
+  """ the bins and stats the original make_hdf5_graph_data.py wrote """
+  align=collections.defaultdict(list)
+  perid=collections.defaultdict(list)
+  maxy=0
+  for evalue, length, identity in reference_edges(blast):
+    align[evalue].append(length)
+    perid[evalue].append(identity)
+    maxy=max(maxy, length)
+  size=sum(len(values) for values in align.values())
+  chopnumber=int((size-int(size*incfrac))/2)
+  keys=sorted(align)
+  remove=set()
+  for ordered in (keys, keys[::-1]):
+    tmpcount=0
+    for key in ordered:
+      tmpcount+=len(align[key])
+      if tmpcount<chopnumber:
+        remove.add(key)
+  kept=[key for key in keys if key not in remove]
+  start, end=kept[0], kept[-1]
+  return {'stats/start': start, 'stats/stop': end, 'stats/maxy': maxy,
+    'edgehisto': [len(align.get(key, [])) for key in range(start, end)],
+    'bins': dict((key, (align.get(key, []), perid.get(key, []))) for key in range(start, end+1))}
+
+
+def reference_lengths(fasta):
+  """ the sequence length histogram of the original script, untrimmed """
+  lengths=collections.Counter()
+  fastaLen=None
+  for line in fasta.decode().splitlines():
+    if line.startswith('>'):
+      if fastaLen is not None:
+        lengths[fastaLen]+=1
+      fastaLen=0
+    else:
+      fastaLen+=len(line.rstrip())
+  lengths[fastaLen]+=1
+  return [lengths[i] for i in range(max(lengths)+1)]
+
+
+def reference_length_histogram(fasta, incfrac=0.99):
+  """ the trimmed length histogram and stats of the original script """
+  lengthAry=reference_lengths(fasta)
+  chopnumber=int((1-incfrac)*sum(lengthAry))
+  lenstart=0
+  counter=0
+  for i in lengthAry:
+    if counter>chopnumber:
+      break
+    counter+=i
+    lenstart+=1
+  lenstop=len(lengthAry)
+  counter=0
+  for i in reversed(lengthAry):
+    if counter>chopnumber:
+      break
+    counter+=i
+    lenstop-=1
+  return {'lenhisto': lengthAry[lenstart:lenstop], 'stats/lenstart': lenstart, 'stats/lenstop': lenstop,
+    'stats/lenmax': max(lengthAry[lenstart:lenstop])}
+
+
+def fivenum(values):
+  """ Tukey five number summary as computed by R's fivenum """
+  values=sorted(values)
+  n=len(values)
+  n4=math.floor((n+3)/2.0)/2.0
+  return [0.5*(values[int(math.floor(d))-1]+values[int(math.ceil(d))-1]) for d in (1, n4, (n+1)/2.0, n+1-n4, n)]
+
+
+def reference_thresholds(blast):
+  """ edges and distinct sequences at or above each alignment score """
+  edges=collections.Counter()
+  best={}
+  for line, (evalue, length, identity) in zip([line for line in blast.decode().splitlines() if line.strip()], reference_edges(blast)):
+    edges[evalue]+=1
+    for seqId in line.split('\t')[:2]:
+      best[seqId]=max(best.get(seqId, evalue), evalue)
+  scores=list(range(min(edges), max(edges)+1))
+  counts=[edges[key] for key in scores]
+  return {'thresholds/score': scores, 'thresholds/edges': counts,
+    'thresholds/cumulative': [sum(counts[i:]) for i in range(len(counts))],
+    'thresholds/nodes': [sum(1 for value in best.values() if value>=key) for key in scores]}
+
+
+def blast_lines(count, prefix='Q'):
+  return b''.join(b'%s%d\tS%d\t%.2f\t%d\t%.1f\t%d\t%d\n' % (prefix.encode(), i, i%97, 20+i%80, 50+i%400, 60+i%300, 200+i%50, 250+i%70)
+    for i in range(count))
+
+
+#-------------------------------------------------------------------------------
+# compressed input
+#-------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('compress', [gzip.compress, bz2.compress], ids=['gzip', 'bzip2'])
+def test_members_ending_on_a_block_boundary(tmpdir, compress):
+  first=blast_lines(2000)
+  second=blast_lines(2000, 'R')
+  member=compress(first)
+  path=str(tmpdir.join('1.out.z'))
+  with open(path, 'wb') as out:
+    out.write(member+compress(second))
+  for blocksize in (len(member), 7, 1<<20):
+    assert b''.join(graph.decompressed_blocks(path, blocksize))==first+second
+
+
+def test_truncated_member(tmpdir):
+  path=str(tmpdir.join('1.out.gz'))
+  with open(path, 'wb') as out:
+    out.write(gzip.compress(blast_lines(100))[:-10])
+  with pytest.raises(IOError):
+    b''.join(graph.decompressed_blocks(path, 100))
+
+
+def test_length_inputs_decompress_in_a_thread(tmpdir, monkeypatch):
+  threads=[]
+  decompress=graph.decompressed_blocks
+  def recorded(path, blocksize):
+    for block in decompress(path, blocksize):
+      threads.append(threading.current_thread())
+      yield block
+  monkeypatch.setattr(graph, 'decompressed_blocks', recorded)
+  fasta=str(tmpdir.join('all.fa.gz'))
+  with gzip.open(fasta, 'wb') as out:
+    out.write(random_fasta(500))
+  table=str(tmpdir.join('length.tab.bz2'))
+  with bz2.BZ2File(table, 'wb') as out:
+    out.write(b'100\t3\n102\t5\n')
+  assert graph.scan_fasta_lengths(fasta, 1000)[0]==500
+  assert graph.read_length_table(table, 1000)==([3, 0, 5], 100, 103)
+  assert threads and threading.current_thread() not in threads
+
+
+#-------------------------------------------------------------------------------
+# edges without ids
+#-------------------------------------------------------------------------------
+
+def test_node_scores_without_ids():
+  nodes=graph.NodeScores()
+  nodes.merge(graph.NodeScores())
+  nodes.update(np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64))
+  assert len(nodes.ids)==0
+  assert nodes.counts(0, 2).tolist()==[0, 0, 0]
+
+
+def test_node_scores_with_repeated_ids():
+  rng=np.random.RandomState(4)
+  ids=rng.randint(1, 50, 5000).astype(np.uint64)
+  bins=rng.randint(-3, 40, 5000).astype(np.int64)
+  nodes=graph.NodeScores()
+  nodes.update(ids[:2000], bins[:2000])
+  nodes.update(ids[2000:], bins[2000:])
+  best={}
+  for seqId, value in zip(ids.tolist(), bins.tolist()):
+    best[seqId]=max(best.get(seqId, value), value)
+  assert nodes.ids.tolist()==sorted(best)
+  assert nodes.best.tolist()==[best[seqId] for seqId in sorted(best)]
+
+
+def test_reduce_with_an_empty_shard(tmpdir):
+  lines=blast_lines(3000)
+  cut=lines.index(b'\n', len(lines)//2)+1
+  fasta=write_file(tmpdir.join('all.fa'), b'>a\nACGT\n')
+  partials=[]
+  for name, data in (('a', lines[:cut]), ('empty', b''), ('b', lines[cut:])):
+    partials.append(str(tmpdir.join(name+'.h5')))
+    run_graph_data('-p', '-b', write_file(tmpdir.join(name+'.out'), data), '-f', partials[-1])
+  run_graph_data('-r', *(partials+['-f', tmpdir.join('reduced.h5'), '-a', fasta]))
+  run_graph_data('-b', write_file(tmpdir.join('1.out'), lines), '--summary', '-f', tmpdir.join('whole.h5'), '-a', fasta)
+  reduced=read_datasets(str(tmpdir.join('reduced.h5')))
+  whole=read_datasets(str(tmpdir.join('whole.h5')))
+  for name in ('edgehisto', 'thresholds/edges', 'thresholds/nodes', 'stats/start', 'stats/stop', 'stats/maxy'):
+    assert np.array_equal(reduced[name], whole[name]), name
+
+
+def test_workers_with_a_range_of_blank_lines(tmpdir):
+  lines=blast_lines(40)
+  fasta=write_file(tmpdir.join('all.fa'), b'>a\nACGT\n')
+  blast=write_file(tmpdir.join('1.out'), lines[:lines.index(b'\n', 1000)+1]+b'\n'*200000+lines[lines.index(b'\n', 1000)+1:])
+  run_graph_data('-w', 4, '--read-size', 1000, '-b', blast, '-f', tmpdir.join('workers.h5'), '-a', fasta)
+  run_graph_data('-b', blast, '--summary', '-f', tmpdir.join('one.h5'), '-a', fasta)
+  workers=read_datasets(str(tmpdir.join('workers.h5')))
+  one=read_datasets(str(tmpdir.join('one.h5')))
+  for name in ('edgehisto', 'thresholds/nodes'):
+    assert np.array_equal(workers[name], one[name]), name
+
+
+#-------------------------------------------------------------------------------
+# streaming
+#-------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('order', ['file', 'score'])
+def test_streamed_bins_take_no_more_space(tmpdir, order):
+  lines=random_blast(20000)
+  if order=='score':
+    #the outer bins come first and are written before they are known to be trimmed
+    lines=b''.join(sorted(lines.splitlines(True), key=lambda line: float(line.split(b'\t')[4])))
+  blast=write_file(tmpdir.join('1.out'), lines)
+  fasta=write_file(tmpdir.join('all.fa'), b'>a\nACGT\n')
+  plain=str(tmpdir.join('plain.h5'))
+  streamed=str(tmpdir.join('streamed.h5'))
+  run_graph_data('-b', blast, '-a', fasta, '-f', plain, '-c', 400)
+  run_graph_data('-b', blast, '-a', fasta, '-f', streamed, '-c', 400, '--stream', '-m', 0)
+  plainData=read_datasets(plain)
+  streamedData=read_datasets(streamed)
+  assert sorted(plainData)==sorted(streamedData)
+  for name in plainData:
+    assert np.array_equal(plainData[name], streamedData[name]), name
+  assert os.path.getsize(streamed)<=os.path.getsize(plain)
+
+
+#-------------------------------------------------------------------------------
+# equivalence with the original line by line script
+#-------------------------------------------------------------------------------
+
+@pytest.fixture(scope='module')
+def job(tmpdir_factory):
+  folder=tmpdir_factory.mktemp('job')
+  blast=random_blast(30000, 2)
+  fasta=random_fasta(3000, 2)
+  paths={'blast': write_file(folder.join('1.out'), blast), 'fasta': write_file(folder.join('all.fa'), fasta)}
+  #shards of 1.out for --partial, one of them empty
+  lines=blast.splitlines(True)
+  paths['shards']=[write_file(folder.join('shard%d.out' % i), b''.join(part)) for i, part in
+    enumerate((lines[:10000], [], lines[10000:25000], lines[25000:]))]
+  with gzip.open(str(folder.join('1.out.gz')), 'wb') as out:
+    out.write(blast)
+  with gzip.open(str(folder.join('all.fa.gz')), 'wb') as out:
+    out.write(fasta)
+  paths['blastgz']=str(folder.join('1.out.gz'))
+  paths['fastagz']=str(folder.join('all.fa.gz'))
+  expected=reference_bins(blast)
+  expected.update(reference_length_histogram(fasta))
+  expected.update(reference_thresholds(blast))
+  return folder, paths, expected
+
+
+def check_common(data, expected):
+  """ the stats and histograms every mode writes """
+  for name in ('stats/start', 'stats/stop', 'stats/maxy', 'stats/lenstart', 'stats/lenstop', 'stats/lenmax'):
+    assert data[name].ravel().tolist()==[expected[name]], name
+  for name in ('edgehisto', 'lenhisto'):
+    assert data[name].ravel().tolist()==expected[name], name
+
+
+def check_bins(data, expected, ordered=True):
+  """ /align/<bin> and /perid/<bin>, in file order or sorted """
+  names=set('align/%s' % key for key in expected['bins'])|set('perid/%s' % key for key in expected['bins'])
+  assert set(name for name in data if name.startswith(('align/', 'perid/')))==names
+  for key, (align, perid) in expected['bins'].items():
+    if not ordered:
+      align, perid=sorted(align), sorted(perid)
+    assert data['align/%s' % key][:,0].tolist()==align, key
+    assert data['perid/%s' % key][:,0].tolist()==perid, key
+
+
+@pytest.mark.parametrize('options', [[], ['--stream', '-m', 0, '-c', 500]], ids=['default', 'stream'])
+def test_bins_layout(job, options):
+  folder, paths, expected=job
+  path=str(folder.join('bins.h5'))
+  run_graph_data(*(['-b', paths['blast'], '-a', paths['fasta'], '-f', path, '--no-length-cache']+options))
+  data=read_datasets(path)
+  check_common(data, expected)
+  check_bins(data, expected)
+
+
+#-------------------------------------------------------------------------------
+# parsing 1.out
+#-------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('fastLoadtxt', [True, False], ids=['loadtxt', 'fromstring'])
+@pytest.mark.parametrize('readsize', [1000, 1<<20])
+def test_blast_blocks_match_lines(monkeypatch, fastLoadtxt, readsize):
+  monkeypatch.setattr(graph, 'FAST_LOADTXT', fastLoadtxt)
+  lines=random_blast(5000, 3).splitlines(True)
+  #a blank line and a line with an extra column are parsed one line at a time
+  lines[100]=b'\n'+lines[100]
+  lines[2000]=lines[2000].rstrip(b'\n')+b'\textra\n'
+  blast=b''.join(lines)
+  blocks=list(graph.read_blast_blocks(io.StringIO(blast.decode()), readsize))
+  evalues, align, perid=[np.concatenate(arrays).tolist() for arrays in zip(*blocks)]
+  assert list(zip(evalues, align, perid))==reference_edges(blast)
+
+
+#-------------------------------------------------------------------------------
+# box plot summaries
+#-------------------------------------------------------------------------------
+
+def check_summary(data, expected):
+  keys=sorted(expected['bins'])
+  assert data['summary/align'].shape==(len(keys), len(graph.SUMMARY_COLUMNS))
+  for i, key in enumerate(keys):
+    align, perid=expected['bins'][key]
+    if not align:
+      assert data['summary/align'][i,-1]==0
+      continue
+    assert np.allclose(data['summary/align'][i,:5], fivenum(align)), key
+    assert np.allclose(data['summary/perid'][i,:5], fivenum(perid)), key
+    assert data['summary/align'][i,-1]==len(align)
+
+
+def test_summary(job):
+  folder, paths, expected=job
+  path=str(folder.join('summary.h5'))
+  run_graph_data('-b', paths['blast'], '-a', paths['fasta'], '-f', path, '--summary', '--no-length-cache')
+  data=read_datasets(path)
+  check_common(data, expected)
+  check_summary(data, expected)
+  assert not any(name.startswith(('align/', 'perid/')) for name in data)
+
+
+#-------------------------------------------------------------------------------
+# csr layout
+#-------------------------------------------------------------------------------
+
+def check_csr(data, expected):
+  offsets=data['offsets'].tolist()
+  assert len(offsets)==len(expected['bins'])+1
+  for i, key in enumerate(sorted(expected['bins'])):
+    align, perid=expected['bins'][key]
+    assert data['align/values'][offsets[i]:offsets[i+1]].tolist()==sorted(align), key
+    assert data['perid/values'][offsets[i]:offsets[i+1]].tolist()==sorted(perid), key
+
+
+@pytest.mark.parametrize('options', [[], ['--stream', '-m', 0, '-c', 500]], ids=['memory', 'stream'])
+def test_csr_layout(job, options):
+  folder, paths, expected=job
+  path=str(folder.join('csr.h5'))
+  run_graph_data(*(['-b', paths['blast'], '-a', paths['fasta'], '-f', path, '--layout', 'csr', '--no-length-cache']+options))
+  data=read_datasets(path)
+  check_common(data, expected)
+  check_csr(data, expected)
+  with h5py.File(path, 'r') as hdfFile:
+    assert hdfFile.attrs['version']==graph.CSR_VERSION
+
+
+#-------------------------------------------------------------------------------
+# parallel reading
+#-------------------------------------------------------------------------------
+
+def test_workers(job):
+  folder, paths, expected=job
+  path=str(folder.join('workers.h5'))
+  run_graph_data('-b', paths['blast'], '-a', paths['fasta'], '-f', path, '-w', 3, '--read-size', 50000, '--no-length-cache')
+  data=read_datasets(path)
+  check_common(data, expected)
+  #values counted into histograms come back sorted
+  check_bins(data, expected, ordered=False)
+
+
+#-------------------------------------------------------------------------------
+# partial and reduce
+#-------------------------------------------------------------------------------
+
+def test_partial_and_reduce(job):
+  folder, paths, expected=job
+  partials=[]
+  for i, shard in enumerate(paths['shards']):
+    partials.append(str(folder.join('partial%d.h5' % i)))
+    run_graph_data('-p', '-b', shard, '-f', partials[-1])
+  path=str(folder.join('reduced.h5'))
+  run_graph_data(*(['-r']+partials+['-a', paths['fasta'], '-f', path, '--no-length-cache']))
+  data=read_datasets(path)
+  check_common(data, expected)
+  check_bins(data, expected, ordered=False)
+
+
+#-------------------------------------------------------------------------------
+# length histogram
+#-------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('readsize', [1, 7, 64, 4096, 1<<20])
+def test_scan_fasta_lengths(tmpdir, readsize):
+  #long headers and unwrapped records span several blocks of the smaller read sizes
+  fasta=random_fasta(300, 3)+b'>A0A0000300 a much longer header line '+b'x'*200+b'\n'+b'A'*1000+b'\n>A0A0000301\nCC\r\nC'
+  path=write_file(tmpdir.join('all.fa'), fasta)
+  fastaNum, lengthHisto=graph.scan_fasta_lengths(path, readsize)
+  assert fastaNum==302
+  assert lengthHisto.tolist()==reference_lengths(fasta)
+
+
+def test_length_cache(tmpdir):
+  fasta=write_file(tmpdir.join('all.fa'), random_fasta(200))
+  first=graph.fasta_lengths(fasta, 4096, True)
+  assert os.path.exists(fasta+'.lenhisto.json')
+  second=graph.fasta_lengths(fasta, 4096, True)
+  assert first[0]==second[0]==200
+  assert first[1].tolist()==second[1].tolist()
+  #a rewritten file is scanned again
+  write_file(fasta, random_fasta(100))
+  assert graph.fasta_lengths(fasta, 4096, True)[0]==100
+
+
+#-------------------------------------------------------------------------------
+# length sources
+#-------------------------------------------------------------------------------
+
+def test_length_sources(job):
+  folder, paths, expected=job
+  table=write_file(folder.join('length.tab'), b''.join(b'%d\t%d\n' % (expected['stats/lenstart']+i, count) for i, count in enumerate(expected['lenhisto'])))
+  path=str(folder.join('lengths.h5'))
+  run_graph_data('-b', paths['blast'], '-a', paths['fasta'], '-f', path, '--summary', '--no-length-cache',
+    '-n', 'uniprot='+table, '-n', 'domain='+paths['fasta'], '-n', 'missing='+str(folder.join('missing.tab')))
+  data=read_datasets(path)
+  for name in ('sequences', 'uniprot', 'domain'):
+    assert data['lenhisto/%s/counts' % name].ravel().tolist()==expected['lenhisto'], name
+    assert data['lenhisto/%s/start' % name].ravel().tolist()==[expected['stats/lenstart']], name
+    assert data['lenhisto/%s/max' % name].ravel().tolist()==[expected['stats/lenmax']], name
+  assert not any(name.startswith('lenhisto/missing') for name in data)
+
+
+#-------------------------------------------------------------------------------
+# thresholds
+#-------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('options', [[], ['--stream', '-m', 0], ['-w', 3, '--read-size', 50000]], ids=['default', 'stream', 'workers'])
+def test_thresholds(job, options):
+  folder, paths, expected=job
+  path=str(folder.join('thresholds.h5'))
+  run_graph_data(*(['-b', paths['blast'], '-a', paths['fasta'], '-f', path, '--no-length-cache']+options))
+  data=read_datasets(path)
+  for name in ('thresholds/score', 'thresholds/edges', 'thresholds/cumulative', 'thresholds/nodes'):
+    assert data[name].ravel().tolist()==expected[name], name
+
+
+def test_no_thresholds(job):
+  folder, paths, expected=job
+  path=str(folder.join('thresholds.h5'))
+  run_graph_data('-b', paths['blast'], '-a', paths['fasta'], '-f', path, '--no-length-cache', '--no-thresholds')
+  data=read_datasets(path)
+  assert data['thresholds/edges'].tolist()==expected['thresholds/edges']
+  assert 'thresholds/nodes' not in data
+
+
+#-------------------------------------------------------------------------------
+# compressed and piped input
+#-------------------------------------------------------------------------------
+
+def test_compressed_and_piped_input(job):
+  folder, paths, expected=job
+  path=str(folder.join('gz.h5'))
+  run_graph_data('-b', paths['blastgz'], '-a', paths['fastagz'], '-f', path, '--read-size', 65536, '--no-length-cache')
+  data=read_datasets(path)
+  check_common(data, expected)
+  check_bins(data, expected)
+  path=str(folder.join('stdin.h5'))
+  with open(paths['blastgz'], 'rb') as stdin:
+    subprocess.check_call([sys.executable, script_path('sbin/make_hdf5_graph_data.py'), '-b', '-', '-a', paths['fasta'], '-f', path, '--no-length-cache'],
+      stdin=stdin, stdout=subprocess.DEVNULL)
+  data=read_datasets(path)
+  check_common(data, expected)
+  check_bins(data, expected)
+
+
+#-------------------------------------------------------------------------------
+# graphs
+#-------------------------------------------------------------------------------
+
+def test_graphs(job):
+  pytest.importorskip('matplotlib')
+  folder, paths, expected=job
+  pngDir=folder.mkdir('png')
+  run_graph_data('-b', paths['blast'], '-a', paths['fasta'], '-f', folder.join('png.h5'), '--summary', '--no-length-cache', '--png-dir', pngDir, '--job-id', 7)
+  for name in ('alignment_length', 'percent_identity', 'length_histogram', 'number_of_edges'):
+    for suffix in ('', '_sm'):
+      assert pngDir.join(name+suffix+'.png').size()>0, name+suffix
+
+
+#-------------------------------------------------------------------------------
+# storage profiles
+#-------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('options', [['--storage', 'small'], ['--storage', 'fast-write', '--stream', '-m', 0], ['--storage', 'remote-read']],
+  ids=['small', 'fast-write-stream', 'remote-read'])
+def test_storage_profiles(job, options):
+  folder, paths, expected=job
+  path=str(folder.join('storage.h5'))
+  run_graph_data(*(['-b', paths['blast'], '-a', paths['fasta'], '-f', path, '--no-length-cache']+options))
+  data=read_datasets(path)
+  check_common(data, expected)
+  check_bins(data, expected)
+  compression=graph.STORAGE_PROFILES[options[1]][0]
+  with h5py.File(path, 'r') as hdfFile:
+    for key in expected['bins']:
+      assert hdfFile['align/%s' % key].compression==compression, key
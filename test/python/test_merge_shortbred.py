@@ -0,0 +1,202 @@
+""" tests of sbin/efi_cgfp/merge_shortbred.py, run with python -m pytest test/python """
+
+from __future__ import print_function
+
+import gzip
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+from scripts import script_path
+
+c_script = script_path( "sbin/efi_cgfp/merge_shortbred.py" )
+c_header = "Family\tCount\tHits\tTotMarkerLength"
+
+#-------------------------------------------------------------------------------
+# helpers
+#-------------------------------------------------------------------------------
+
+def run_merge( *args ):
+    # stderr has the missing genome size messages
+    subprocess.check_call( [sys.executable, c_script] + [str( a ) for a in args], stderr=subprocess.DEVNULL )
+
+def read_text( path ):
+    with open( str( path ) ) as fh:
+        return fh.read( )
+
+def write_sample( path, rows ):
+    with open( str( path ), "w" ) as fh:
+        fh.write( "\n".join( [c_header] + ["%s\t%r\t1\t300" % ( name, value ) for name, value in rows] ) + "\n" )
+    return str( path )
+
+def make_job( folder, samples=6, seed=1 ):
+    """ cluster map, genome sizes and median and mean files for a small job """
+    rng = random.Random( seed )
+    proteins = ["A0A%07d" % i for i in range( 60 )]
+    clusters = folder.join( "cgfp-clusters.txt" )
+    with open( str( clusters ), "w" ) as fh:
+        # the last proteins are in no cluster and end up in #N/A
+        for i, acc in enumerate( proteins[:50] ):
+            print( "%d\t%s" % ( 1 + i % 7, acc ), file=fh )
+    sizes = folder.join( "ags.txt" )
+    with open( str( sizes ), "w" ) as fh:
+        # sample 0 has no genome size and gets the default
+        for i in range( 1, samples ):
+            print( "SRS%03d\t%d" % ( i, rng.randint( 2000000, 8000000 ) ), file=fh )
+    files = {"median": [], "mean": []}
+    for stat in files:
+        for i in range( samples ):
+            rows = []
+            for acc in proteins:
+                name = acc if rng.random( ) < 0.7 else "tr|%s|%s_BACT" % ( acc, acc[-4:] )
+                # the last sample has no hits at all, so it sums to 0
+                value = 0.0 if i == samples - 1 or rng.random( ) < 0.6 else rng.lognormvariate( 1, 2 )
+                rows.append( ( name, value ) )
+            files[stat].append( write_sample( folder.join( "SRS%03d.%s.txt" % ( i, stat ) ), rows ) )
+    return str( clusters ), str( sizes ), files
+
+def read_table( path ):
+    """ (samples, [(feature, [values])]) of a dense table """
+    lines = read_text( path ).splitlines( )
+    samples = lines[0].split( "\t" )[1:]
+    rows = [line.split( "\t" ) for line in lines[1:]]
+    return samples, [( row[0], [float( v ) for v in row[1:]] ) for row in rows]
+
+#-------------------------------------------------------------------------------
+# the dict backend, which keeps the original merge code
+#-------------------------------------------------------------------------------
+
+def test_dict_backend_table( tmpdir ):
+    clusters = tmpdir.join( "cgfp-clusters.txt" )
+    clusters.write( "2\tP1\n1\tP2\n10\tP3\n" )
+    s1 = write_sample( tmpdir.join( "S1.txt" ), [( "P1", 2.0 ), ( "tr|P2|X_BACT", 6.0 ), ( "Q9", 0.0 )] )
+    s2 = write_sample( tmpdir.join( "S2.txt" ), [( "P1", 1.0 ), ( "P3", 3.0 )] )
+    run_merge( s1, s2, "-c", clusters, "-n", "--backend", "dict",
+               "-p", tmpdir.join( "p.txt" ), "-C", tmpdir.join( "c.txt" ) )
+    assert read_text( tmpdir.join( "p.txt" ) ) == (
+        "Feature \\ Sample\tS1\tS2\n"
+        "#N/A|Q9\t0\t0\n"
+        "1|P2\t0.75\t0\n"
+        "2|P1\t0.25\t0.25\n"
+        "10|P3\t0\t0.75\n" )
+    assert read_text( tmpdir.join( "c.txt" ) ) == (
+        "Feature \\ Sample\tS1\tS2\n"
+        "#N/A\t0\t0\n"
+        "1\t0.75\t0\n"
+        "2\t0.25\t0.25\n"
+        "10\t0\t0.75\n" )
+
+#-------------------------------------------------------------------------------
+# equivalence with the dict backend
+#-------------------------------------------------------------------------------
+
+@pytest.mark.parametrize( "options", [
+    ["--backend", "matrix"],
+    ["--backend", "matrix", "--workers", "3"],
+    ["--backend", "dict", "--workers", "3"],
+], ids=["matrix", "matrix-workers", "dict-workers"] )
+def test_backends_match_dict( tmpdir, options ):
+    pytest.importorskip( "numpy" )
+    clusters, sizes, files = make_job( tmpdir )
+    for norm in ( [], ["-n"], ["-g", sizes], ["-g", sizes, "-n"] ):
+        base = ["-c", clusters] + files["median"] + norm
+        run_merge( *( base + ["--backend", "dict", "-p", tmpdir.join( "dp.txt" ), "-C", tmpdir.join( "dc.txt" )] ) )
+        run_merge( *( base + options + ["-p", tmpdir.join( "p.txt" ), "-C", tmpdir.join( "c.txt" )] ) )
+        assert read_text( tmpdir.join( "p.txt" ) ) == read_text( tmpdir.join( "dp.txt" ) )
+        assert read_text( tmpdir.join( "c.txt" ) ) == read_text( tmpdir.join( "dc.txt" ) )
+
+#-------------------------------------------------------------------------------
+# several outputs in one run
+#-------------------------------------------------------------------------------
+
+@pytest.mark.parametrize( "backend", ["dict", "matrix"] )
+def test_outputs_match_separate_runs( tmpdir, backend ):
+    if backend == "matrix":
+        pytest.importorskip( "numpy" )
+    clusters, sizes, files = make_job( tmpdir )
+    outputs = []
+    for stat in ( "median", "mean" ):
+        for norm in ( "raw", "sum", "genome" ):
+            outputs += ["--output", stat, norm, tmpdir.join( "p_%s_%s.txt" % ( stat, norm ) ), tmpdir.join( "c_%s_%s.txt" % ( stat, norm ) )]
+    run_merge( *( ["-c", clusters, "-g", sizes, "--backend", backend, "--median-files"] + files["median"] +
+                  ["--mean-files"] + files["mean"] + outputs ) )
+    for stat in ( "median", "mean" ):
+        for norm, flags in ( ( "raw", [] ), ( "sum", ["-n"] ), ( "genome", ["-g", sizes] ) ):
+            run_merge( *( ["-c", clusters, "--backend", "dict", "-p", tmpdir.join( "p.txt" ), "-C", tmpdir.join( "c.txt" )] +
+                          flags + files[stat] ) )
+            assert read_text( tmpdir.join( "p_%s_%s.txt" % ( stat, norm ) ) ) == read_text( tmpdir.join( "p.txt" ) )
+            assert read_text( tmpdir.join( "c_%s_%s.txt" % ( stat, norm ) ) ) == read_text( tmpdir.join( "c.txt" ) )
+
+@pytest.mark.parametrize( "legacy", [["-p", "p.txt"], ["-C", "c.txt"]], ids=["protein", "cluster"] )
+def test_output_with_legacy_paths( tmpdir, legacy ):
+    clusters, sizes, files = make_job( tmpdir, samples=2 )
+    command = [sys.executable, c_script, "-c", clusters, "--median-files"] + files["median"] + \
+        ["--output", "median", "raw", str( tmpdir.join( "p_raw.txt" ) ), str( tmpdir.join( "c_raw.txt" ) )] + legacy
+    proc = subprocess.Popen( command, cwd=str( tmpdir ), stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+    out, err = proc.communicate( )
+    assert proc.returncode == 2
+    assert b"-p and -C cannot be used with it" in err
+    assert not tmpdir.join( "p_raw.txt" ).exists( )
+
+#-------------------------------------------------------------------------------
+# store
+#-------------------------------------------------------------------------------
+
+def test_store_adds_samples( tmpdir ):
+    pytest.importorskip( "numpy" )
+    clusters, sizes, files = make_job( tmpdir )
+    paths = files["median"]
+    store = tmpdir.join( "store" )
+    run_merge( *( ["-c", clusters, "--store", store, "-p", tmpdir.join( "p1.txt" ), "-C", tmpdir.join( "c1.txt" )] + paths[:3] ) )
+    # a new version of a stored sample replaces it
+    replaced = write_sample( tmpdir.mkdir( "rerun" ).join( os.path.basename( paths[0] ) ), [( "A0A0000001", 5.0 ), ( "NEW1", 1.0 )] )
+    run_merge( *( ["-c", clusters, "--store", store, "-g", sizes, "-n", "-p", tmpdir.join( "p.txt" ), "-C", tmpdir.join( "c.txt" )] +
+                  paths[3:] + [replaced] ) )
+    run_merge( *( ["-c", clusters, "--backend", "dict", "-g", sizes, "-n", "-p", tmpdir.join( "dp.txt" ), "-C", tmpdir.join( "dc.txt" ),
+                   replaced] + paths[1:] ) )
+    assert read_text( tmpdir.join( "p.txt" ) ) == read_text( tmpdir.join( "dp.txt" ) )
+    assert read_text( tmpdir.join( "c.txt" ) ) == read_text( tmpdir.join( "dc.txt" ) )
+
+#-------------------------------------------------------------------------------
+# sparse tables
+#-------------------------------------------------------------------------------
+
+@pytest.mark.parametrize( "backend", ["dict", "matrix"] )
+@pytest.mark.parametrize( "sparse", ["txt", "gz"] )
+def test_sparse_matches_dense( tmpdir, backend, sparse ):
+    if backend == "matrix":
+        pytest.importorskip( "numpy" )
+    clusters, sizes, files = make_job( tmpdir )
+    run_merge( *( ["-c", clusters, "-n", "--backend", backend, "--sparse", sparse,
+                   "-p", tmpdir.join( "p.txt" ), "-C", tmpdir.join( "c.txt" )] + files["median"] ) )
+    for name in ( "p", "c" ):
+        samples, rows = read_table( tmpdir.join( name + ".txt" ) )
+        expected = ["Feature\tSample\tValue"]
+        for feature, values in rows:
+            expected += ["%s\t%s\t%.6g" % ( feature, s, v ) for s, v in zip( samples, values ) if v != 0]
+        path = str( tmpdir.join( name + ".sparse.txt" ) )
+        if sparse == "gz":
+            with gzip.open( path + ".gz", "rt" ) as fh:
+                text = fh.read( )
+        else:
+            text = read_text( path )
+        assert text.splitlines( ) == expected
+
+#-------------------------------------------------------------------------------
+# hdf5 export
+#-------------------------------------------------------------------------------
+
+def test_hdf5_matches_dense( tmpdir ):
+    np = pytest.importorskip( "numpy" )
+    h5py = pytest.importorskip( "h5py" )
+    clusters, sizes, files = make_job( tmpdir )
+    run_merge( *( ["-c", clusters, "-g", sizes, "--hdf5", "-p", tmpdir.join( "p.txt" ), "-C", tmpdir.join( "c.txt" )] + files["median"] ) )
+    for name in ( "p", "c" ):
+        samples, rows = read_table( tmpdir.join( name + ".txt" ) )
+        with h5py.File( str( tmpdir.join( name + ".h5" ) ), "r" ) as hdf:
+            assert [s.decode( ) for s in hdf["samples"][...]] == samples
+            assert [f.decode( ) for f in hdf["features"][...]] == [feature for feature, values in rows]
+            assert np.allclose( hdf["values"][...], np.array( [values for feature, values in rows] ), rtol=1e-5, atol=0 )
@@ -0,0 +1,321 @@
+""" tests of the ShortBRED quantify helpers in sbin/efi_cgfp/shortbred_20180817/src, run with python -m pytest test/python """
+
+from __future__ import print_function
+
+import gzip
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+
+import pytest
+
+from scripts import script_path
+
+pytest.importorskip('Bio')
+from Bio import SeqIO
+
+sys.path.insert(0, script_path('sbin/efi_cgfp/shortbred_20180817'))
+import src.quantify_functions as sq
+
+BLOCK_SIZES = [1, 2, 3, 5, 64, 1 << 24]
+
+
+def write_file(path, data):
+    with open(str(path), 'wb') as out:
+        out.write(data)
+    return str(path)
+
+
+def seqio_lengths(path, strFormat):
+    """ read lengths the way shortbred_quantify.py counted them before ScanReadStats """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as fileIn:
+        return [len(seq) for seq in SeqIO.parse(fileIn, strFormat)]
+
+
+def assert_stats(statsWGS, aiLengths):
+    assert statsWGS.iReads == len(aiLengths)
+    assert statsWGS.iBases == sum(aiLengths)
+    assert statsWGS.iMin == (min(aiLengths) if aiLengths else None)
+    assert statsWGS.iMax == max(aiLengths + [0])
+    assert dict(statsWGS.dictHistogram) == dict((i, aiLengths.count(i)) for i in set(aiLengths))
+
+
+def write_markers(path, iFamilies=8, iSeed=1):
+    """ a marker fasta with TM, JM and QM markers, the QMs shared with the next family """
+    rng = random.Random(iSeed)
+    astrLines = []
+    for iFam in range(iFamilies):
+        for iMarker, strType in enumerate(['TM', 'TM', 'JM', 'QM'][:rng.randint(1, 4)]):
+            strID = 'FAM%d_%s%02d_#%02d' % (iFam, strType, iMarker + 1, iMarker + 1)
+            if strType == 'QM':
+                strID += '__[FAM%d_w=%.3f,FAM%d_w=%.3f]' % (iFam, rng.uniform(0.3, 0.9), (iFam + 1) % iFamilies, rng.uniform(0.01, 0.3))
+            astrLines += ['>' + strID, ('ACDEFGHIKLMNPQRSTVWY' * 10)[:rng.randint(10, 200)]]
+    return write_file(path, ('\n'.join(astrLines) + '\n').encode())
+
+
+def write_hits(path, astrMarkers, iHits=3000, iSeed=1):
+    """ tabular search output of reads against the markers """
+    rng = random.Random(iSeed)
+    astrLines = []
+    for iHit in range(iHits):
+        iReadLen = 0 if rng.random() < 0.02 else rng.randint(30, 150)
+        astrLines.append('\t'.join(['read%d' % iHit, rng.choice(astrMarkers), '%.1f' % rng.uniform(80, 100),
+                                    str(rng.randint(5, 60)), str(iReadLen)] + ['0'] * 7))
+    return write_file(path, ('\n'.join(astrLines) + '\n').encode())
+
+
+def reference_hit_counts(strSearchOut, dictMarkerLen, dID, strCentCheck, dAlnLength, iMinReadBP, iAlnCentroids=30):
+    """ hits and counts per marker id and the valid hit lines, as the original dict based StoreHitCounts found them """
+    dictHits = {}
+    dictCounts = dict((strMarker, 0) for strMarker in dictMarkerLen)
+    astrValid = []
+    with open(strSearchOut) as fileSearch:
+        for strLine in fileSearch:
+            aLine = strLine.rstrip('\n').split('\t')
+            RLen = int(aLine[4])
+            if RLen == 0:
+                continue
+            if strCentCheck == 'Y':
+                if int(aLine[3]) >= iAlnCentroids and float(aLine[2]) / 100 >= dID:
+                    dictHits[aLine[1]] = dictHits.get(aLine[1], 0) + 1
+                    astrValid.append(strLine)
+                continue
+            iAlnMin = min(dictMarkerLen[aLine[1]], math.floor(RLen * dAlnLength / 3))
+            if int(aLine[3]) >= iAlnMin and RLen >= iMinReadBP and float(aLine[2]) / 100 >= dID:
+                iMarkerNucs = dictMarkerLen[aLine[1]] * 3
+                dPctAdditionalTargetSeq = ((1.0 - dAlnLength) * 2.0) * RLen
+                if iMarkerNucs > (RLen * dAlnLength):
+                    iPossibleHitSpace = iMarkerNucs + dPctAdditionalTargetSeq - RLen + 1
+                else:
+                    iPossibleHitSpace = RLen - iMarkerNucs - 1
+                dictHits[aLine[1]] = dictHits.get(aLine[1], 0) + 1
+                dictCounts[aLine[1]] += float(1 / iPossibleHitSpace)
+                astrValid.append(strLine)
+    return dictHits, dictCounts, astrValid
+
+
+#-------------------------------------------------------------------------------
+# ScanReadStats
+#-------------------------------------------------------------------------------
+
+FASTA_CASES = [
+    b'',
+    b'\n',
+    b'junk\n',
+    b'junk\n>a\nAC\n',
+    b'x>a\nAA\n>b\nC\n',
+    b'pre\nam\nble\n>r1 desc\nACGT\nAC\n>r2\nA\n',
+    b'>a\nAC\n>b\n\n>c\nA C\r\nGG',
+    b'\n\n>x\n>y\nAAA\n',
+    b'>only a header',
+]
+
+
+@pytest.mark.parametrize('data', FASTA_CASES)
+@pytest.mark.parametrize('iBlock', BLOCK_SIZES)
+def test_fasta_matches_seqio(tmpdir, data, iBlock):
+    path = write_file(tmpdir.join('reads.fa'), data)
+    assert_stats(sq.ScanReadStats(path, iBlock), seqio_lengths(path, 'fasta'))
+
+
+@pytest.mark.parametrize('iBlock', [7, 4096, 1 << 24])
+def test_wrapped_reads_match_seqio(tmpdir, iBlock):
+    aiLengths = [(i * 37) % 301 for i in range(2000)]
+    abData = b''.join(b'>r%d some description\n' % i +
+                      b'\n'.join(b'ACGT' * 15 for j in range(n // 60)) + b'\n' + b'A' * (n % 60) + b'\n'
+                      for i, n in enumerate(aiLengths))
+    path = write_file(tmpdir.join('reads.fa'), b'\n' + abData)
+    assert_stats(sq.ScanReadStats(path, iBlock), seqio_lengths(path, 'fasta'))
+    pathGz = str(tmpdir.join('reads.fa.gz'))
+    with gzip.open(pathGz, 'wb') as out:
+        out.write(abData)
+    assert_stats(sq.ScanReadStats(pathGz, iBlock), seqio_lengths(pathGz, 'fasta'))
+
+
+def test_fastq_matches_seqio(tmpdir):
+    aiLengths = [(i * 13) % 151 for i in range(1000)]
+    path = write_file(tmpdir.join('reads.fastq'), b''.join(b'@r%d\n%s\n+\n%s\n' % (i, b'A' * n, b'I' * n) for i, n in enumerate(aiLengths)))
+    assert_stats(sq.ScanReadStats(path), seqio_lengths(path, 'fastq'))
+
+
+#-------------------------------------------------------------------------------
+# ReadStats
+#-------------------------------------------------------------------------------
+
+def test_merge():
+    statsAll = sq.ReadStats()
+    statsAll.Merge(sq.ReadStats())
+    for aiLengths in ([5, 3, 9], [], [1, 9]):
+        statsPart = sq.ReadStats()
+        statsPart.Add(aiLengths)
+        statsAll.Merge(statsPart)
+    assert_stats(statsAll, [5, 3, 9, 1, 9])
+    assert statsAll.Average() == 27 / 5.0
+
+
+def test_sidecar(tmpdir):
+    path = write_file(tmpdir.join('reads.fa'), b'>a\nACGT\n>b\nAC\n')
+    statsFirst = sq.ReadStatsScanner(path).Result()
+    scanSecond = sq.ReadStatsScanner(path)
+    assert scanSecond.threadScan is None
+    assert_stats(scanSecond.Result(), [4, 2])
+    assert scanSecond.Result().dictHistogram == statsFirst.dictHistogram
+    # a changed file is scanned again
+    write_file(path, b'>a\nACGTACGT\n')
+    assert_stats(sq.ReadStatsScanner(path).Result(), [8])
+
+
+def test_scan_errors_reach_the_caller(tmpdir):
+    with pytest.raises(IOError):
+        sq.ReadStatsScanner(str(tmpdir.join('missing.fa'))).Result()
+
+
+#-------------------------------------------------------------------------------
+# marker database cache
+#-------------------------------------------------------------------------------
+
+def test_program_version_without_a_version_command(tmpdir):
+    # rapsearch2 has no version option, so the executable itself stands in for it
+    strVersion = sq.ProgramVersion('rapsearch2', sys.executable)
+    assert len(strVersion) == 12
+    assert strVersion == sq.ProgramVersion('rapsearch2', sys.executable)
+    assert sq.ProgramVersion('rapsearch2', str(tmpdir.join('missing'))) == 'unknown'
+
+
+#-------------------------------------------------------------------------------
+# streamed search output
+#-------------------------------------------------------------------------------
+
+def store_hit_counts(objSearchOut, strValidHits, catMarkers, strSearchCopy=''):
+    aiHits = [0] * len(catMarkers)
+    adCounts = [0] * len(catMarkers)
+    sq.StoreHitCounts(objSearchOut, strValidHits, catMarkers, aiHits, adCounts, 0.9, 'N', 0.95, 90, 30, 'rapsearch2',
+                      strSearchCopy=strSearchCopy)
+    return aiHits, adCounts
+
+
+def test_streamed_search_matches_file(tmpdir):
+    catMarkers = sq.MarkerCatalog.FromFasta(write_markers(tmpdir.join('markers.faa')))
+    strSearchOut = write_hits(tmpdir.join('search.out'), catMarkers.astrMarkers)
+    # rapsearch2 output starts with comment lines
+    with open(strSearchOut) as fileIn:
+        strText = '# RAPSearch2\n' + fileIn.read()
+    write_file(strSearchOut, strText.encode())
+    tupFile = store_hit_counts(strSearchOut, str(tmpdir.join('file.hits')), catMarkers)
+    pSearch = sq.StreamSearch([sys.executable, '-c', 'import sys; sys.stdout.write(open(sys.argv[1]).read())', strSearchOut])
+    tupStream = store_hit_counts(pSearch, str(tmpdir.join('stream.hits')), catMarkers, str(tmpdir.join('copy.out')))
+    assert tupStream == tupFile
+    assert sum(tupFile[0]) > 0
+    assert tmpdir.join('stream.hits').read() == tmpdir.join('file.hits').read()
+    assert tmpdir.join('copy.out').read() == strText
+
+
+def test_failed_search_reaches_the_caller(tmpdir):
+    catMarkers = sq.MarkerCatalog.FromFasta(write_markers(tmpdir.join('markers.faa')))
+    pSearch = sq.StreamSearch([sys.executable, '-c', 'import sys; sys.exit(2)'])
+    with pytest.raises(subprocess.CalledProcessError):
+        store_hit_counts(pSearch, str(tmpdir.join('stream.hits')), catMarkers)
+
+
+#-------------------------------------------------------------------------------
+# marker catalog
+#-------------------------------------------------------------------------------
+
+def test_catalog_matches_marker_ids(tmpdir):
+    strMarkers = write_markers(tmpdir.join('markers.faa'))
+    catMarkers = sq.MarkerCatalog.FromFasta(strMarkers)
+    catMarkers.SetQMOverlap(90, 0.95)
+    astrQMs = []
+    for iMarker, seq in enumerate(SeqIO.parse(strMarkers, 'fasta')):
+        mtchStub = re.search(r'(.*)_([TJQ]M)[0-9]*_\#([0-9]*)', seq.id)
+        assert catMarkers.astrMarkers[iMarker] == seq.id
+        assert catMarkers.dictIndex[seq.id] == iMarker
+        assert catMarkers.astrFamily[iMarker] == mtchStub.group(1)
+        assert catMarkers.astrType[iMarker] == mtchStub.group(2)
+        assert catMarkers.aiLength[iMarker] == len(seq)
+        if mtchStub.group(2) != 'QM':
+            continue
+        astrQMs.append(seq.id)
+        # the families kept for each QM, worked out the way shortbred_quantify.py did
+        astrFams = []
+        for strFam in re.search(r'\__\[(.*)\]', seq.id).group(1).split(','):
+            mtchFam = re.search(r'(.*)_w=(.*)', strFam)
+            strID, dProp = mtchFam.group(1), float(mtchFam.group(2))
+            if strID == mtchStub.group(1):
+                dMainFamProp = dProp
+            if (dProp / dMainFamProp) * len(seq) >= 90 / 3 or (dProp / dMainFamProp) >= 0.95:
+                astrFams.append(strID)
+        assert catMarkers.aastrQMOverlap[iMarker] == astrFams
+    assert astrQMs
+
+
+def test_catalog_is_saved_and_rebuilt(tmpdir):
+    strMarkers = write_markers(tmpdir.join('markers.faa'))
+    catFirst = sq.GetMarkerCatalog(strMarkers)
+    assert os.path.exists(strMarkers + '.catalog')
+    catSaved = sq.MarkerCatalog.Load(strMarkers + '.catalog')
+    for strField in ('astrMarkers', 'astrFamily', 'astrType', 'aiLength', 'dictQMWeights', 'bCentroids', 'strChecksum'):
+        assert getattr(catSaved, strField) == getattr(catFirst, strField), strField
+    assert sq.GetMarkerCatalog(strMarkers).astrMarkers == catFirst.astrMarkers
+    # new markers or a different mode build a new catalog
+    write_markers(strMarkers, iFamilies=3, iSeed=2)
+    assert sq.GetMarkerCatalog(strMarkers).astrMarkers == [seq.id for seq in SeqIO.parse(strMarkers, 'fasta')]
+    catCentroids = sq.GetMarkerCatalog(strMarkers, bCentroids=True)
+    assert catCentroids.bCentroids and catCentroids.astrType == [None] * len(catCentroids)
+
+
+@pytest.mark.parametrize('strCentCheck', ['N', 'Y'], ids=['markers', 'centroids'])
+def test_hit_counts_match_marker_ids(tmpdir, strCentCheck):
+    strMarkers = write_markers(tmpdir.join('markers.faa'))
+    catMarkers = sq.MarkerCatalog.FromFasta(strMarkers, bCentroids=(strCentCheck == 'Y'))
+    strSearchOut = write_hits(tmpdir.join('search.out'), catMarkers.astrMarkers)
+    aiHits = [0] * len(catMarkers)
+    adCounts = [0] * len(catMarkers)
+    sq.StoreHitCounts(strSearchOut, str(tmpdir.join('valid.hits')), catMarkers, aiHits, adCounts, 0.9, strCentCheck, 0.95, 90, 30, 'rapsearch2')
+    dictHits, dictCounts, astrValid = reference_hit_counts(strSearchOut, dict(zip(catMarkers.astrMarkers, catMarkers.aiLength)),
+                                                           0.9, strCentCheck, 0.95, 90)
+    assert aiHits == [dictHits.get(strMarker, 0) for strMarker in catMarkers.astrMarkers]
+    assert adCounts == [dictCounts[strMarker] for strMarker in catMarkers.astrMarkers]
+    assert sum(aiHits) > 0
+    with open(str(tmpdir.join('valid.hits'))) as fileHits:
+        assert fileHits.read().splitlines() == [strLine.rstrip('\n') for strLine in astrValid]
+
+
+#-------------------------------------------------------------------------------
+# fasta chunks
+#-------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('iInFlight', [0, 2])
+@pytest.mark.parametrize('strFormat', ['fasta', 'fastq'])
+def test_chunks_hold_every_read(tmpdir, iInFlight, strFormat):
+    aiLengths = [(i * 37) % 301 + 1 for i in range(1000)]
+    if strFormat == 'fasta':
+        abData = b''.join(b'>r%d\n%s\n' % (i, b'A' * n) for i, n in enumerate(aiLengths))
+    else:
+        abData = b''.join(b'@r%d\n%s\n+\n%s\n' % (i, b'A' * n, b'I' * n) for i, n in enumerate(aiLengths))
+    strWGS = write_file(tmpdir.join('reads.' + strFormat), abData)
+    with open(strWGS) as streamWGS:
+        chunker = sq.FastaChunker(streamWGS, strFormat, str(tmpdir.join('chunk')), 150, iMaxReadLength=280)
+        astrChunks = list(chunker.Chunks(iInFlight))
+    aiKept = [n for n in aiLengths if n < 280]
+    assert len(astrChunks) == int(math.ceil(len(aiKept) / 150.0))
+    aaiChunks = [[len(seq) for seq in SeqIO.parse(strChunk, 'fasta')] for strChunk in astrChunks]
+    assert all(len(aiChunk) == 150 for aiChunk in aaiChunks[:-1])
+    assert sum(aaiChunks, []) == aiKept
+    assert_stats(chunker.statsReads, aiKept)
+
+
+def test_chunks_written_ahead_are_removed(tmpdir):
+    strWGS = write_file(tmpdir.join('reads.fa'), b''.join(b'>r%d\nACGT\n' % i for i in range(2000)))
+    with open(strWGS) as streamWGS:
+        chunker = sq.FastaChunker(streamWGS, 'fasta', str(tmpdir.join('chunk')), 100)
+        genChunks = chunker.Chunks(3)
+        strFirst = next(genChunks)
+        # a search that fails stops the chunker
+        genChunks.close()
+    assert sorted(os.listdir(str(tmpdir))) == ['chunk_01.fna', 'reads.fa']
+    assert os.path.basename(strFirst) == 'chunk_01.fna'